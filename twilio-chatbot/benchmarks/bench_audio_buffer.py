@@ -0,0 +1,82 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Compares the old `bytes +=` / slice buffering in the websocket output
+# transport with AudioRingBuffer. Reports bytes copied per second of speech.
+#
+#   python benchmarks/bench_audio_buffer.py
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_services.ring_buffer import AudioRingBuffer  # noqa: E402
+
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+FRAME_SIZE = 6400
+SPEECH_SECONDS = 30
+
+
+def make_chunks(chunk_ms: int) -> list[bytes]:
+    rng = random.Random(0)
+    total = SPEECH_SECONDS * BYTES_PER_SECOND
+    mean = BYTES_PER_SECOND * chunk_ms // 1000
+    chunks = []
+    while total > 0:
+        size = min(total, max(2, int(rng.uniform(0.5, 1.5) * mean)) & ~1)
+        chunks.append(bytes(size))
+        total -= size
+    return chunks
+
+
+def run_legacy(chunks: list[bytes]) -> int:
+    copied = 0
+    buffer = bytes()
+    for chunk in chunks:
+        buffer += chunk
+        copied += len(buffer)
+        while len(buffer) >= FRAME_SIZE:
+            frame = buffer[:FRAME_SIZE]
+            copied += len(frame)
+            buffer = buffer[FRAME_SIZE:]
+            copied += len(buffer)
+    return copied
+
+
+def run_ring(chunks: list[bytes]) -> int:
+    buffer = AudioRingBuffer(FRAME_SIZE)
+    for chunk in chunks:
+        buffer.write(chunk)
+        while buffer.read_frame() is not None:
+            pass
+    return buffer.bytes_copied
+
+
+def measure(fn, chunks: list[bytes]) -> tuple[int, float]:
+    start = time.perf_counter()
+    copied = fn(chunks)
+    return copied, time.perf_counter() - start
+
+
+def main():
+    print(f"{SPEECH_SECONDS}s of 16kHz speech, {FRAME_SIZE} byte frames")
+    print(f"{'chunk':>8} {'legacy MB/s':>12} {'ring MB/s':>10} {'legacy ms':>10} {'ring ms':>8}")
+    for chunk_ms in (20, 100, 500, 2000, 10000):
+        chunks = make_chunks(chunk_ms)
+        legacy_copied, legacy_time = measure(run_legacy, chunks)
+        ring_copied, ring_time = measure(run_ring, chunks)
+        print(
+            f"{chunk_ms:>6}ms "
+            f"{legacy_copied / SPEECH_SECONDS / 1e6:>12.3f} "
+            f"{ring_copied / SPEECH_SECONDS / 1e6:>10.3f} "
+            f"{legacy_time * 1000:>10.2f} "
+            f"{ring_time * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
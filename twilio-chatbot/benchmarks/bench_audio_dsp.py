@@ -0,0 +1,77 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Measures the Twilio media path transcoding cost per call: 50 inbound
+# μ-law 8kHz frames and 50 outbound 16kHz PCM frames per second. Compares
+# audioop (what pipecat's serializer uses) with custom_services.audio_dsp and
+# reports how many calls a single core could transcode in real time.
+#
+#   python benchmarks/bench_audio_dsp.py
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_services.audio_dsp import UlawDecoder, UlawEncoder  # noqa: E402
+
+try:
+    import audioop
+except ModuleNotFoundError:
+    audioop = None
+
+SAMPLE_RATE = 16000
+FRAMES_PER_SECOND = 50
+SECONDS = 20
+
+
+def make_frames() -> tuple[list[bytes], list[bytes]]:
+    rng = np.random.default_rng(0)
+    inbound = [rng.integers(0, 256, 160, dtype=np.uint8).tobytes()
+               for _ in range(FRAMES_PER_SECOND * SECONDS)]
+    outbound = [(rng.standard_normal(SAMPLE_RATE // FRAMES_PER_SECOND) * 3000).astype(np.int16).tobytes()
+                for _ in range(FRAMES_PER_SECOND * SECONDS)]
+    return inbound, outbound
+
+
+def run_audioop(inbound: list[bytes], outbound: list[bytes]):
+    in_state = None
+    out_state = None
+    for ulaw, pcm in zip(inbound, outbound):
+        decoded = audioop.ulaw2lin(ulaw, 2)
+        decoded, in_state = audioop.ratecv(decoded, 2, 1, 8000, SAMPLE_RATE, in_state)
+        resampled, out_state = audioop.ratecv(pcm, 2, 1, SAMPLE_RATE, 8000, out_state)
+        audioop.lin2ulaw(resampled, 2)
+
+
+def run_audio_dsp(inbound: list[bytes], outbound: list[bytes]):
+    decoder = UlawDecoder(SAMPLE_RATE)
+    encoder = UlawEncoder(SAMPLE_RATE)
+    for ulaw, pcm in zip(inbound, outbound):
+        decoder.decode(ulaw)
+        encoder.encode(pcm)
+
+
+def report(name: str, fn, inbound: list[bytes], outbound: list[bytes]):
+    start = time.process_time()
+    fn(inbound, outbound)
+    elapsed = time.process_time() - start
+    cpu_per_call = elapsed / SECONDS
+    print(f"{name:>10}: {cpu_per_call * 1000:8.3f}ms CPU per call-second, "
+          f"{1 / cpu_per_call:10.0f} calls per core")
+
+
+def main():
+    inbound, outbound = make_frames()
+    print(f"{SECONDS}s of audio, {FRAMES_PER_SECOND} frames/s in each direction")
+    if audioop:
+        report("audioop", run_audioop, inbound, outbound)
+    report("audio_dsp", run_audio_dsp, inbound, outbound)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Measures the JSON/base64 cost of one call's media traffic: 50 Twilio media
+# events in, 50 Twilio media messages out and 50 Cartesia audio chunks per
+# second. Compares the json/base64 modules with custom_services.codec (which
+# uses orjson when it is installed).
+#
+#   python benchmarks/bench_codec.py
+
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_services.codec import JSON_BACKEND, b64decode, b64encode, json_dumps, json_loads  # noqa: E402
+
+FRAMES_PER_SECOND = 50
+SECONDS = 20
+STREAM_SID = "MZ18ad3ab5a668481ce02b83e7395059f0"
+
+
+def make_messages() -> tuple[list[str], list[bytes], list[str]]:
+    inbound = []
+    outbound = []
+    chunks = []
+    for i in range(FRAMES_PER_SECOND * SECONDS):
+        ulaw = os.urandom(160)
+        inbound.append(json.dumps({
+            "event": "media",
+            "sequenceNumber": str(i + 2),
+            "media": {
+                "track": "inbound",
+                "chunk": str(i + 1),
+                "timestamp": str(i * 20),
+                "payload": base64.b64encode(ulaw).decode("utf-8"),
+            },
+            "streamSid": STREAM_SID,
+        }))
+        outbound.append(os.urandom(160))
+        chunks.append(json.dumps({
+            "type": "chunk",
+            "context_id": "0b7f1a8e-8c1e-4b55-9d0a-3f4c7a1e2d6b",
+            "status_code": 206,
+            "done": False,
+            "data": base64.b64encode(os.urandom(160)).decode("utf-8"),
+            "step_time": 12.5,
+        }))
+    return inbound, outbound, chunks
+
+
+def run_stdlib(inbound: list[str], outbound: list[bytes], chunks: list[str]):
+    for message, ulaw, chunk in zip(inbound, outbound, chunks):
+        base64.b64decode(json.loads(message)["media"]["payload"])
+        json.dumps({
+            "event": "media",
+            "streamSid": STREAM_SID,
+            "media": {"payload": base64.b64encode(ulaw).decode("utf-8")},
+        })
+        base64.b64decode(json.loads(chunk)["data"])
+
+
+def run_codec(inbound: list[str], outbound: list[bytes], chunks: list[str]):
+    # Same prebuilt message as TwilioFrameSerializer.
+    prefix = f'{{"event":"media","streamSid":{json_dumps(STREAM_SID)},"media":{{"payload":"'
+    suffix = '"}}'
+    for message, ulaw, chunk in zip(inbound, outbound, chunks):
+        b64decode(json_loads(message)["media"]["payload"])
+        prefix + b64encode(ulaw) + suffix
+        b64decode(json_loads(chunk)["data"])
+
+
+def report(name: str, fn, *messages):
+    start = time.process_time()
+    for _ in range(5):
+        fn(*messages)
+    elapsed = (time.process_time() - start) / 5
+    cpu_per_call = elapsed / SECONDS
+    print(f"{name:>14}: {cpu_per_call * 1000:8.3f}ms CPU per call-second, "
+          f"{1 / cpu_per_call:10.0f} calls per core")
+
+
+def main():
+    messages = make_messages()
+    print(f"{SECONDS}s of audio, {FRAMES_PER_SECOND} frames/s in each direction")
+    report("json/base64", run_stdlib, *messages)
+    report(f"codec ({JSON_BACKEND})", run_codec, *messages)
+
+
+if __name__ == "__main__":
+    main()
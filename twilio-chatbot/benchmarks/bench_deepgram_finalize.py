@@ -0,0 +1,88 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Stop-speaking to LLM-request latency with and without sending Deepgram a
+# Finalize when the VAD detects the end of speech. A stub stands in for
+# Deepgram's live endpoint:
+#
+#   - it finalizes after `endpointing` ms of silence, but line noise (any
+#     silent frame is noisy with probability NOISE) restarts the count, as
+#     happens on phone calls
+#   - it finalizes immediately when it receives Finalize
+#   - results take PROCESSING_MS to come back
+#
+# The caller speaks for a few seconds and then goes silent. Silero reports
+# the end of speech VAD_STOP_MS later. The user aggregator asks the LLM
+# once it has both the end of speech and the final transcript.
+#
+#   python benchmarks/bench_deepgram_finalize.py
+
+import random
+
+FRAME_MS = 20
+VAD_STOP_MS = 800
+PROCESSING_MS = 60
+NOISE = 0.03
+UTTERANCES = 500
+
+
+class DeepgramStub:
+
+    def __init__(self, endpointing: int, rng: random.Random):
+        self._endpointing = endpointing
+        self._rng = rng
+        self._silence_ms = 0
+        self._pending = False
+        self.final_at = None
+
+    def send_audio(self, now: int, speech: bool):
+        if self.final_at is not None:
+            return
+        if speech:
+            self._pending = True
+            self._silence_ms = 0
+            return
+        self._silence_ms = 0 if self._rng.random() < NOISE else self._silence_ms + FRAME_MS
+        if self._pending and self._silence_ms >= self._endpointing:
+            self.final_at = now + PROCESSING_MS
+
+    def finalize(self, now: int):
+        if self.final_at is None and self._pending:
+            self.final_at = now + PROCESSING_MS
+
+
+def run(endpointing: int, finalize: bool, vad_gated: bool, rng: random.Random) -> int:
+    stub = DeepgramStub(endpointing, rng)
+    speech_ms = rng.randrange(1000, 4000, FRAME_MS)
+    vad_stop = speech_ms + VAD_STOP_MS
+    now = 0
+    # Keep going until the final arrives (or give up after 10s: with VAD
+    # gating and no Finalize, Deepgram may never see enough silence).
+    while now < speech_ms + 10000:
+        if stub.final_at is not None and now >= vad_stop:
+            break
+        if now == vad_stop and finalize:
+            stub.finalize(now)
+        if now < vad_stop or not vad_gated:
+            stub.send_audio(now, now < speech_ms)
+        now += FRAME_MS
+    final_at = stub.final_at if stub.final_at is not None else now
+    return max(final_at, vad_stop) - vad_stop
+
+
+def main():
+    print(f"VAD stop after {VAD_STOP_MS}ms of silence, {NOISE:.0%} noisy silent frames, "
+          f"{PROCESSING_MS}ms processing, {UTTERANCES} utterances")
+    print(f"{'endpointing':>12} {'finalize':>9} {'gated':>6} {'mean':>8} {'p90':>8}")
+    for endpointing in (10, 300, 1000):
+        for finalize, vad_gated in ((False, False), (False, True), (True, False), (True, True)):
+            rng = random.Random(0)
+            latencies = sorted(run(endpointing, finalize, vad_gated, rng) for _ in range(UTTERANCES))
+            mean = sum(latencies) / len(latencies)
+            p90 = latencies[int(len(latencies) * 0.9)]
+            print(f"{endpointing:>10}ms {str(finalize):>9} {str(vad_gated):>6} {mean:>6.0f}ms {p90:>6.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Estimates LLM first token to first audio with sentence aggregation and with
+# the early first clause of custom_services.text_chunker. The LLM streams one
+# word per token at a fixed rate and the TTS starts playing a fixed time
+# after it gets the first chunk. CartesiaTTSService logs the real number
+# ("LLM first token to first audio") on every response.
+#
+#   python benchmarks/bench_text_chunker.py [tokens per second] [TTS TTFB ms]
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_services.text_chunker import TextChunker  # noqa: E402
+
+RESPONSES = [
+    "Hi, this is East Bay Dental Office, how may I help you today?",
+    "Sure, I can help you with that, are you a new or an existing patient?",
+    "Great, and could I get your phone number so I can pull up your file?",
+    "We're open next Monday from 8am to 5pm, so what time works best for you?",
+    "Okay. I have you down for Monday at 10am.",
+    "I'm sorry, I didn't quite catch that because there was some static on the line.",
+    "We accept Delta Dental and Anthem, but we can also talk about self-pay options.",
+]
+
+
+def first_chunk_tokens(chunker: TextChunker, response: str) -> int:
+    chunker.reset()
+    text = ""
+    tokens = re.findall(r"\s*\S+", response)
+    for i, token in enumerate(tokens, 1):
+        text += token
+        if chunker.split(text):
+            return i
+    # Flushed by the end of the response.
+    return len(tokens)
+
+
+def main():
+    tokens_per_second = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    ttfb = (float(sys.argv[2]) if len(sys.argv) > 2 else 150.0) / 1000
+
+    sentences = TextChunker(first_chunk_min_words=sys.maxsize)
+    clauses = TextChunker()
+
+    print(f"{tokens_per_second:.0f} tokens/s, TTS TTFB {ttfb * 1000:.0f}ms")
+    totals = [0.0, 0.0]
+    for response in RESPONSES:
+        latencies = []
+        for i, chunker in enumerate((sentences, clauses)):
+            # The first token arrives at t=0.
+            latency = (first_chunk_tokens(chunker, response) - 1) / tokens_per_second + ttfb
+            totals[i] += latency
+            latencies.append(latency)
+        print(f"{latencies[0] * 1000:6.0f}ms {latencies[1] * 1000:6.0f}ms  {response}")
+    print(f"mean: sentence {totals[0] / len(RESPONSES) * 1000:.0f}ms, "
+          f"first clause {totals[1] / len(RESPONSES) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
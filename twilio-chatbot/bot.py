@@ -8,6 +8,7 @@ from asyncio import TimeoutError
 import aiohttp
 from dotenv import load_dotenv
 from loguru import logger
+from deepgram import LiveOptions
 
 # Pipecat core imports
 from pipecat.frames.frames import EndFrame, LLMMessagesFrame
@@ -18,38 +19,58 @@ from pipecat.processors.aggregators.llm_response import (
     LLMAssistantResponseAggregator,
     LLMUserResponseAggregator
 )
-from pipecat.serializers.twilio import TwilioFrameSerializer
-from pipecat.transports.network.fastapi_websocket import FastAPIWebsocketTransport, FastAPIWebsocketParams
+# from pipecat.serializers.twilio import TwilioFrameSerializer
+# from pipecat.transports.network.fastapi_websocket import FastAPIWebsocketTransport, FastAPIWebsocketParams
 from pipecat.vad.silero import SileroVADAnalyzer
 
 # Custom service imports
 from custom_services.groq_service import GroqLLMService
 from custom_services.deepgram_service import DeepgramSTTService
 from custom_services.cartesia_service import CartesiaTTSService
+from custom_services.binary_serializer import BinaryFrameSerializer
+from custom_services.fastapi_websocket import FastAPIWebsocketTransport, FastAPIWebsocketParams
+from custom_services.twilio_serializer import TwilioFrameSerializer
+from custom_services.tts_cache import get_default_tts_cache
+from custom_services.speculative_turn import SpeculativeTurnProcessor
 
 # from pipecat.services.openai import OpenAILLMService
 # from pipecat.services.anthropic import AnthropicLLMService
 # from pipecat.services.deepgram import DeepgramSTTService
 # from pipecat.services.elevenlabs import ElevenLabsTTSService
 # from custom_services.eleven_labs_service import ElevenLabsTTSService
-# from custom_services.fastapi_websocket import FastAPIWebsocketTransport, FastAPIWebsocketParams
 
 load_dotenv(override=True)
 
 logger.remove(0)
 logger.add(sys.stderr, level="DEBUG")
 
-async def run_bot(websocket_client, stream_sid): 
+# Twilio streams 8kHz μ-law. Asking the STT and TTS services for that same
+# format avoids resampling and transcoding every frame in both directions.
+TWILIO_SAMPLE_RATE = 8000
+
+async def run_bot(websocket_client, stream_sid, binary=False): 
+    # Twilio sends JSON text messages. Our own clients (`binary=True`) use
+    # BinaryFrameSerializer, with the same 8kHz μ-law audio.
+    if binary:
+        serializer = BinaryFrameSerializer(sample_rate=TWILIO_SAMPLE_RATE)
+    else:
+        serializer = TwilioFrameSerializer(stream_sid, native_ulaw=True)
+
     async with aiohttp.ClientSession() as session:
         transport = FastAPIWebsocketTransport(
             websocket=websocket_client,
             params=FastAPIWebsocketParams(
+                audio_in_sample_rate=TWILIO_SAMPLE_RATE,
+                audio_in_block_ms=40,
                 audio_out_enabled=True,
+                audio_out_sample_rate=TWILIO_SAMPLE_RATE,
+                audio_out_ulaw=True,
                 add_wav_header=False,
                 vad_enabled=True,
-                vad_analyzer=SileroVADAnalyzer(),
+                vad_analyzer=SileroVADAnalyzer(sample_rate=TWILIO_SAMPLE_RATE),
                 vad_audio_passthrough=True,
-                serializer=TwilioFrameSerializer(stream_sid)
+                binary_mode=binary,
+                serializer=serializer
             )
         )
 
@@ -58,12 +79,28 @@ async def run_bot(websocket_client, stream_sid):
             model="llama-3.1-8b-instant"
         )
 
-        stt = DeepgramSTTService(api_key=os.getenv('DEEPGRAM_API_KEY'))
+        stt = DeepgramSTTService(
+            api_key=os.getenv('DEEPGRAM_API_KEY'),
+            live_options=LiveOptions(
+                encoding="mulaw",
+                language="en-US",
+                model="nova-2-phonecall",
+                sample_rate=TWILIO_SAMPLE_RATE,
+                channels=1,
+                interim_results=True,
+                smart_format=True,
+            ),
+            # Only stream the caller's speech (plus a pre-roll) to Deepgram.
+            vad_gated=True,
+        )
 
         tts = CartesiaTTSService(
             aiohttp_session=session,
             api_key=os.getenv('CARTESIA_API_KEY'),
             voice_id=os.getenv('CARTESIA_VOICE_ID'),
+            encoding="pcm_mulaw",
+            sample_rate=TWILIO_SAMPLE_RATE,
+            cache=get_default_tts_cache(),
         )
 
         # messages = [
@@ -124,10 +161,12 @@ async def run_bot(websocket_client, stream_sid):
 
         tma_in = LLMUserResponseAggregator(messages)
         tma_out = LLMAssistantResponseAggregator(messages)
+        speculation = SpeculativeTurnProcessor()
 
         pipeline = Pipeline([
             transport.input(),   # Websocket input from client
             stt,                 # Speech-To-Text
+            speculation,         # Speculative LLM responses
             tma_in,              # User responses
             llm,                 # LLM
             tts,                 # Text-To-Speech
@@ -0,0 +1,5 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Makes `custom_services` importable from the tests.
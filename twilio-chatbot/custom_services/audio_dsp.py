@@ -0,0 +1,142 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Audio DSP for the Twilio media path: table driven G.711 μ-law and a
+# streaming polyphase resampler. Everything works on 16-bit mono PCM.
+
+import math
+
+import numpy as np
+
+_ULAW_BIAS = 0x84
+_ULAW_CLIP = 8159
+
+
+def _build_ulaw_decode_table() -> np.ndarray:
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    t = (((u & 0x0F) << 3) + _ULAW_BIAS) << ((u & 0x70) >> 4)
+    return np.where(u & 0x80, _ULAW_BIAS - t, t - _ULAW_BIAS).astype(np.int16)
+
+
+def _build_ulaw_encode_table() -> np.ndarray:
+    # Indexed by the 16-bit sample reinterpreted as uint16. Same 14-bit
+    # quantization as audioop.lin2ulaw().
+    pcm = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(pcm), _ULAW_CLIP) + (_ULAW_BIAS >> 2)
+    segment = np.searchsorted((0x40 << np.arange(8)) - 1, magnitude)
+    ulaw = np.where(
+        segment < 8, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F), 0x7F)
+    return ((ulaw ^ mask) & 0xFF).astype(np.uint8)
+
+
+ULAW_DECODE_TABLE = _build_ulaw_decode_table()
+ULAW_ENCODE_TABLE = _build_ulaw_encode_table()
+
+
+def ulaw_decode(data: bytes) -> np.ndarray:
+    return ULAW_DECODE_TABLE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def ulaw_encode(samples: np.ndarray) -> bytes:
+    return ULAW_ENCODE_TABLE[samples.view(np.uint16)].tobytes()
+
+
+class Resampler:
+    """Streaming polyphase resampler for 16-bit mono audio.
+
+    The last few input samples are kept between calls, so a stream resampled
+    in chunks is identical to resampling it in one go (no clicks at chunk
+    boundaries). Use one instance per stream and direction.
+
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, taps_per_phase: int = 32):
+        g = math.gcd(in_rate, out_rate)
+        self._up = out_rate // g
+        self._down = in_rate // g
+        # When decimating the filter needs to be longer to keep the same
+        # transition band at the lower rate.
+        self._taps = -(-taps_per_phase * max(self._up, self._down) // self._up)
+
+        # Low-pass windowed sinc designed at the upsampled rate, split into
+        # one sub-filter per phase.
+        num_taps = self._up * self._taps
+        cutoff = 0.47 / max(self._up, self._down)
+        n = np.arange(num_taps) - (num_taps - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(num_taps, 8.0)
+        h *= self._up / h.sum()
+        self._phases = [np.ascontiguousarray(h[p::self._up], dtype=np.float32)
+                        for p in range(self._up)]
+
+        self.reset()
+
+    @property
+    def passthrough(self) -> bool:
+        return self._up == self._down
+
+    def reset(self):
+        self._history = np.zeros(self._taps - 1, dtype=np.float32)
+        self._in_count = 0
+        self._out_count = 0
+
+    def resample(self, samples: np.ndarray) -> np.ndarray:
+        if self.passthrough or len(samples) == 0:
+            return samples
+
+        x = np.concatenate((self._history, samples.astype(np.float32)))
+
+        in_end = self._in_count + len(samples)
+        out_end = -(-in_end * self._up // self._down)
+
+        # Each phase is a plain FIR over the input. Integer ratios (8k <->
+        # 16k) get a fast path, anything else gathers the output positions.
+        if self._down == 1:
+            # Every input sample produces one output per phase, in order.
+            y = np.stack([np.convolve(x, taps, "valid") for taps in self._phases], axis=1).ravel()
+        elif self._up == 1:
+            start = self._out_count * self._down - self._in_count
+            y = np.convolve(x, self._phases[0], "valid")[start::self._down]
+        else:
+            # Output sample j sits at input position j * down / up.
+            positions = np.arange(self._out_count, out_end, dtype=np.int64) * self._down
+            offsets = positions // self._up - self._in_count
+            phases = positions % self._up
+            y = np.empty(len(offsets), dtype=np.float32)
+            for p, taps in enumerate(self._phases):
+                mask = phases == p
+                y[mask] = np.convolve(x, taps, "valid")[offsets[mask]]
+
+        self._history = x[len(x) - (self._taps - 1):]
+        self._in_count = in_end
+        self._out_count = out_end
+
+        return np.clip(np.rint(y), -32768, 32767).astype(np.int16)
+
+
+class UlawDecoder:
+    """μ-law 8kHz (Twilio) to 16-bit PCM at `sample_rate`."""
+
+    def __init__(self, sample_rate: int):
+        self._resampler = Resampler(8000, sample_rate)
+
+    def reset(self):
+        self._resampler.reset()
+
+    def decode(self, data: bytes) -> bytes:
+        return self._resampler.resample(ulaw_decode(data)).tobytes()
+
+
+class UlawEncoder:
+    """16-bit PCM at `sample_rate` to μ-law 8kHz (Twilio)."""
+
+    def __init__(self, sample_rate: int):
+        self._resampler = Resampler(sample_rate, 8000)
+
+    def reset(self):
+        self._resampler.reset()
+
+    def encode(self, data: bytes) -> bytes:
+        samples = np.frombuffer(data, dtype=np.int16)
+        return ulaw_encode(self._resampler.resample(samples))
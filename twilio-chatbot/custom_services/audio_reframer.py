@@ -0,0 +1,58 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Regroups audio streamed over HTTP into frames of a fixed duration. The
+# pieces aiohttp hands out have arbitrary (often odd) lengths: iterating a
+# StreamReader splits on newlines, which raw PCM contains at random. That
+# gives tiny frames and 16-bit samples split between two frames.
+
+from typing import AsyncIterator
+
+
+class AudioReframer:
+
+    def __init__(self, frame_size: int, sample_width: int = 2):
+        # Frames are always a whole number of samples.
+        self._frame_size = max(frame_size - frame_size % sample_width, sample_width)
+        self._sample_width = sample_width
+        self._buffer = bytearray()
+
+    @property
+    def frame_size(self) -> int:
+        return self._frame_size
+
+    def push(self, data: bytes) -> list[bytes]:
+        """Adds `data` and returns the complete frames."""
+        self._buffer.extend(data)
+        frames = []
+        size = self._frame_size
+        end = len(self._buffer) - len(self._buffer) % size
+        if end:
+            frames = [bytes(self._buffer[i:i + size]) for i in range(0, end, size)]
+            del self._buffer[:end]
+        return frames
+
+    def flush(self) -> bytes:
+        """Returns what is left, without a trailing partial sample."""
+        end = len(self._buffer) - len(self._buffer) % self._sample_width
+        audio = bytes(self._buffer[:end])
+        self._buffer.clear()
+        return audio
+
+
+async def reframe_audio(
+        chunks: AsyncIterator[bytes],
+        frame_size: int,
+        sample_width: int = 2) -> AsyncIterator[bytes]:
+    """Yields `frame_size` byte frames (the last one may be shorter) from
+    `chunks`, e.g. `response.content.iter_chunked(4096)`.
+
+    """
+    reframer = AudioReframer(frame_size, sample_width)
+    async for chunk in chunks:
+        for frame in reframer.push(chunk):
+            yield frame
+    audio = reframer.flush()
+    if audio:
+        yield audio
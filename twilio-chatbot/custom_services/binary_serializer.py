@@ -0,0 +1,88 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Binary framing for our own clients (SIP gateway, browser). Audio travels as
+# raw bytes in binary websocket messages instead of base64 inside JSON.
+#
+# Every message starts with a 4 byte header:
+#
+#   type (uint8) | flags (uint8, reserved) | sequence number (uint16, BE)
+#
+# followed by the payload:
+#
+#   AUDIO_PCM16  16-bit little-endian mono PCM at the serializer sample rate
+#   AUDIO_ULAW   G.711 μ-law at 8kHz
+#   CLEAR        no payload, drop any buffered audio
+#   MARK         UTF-8 mark name, echoed back once the audio before it played
+
+import struct
+
+from pipecat.frames.frames import AudioRawFrame, Frame, StartInterruptionFrame
+from pipecat.serializers.base_serializer import FrameSerializer
+
+from custom_services.audio_dsp import ulaw_decode
+from custom_services.frames import (
+    PlayoutMarkFrame,
+    SequencedAudioRawFrame,
+    TelephonyAudioRawFrame,
+    UlawAudioRawFrame)
+
+AUDIO_PCM16 = 0x01
+AUDIO_ULAW = 0x02
+CLEAR = 0x10
+MARK = 0x11
+
+_HEADER = struct.Struct("!BBH")
+
+
+class BinaryFrameSerializer(FrameSerializer):
+    SERIALIZABLE_TYPES = {
+        AudioRawFrame: "audio",
+        StartInterruptionFrame: "clear",
+        PlayoutMarkFrame: "mark",
+    }
+
+    def __init__(self, sample_rate: int = 16000):
+        self._sample_rate = sample_rate
+        self._sequence_number = 0
+
+    def _header(self, message_type: int) -> bytes:
+        header = _HEADER.pack(message_type, 0, self._sequence_number)
+        self._sequence_number = (self._sequence_number + 1) & 0xFFFF
+        return header
+
+    def serialize(self, frame: Frame) -> str | bytes | None:
+        if isinstance(frame, UlawAudioRawFrame):
+            return b"".join((self._header(AUDIO_ULAW), frame.audio))
+        if isinstance(frame, AudioRawFrame):
+            return b"".join((self._header(AUDIO_PCM16), frame.audio))
+        if isinstance(frame, StartInterruptionFrame):
+            return self._header(CLEAR)
+        if isinstance(frame, PlayoutMarkFrame):
+            return self._header(MARK) + frame.mark.encode("utf-8")
+        return None
+
+    def deserialize(self, data: str | bytes) -> Frame | None:
+        if not isinstance(data, bytes) or len(data) < _HEADER.size:
+            return None
+
+        message_type, _, sequence_number = _HEADER.unpack_from(data)
+        payload = data[_HEADER.size:]
+
+        if message_type == AUDIO_PCM16:
+            return SequencedAudioRawFrame(
+                audio=payload,
+                sample_rate=self._sample_rate,
+                num_channels=1,
+                sequence_number=sequence_number)
+        elif message_type == AUDIO_ULAW:
+            return TelephonyAudioRawFrame(
+                audio=ulaw_decode(payload).tobytes(),
+                sample_rate=8000,
+                num_channels=1,
+                sequence_number=sequence_number,
+                ulaw=payload)
+        elif message_type == MARK:
+            return PlayoutMarkFrame(mark=payload.decode("utf-8"))
+        return None
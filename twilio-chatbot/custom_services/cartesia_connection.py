@@ -0,0 +1,249 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Process-wide pool of Cartesia websockets. Cartesia multiplexes requests by
+# `context_id`, so calls don't need a websocket (and a TLS handshake) each:
+# they share a few connections and each connection routes incoming messages
+# to the call that owns the context.
+#
+# Each connection is supervised: websocket pings detect dead sockets, and a
+# lost connection is reopened with exponential backoff. Services are told
+# when the connection comes back so they can replay what was lost.
+
+import asyncio
+import random
+import time
+
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from custom_services.codec import json_loads
+
+try:
+    import websockets
+except ModuleNotFoundError as e:
+    logger.error(f"Exception: {e}")
+    logger.error(
+        "In order to use Cartesia, you need to `pip install pipecat-ai[cartesia]`. Also, set `CARTESIA_API_KEY` environment variable.")
+    raise Exception(f"Missing module: {e}")
+
+
+class CartesiaConnection:
+
+    def __init__(
+            self,
+            url: str,
+            *,
+            heartbeat_interval: float = 5.0,
+            heartbeat_timeout: float = 5.0,
+            min_backoff: float = 0.1,
+            max_backoff: float = 5.0,
+            send_timeout: float = 5.0):
+        self._url = url
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_timeout = heartbeat_timeout
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._send_timeout = send_timeout
+
+        self._websocket = None
+        self._connected = asyncio.Event()
+        self._closing = False
+        self._connect_task = None
+        self._supervisor_task = None
+        self._contexts: dict[str, asyncio.Queue] = {}
+        self._listeners: list[Callable[[float], Awaitable[None]]] = []
+        self.users = 0
+
+        self.reconnects = 0
+        self.last_recovery_secs = None
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def closed(self) -> bool:
+        if self._connect_task and not self._connect_task.done():
+            # Still opening.
+            return self._closing
+        return self._closing or not self._supervisor_task or self._supervisor_task.done()
+
+    async def connect(self):
+        self._websocket = await self._open()
+        self._connected.set()
+        self._supervisor_task = asyncio.get_running_loop().create_task(self._supervisor_task_handler())
+
+    def start_connect(self):
+        """Opens the connection in the background, `wait_connected()` waits
+        for it.
+
+        """
+        self._connect_task = asyncio.get_running_loop().create_task(self.connect())
+
+    async def wait_connected(self):
+        # Shielded: other services may be waiting for the same connection.
+        await asyncio.shield(self._connect_task)
+
+    async def close(self):
+        self._closing = True
+        self._connected.clear()
+        if self._connect_task and not self._connect_task.done():
+            self._connect_task.cancel()
+        if self._supervisor_task:
+            self._supervisor_task.cancel()
+            try:
+                await self._supervisor_task
+            except asyncio.CancelledError:
+                pass
+            self._supervisor_task = None
+        if self._websocket:
+            ws = self._websocket
+            self._websocket = None
+            await ws.close()
+
+    async def send(self, message: str):
+        # While reconnecting, wait a little for the connection to come back.
+        if not self._connected.is_set():
+            await asyncio.wait_for(self._connected.wait(), timeout=self._send_timeout)
+        await self._websocket.send(message)
+
+    def register_context(self, context_id: str, queue: asyncio.Queue):
+        self._contexts[context_id] = queue
+
+    def unregister_context(self, context_id: str):
+        self._contexts.pop(context_id, None)
+
+    def add_recovery_listener(self, listener: Callable[[float], Awaitable[None]]):
+        """`listener` is called with the recovery time after every reconnect.
+        Contexts that were in flight are gone on Cartesia's side.
+
+        """
+        self._listeners.append(listener)
+
+    def remove_recovery_listener(self, listener: Callable[[float], Awaitable[None]]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    async def _open(self):
+        return await websockets.connect(
+            self._url,
+            ping_interval=self._heartbeat_interval,
+            ping_timeout=self._heartbeat_timeout)
+
+    async def _supervisor_task_handler(self):
+        while not self._closing:
+            await self._receive_messages()
+            if self._closing:
+                break
+
+            self._connected.clear()
+            lost_time = time.monotonic()
+            logger.warning("Cartesia connection lost, reconnecting")
+
+            await self._reconnect()
+
+            self.reconnects += 1
+            self.last_recovery_secs = time.monotonic() - lost_time
+            self._connected.set()
+            logger.info(
+                f"Cartesia connection recovered in {self.last_recovery_secs * 1000:.0f}ms "
+                f"(reconnects: {self.reconnects})")
+
+            # Listeners replay their contexts concurrently, so a slow one
+            # doesn't hold up the other calls on this connection.
+            await asyncio.gather(*[self._notify_listener(listener) for listener in list(self._listeners)])
+
+    async def _notify_listener(self, listener: Callable[[float], Awaitable[None]]):
+        try:
+            await listener(self.last_recovery_secs)
+        except Exception as e:
+            logger.exception(f"Cartesia recovery listener exception: {e}")
+
+    async def _reconnect(self):
+        backoff = self._min_backoff
+        while True:
+            try:
+                self._websocket = await self._open()
+                return
+            except Exception as e:
+                delay = backoff * random.uniform(0.5, 1.0)
+                logger.warning(f"Cartesia reconnect failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self._max_backoff)
+
+    async def _receive_messages(self):
+        try:
+            async for message in self._websocket:
+                msg = json_loads(message)
+                if not msg:
+                    continue
+                queue = self._contexts.get(msg.get("context_id"))
+                if queue:
+                    queue.put_nowait(msg)
+        except Exception as e:
+            logger.warning(f"Cartesia connection closed: {e}")
+
+
+class CartesiaConnectionPool:
+    """Hands out shared connections, opening a new one only when all the
+    existing ones already serve `max_users_per_connection` services (up to
+    `max_connections`, after which connections are just shared more).
+
+    """
+
+    def __init__(self, max_connections: int = 4, max_users_per_connection: int = 50):
+        self._max_connections = max_connections
+        self._max_users_per_connection = max_users_per_connection
+        self._connections: dict[str, list[CartesiaConnection]] = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, url: str) -> CartesiaConnection:
+        async with self._lock:
+            connections = [c for c in self._connections.get(url, []) if not c.closed]
+            self._connections[url] = connections
+
+            connection = min(connections, key=lambda c: c.users, default=None)
+            if not connection or (connection.users >= self._max_users_per_connection and
+                                  len(connections) < self._max_connections):
+                # The handshake happens outside the lock, so calls that can
+                # use an open connection don't wait for it. Calls assigned to
+                # this connection in the meantime wait for it below.
+                connection = CartesiaConnection(url)
+                connection.start_connect()
+                connections.append(connection)
+                logger.debug(f"Opening Cartesia connection ({len(connections)} open)")
+
+            connection.users += 1
+
+        try:
+            await connection.wait_connected()
+        except BaseException:
+            await self.release(connection)
+            raise
+        return connection
+
+    async def release(self, connection: CartesiaConnection):
+        async with self._lock:
+            connection.users -= 1
+            if connection.users > 0:
+                return
+            # Keep one idle connection around so the next call doesn't pay
+            # for the handshake.
+            connections = self._connections.get(connection.url, [])
+            if connection not in connections or len(connections) == 1:
+                return
+            connections.remove(connection)
+        await connection.close()
+
+
+_default_pool: CartesiaConnectionPool | None = None
+
+
+def get_default_connection_pool() -> CartesiaConnectionPool:
+    global _default_pool
+    if not _default_pool:
+        _default_pool = CartesiaConnectionPool()
+    return _default_pool
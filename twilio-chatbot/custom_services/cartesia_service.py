@@ -6,12 +6,11 @@
 
 # Modified by Kyle Jeong
 
-import json
 import uuid
-import base64
 import asyncio
 import time
 
+from collections import deque
 from typing import AsyncGenerator
 
 from pipecat.processors.frame_processor import FrameDirection
@@ -22,19 +21,44 @@ from pipecat.frames.frames import (
     StartFrame,
     EndFrame,
     TextFrame,
+    LLMFullResponseStartFrame,
     LLMFullResponseEndFrame
 )
 from pipecat.services.ai_services import TTSService
 
+from custom_services.codec import b64decode, json_dumps
+from custom_services.cartesia_connection import (
+    CartesiaConnection,
+    CartesiaConnectionPool,
+    get_default_connection_pool)
+from custom_services.frames import AudioPlayoutFrame, ConnectionRecoveryFrame, UlawAudioRawFrame
+from custom_services.text_chunker import TextChunker
+from custom_services.tts_cache import CachedAudio, TTSCache, iter_audio_chunks, tts_cache_key
+from custom_services.tts_metrics import TTSMetricsTracker
+
 from loguru import logger
 
-try:
-    import websockets
-except ModuleNotFoundError as e:
-    logger.error(f"Exception: {e}")
-    logger.error(
-        "In order to use Cartesia, you need to `pip install pipecat-ai[cartesia]`. Also, set `CARTESIA_API_KEY` environment variable.")
-    raise Exception(f"Missing module: {e}")
+
+class _CacheRecording:
+    """Collects the audio and word timestamps of the first sentence of a
+    context. Later sentences go to the same context, so the audio is cut
+    where the sentence's last word ends.
+
+    """
+
+    def __init__(self, key: str, num_words: int):
+        self.key = key
+        self.num_words = num_words
+        self.words = []
+        self.audio = bytearray()
+        self.end_secs = None
+
+    def add_words(self, words: list[tuple[str, float]]):
+        missing = self.num_words - len(self.words)
+        if missing > 0:
+            self.words.extend(words[:missing])
+            if len(self.words) == self.num_words:
+                self.end_secs = self.words[-1][1]
 
 
 class CartesiaTTSService(TTSService):
@@ -50,6 +74,9 @@ class CartesiaTTSService(TTSService):
             encoding: str = "pcm_s16le",
             sample_rate: int = 16000,
             language: str = "en",
+            connection_pool: CartesiaConnectionPool | None = None,
+            cache: TTSCache | None = None,
+            first_chunk_min_words: int = 4,
             **kwargs):
         super().__init__(**kwargs)
 
@@ -58,6 +85,11 @@ class CartesiaTTSService(TTSService):
         # a full sentence should only "cost" us 15ms or so with GPT-4o or a Llama 3
         # model, and it's worth it for the better audio quality.
         self._aggregate_sentences = True
+        # Except for the first sentence of a response, where the wait delays
+        # the first audio: its first clause is sent on its own (see
+        # `_process_text_frame`).
+        self._text_chunker = TextChunker(first_chunk_min_words=first_chunk_min_words)
+        self._first_token_time = None
         # we don't want to automatically push LLM response text frames, because the
         # context aggregators will add them to the LLM context even if we're
         # interrupted. cartesia gives us word-by-word timestamps. we can use those
@@ -75,11 +107,54 @@ class CartesiaTTSService(TTSService):
             "sample_rate": sample_rate,
         }
         self._language = language
+        # "pcm_mulaw" at 8000Hz is what Twilio plays natively, so the
+        # transport can send it without transcoding.
+        self._audio_frame_type = UlawAudioRawFrame if encoding == "pcm_mulaw" else AudioRawFrame
+        self._sample_width = {"pcm_mulaw": 1, "pcm_alaw": 1, "pcm_f32le": 4}.get(encoding, 2)
+        self._bytes_per_second = sample_rate * self._sample_width
 
-        self._websocket = None
+        # Websockets are shared with other calls through the pool. Messages
+        # for our contexts are routed to `_messages`.
+        self._connection_pool = connection_pool or get_default_connection_pool()
+        self._connection = None
+        self._messages = asyncio.Queue()
         self._context_id = None
-        self._context_id_start_timestamp = None
-        self._timestamped_words_buffer = []
+        # Cancel message for the interrupted context, sent in the background
+        # and waited for before the next context starts.
+        self._cancel_task = None
+        # Words are emitted when the caller hears them. Their times are
+        # positions in the audio pushed since the last interruption
+        # (`_pushed_secs`), the same count the transport reports playout in
+        # (AudioPlayoutFrame.stream_secs). `_context_start_secs` is where
+        # the current context's audio starts and `_playout_anchor` is the
+        # last known (time, position) of playout.
+        self._timestamped_words_buffer = deque()
+        self._pushed_secs = 0.0
+        self._context_start_secs = 0.0
+        self._playout_anchor = None
+        # What we know about the current context, so it can be replayed on a
+        # new connection if the websocket drops: the text sent and how many
+        # of its words Cartesia already returned timestamps for.
+        self._context_text = []
+        self._context_words_received = 0
+        # Sentences that start a context are served from the cache when
+        # possible. `_cached_audio_secs` is the audio pushed from the cache
+        # since the last context.
+        self._cache = cache
+        self._cache_recording = None
+        self._cached_audio_secs = 0.0
+        # Per-sentence metrics. Sentences share a context, so a sentence is
+        # finished once Cartesia returned the timestamp of its last word:
+        # `_context_sentences` holds the sentences in flight with the number
+        # of context words up to their end.
+        self._tts_metrics = TTSMetricsTracker(str(self), self._bytes_per_second)
+        self._context_sentences = deque()
+        self._context_words_sent = 0
+        self._sentence_start_secs = 0.0
+        # Wakes up the context appending task when there is something new to
+        # schedule, so it can sleep until the next word is due (or forever if
+        # nothing is pending) instead of polling.
+        self._words_event = asyncio.Event()
         self._receive_task = None
         self._context_appending_task = None
 
@@ -100,17 +175,19 @@ class CartesiaTTSService(TTSService):
 
     async def _connect(self):
         try:
-            self._websocket = await websockets.connect(
+            self._connection = await self._connection_pool.acquire(
                 f"{self._url}?api_key={self._api_key}&cartesia_version={self._cartesia_version}"
             )
+            self._connection.add_recovery_listener(self._on_connection_recovered)
             self._receive_task = self.get_event_loop().create_task(self._receive_task_handler())
             self._context_appending_task = self.get_event_loop().create_task(self._context_appending_task_handler())
         except Exception as e:
             logger.exception(f"{self} initialization error: {e}")
-            self._websocket = None
+            self._connection = None
 
     async def _disconnect(self):
         try:
+            await self._wait_cancel_context()
             if self._context_appending_task:
                 self._context_appending_task.cancel()
                 await self._context_appending_task
@@ -119,72 +196,309 @@ class CartesiaTTSService(TTSService):
                 self._receive_task.cancel()
                 await self._receive_task
                 self._receive_task = None
-            if self._websocket:
-                ws = self._websocket
-                self._websocket = None
-                await ws.close()
+            if self._connection:
+                connection = self._connection
+                self._connection = None
+                connection.remove_recovery_listener(self._on_connection_recovered)
+                if self._context_id:
+                    connection.unregister_context(self._context_id)
+                await self._connection_pool.release(connection)
+            self._messages = asyncio.Queue()
             self._context_id = None
-            self._context_id_start_timestamp = None
-            self._timestamped_words_buffer = []
+            self._reset_playout()
             await self.stop_all_metrics()
         except Exception as e:
             logger.exception(f"{self} error closing websocket: {e}")
 
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        if isinstance(frame, AudioPlayoutFrame):
+            self._handle_audio_playout(frame)
+            self._tts_metrics.handle_playout(frame)
+        elif isinstance(frame, LLMFullResponseStartFrame):
+            self._text_chunker.reset()
+            self._first_token_time = None
+        await super().process_frame(frame, direction)
+        if isinstance(frame, LLMFullResponseEndFrame) and not self._context_id and self._cached_audio_secs:
+            # The response ended with audio from the cache, there is no
+            # "done" message to close it.
+            self._cached_audio_secs = 0.0
+            self._timestamped_words_buffer.append(("LLMFullResponseEndFrame", 0))
+            self._words_event.set()
+
+    def _handle_audio_playout(self, frame: AudioPlayoutFrame):
+        # The transport tells us how much audio the caller has actually heard,
+        # so words follow real playout instead of the time since the first
+        # chunk arrived. Playout segments restart whenever the caller runs out
+        # of audio, `stream_secs` doesn't.
+        if self._playout_anchor:
+            self._playout_anchor = (time.time(), frame.stream_secs)
+            self._words_event.set()
+
+    async def _process_text_frame(self, frame: TextFrame):
+        # Same as TTSService, which keeps the text in `_current_sentence` and
+        # flushes what is left at the end of the response, but split with the
+        # chunker.
+        if self._first_token_time is None:
+            self._first_token_time = time.time()
+        self._current_sentence += frame.text
+        while chunk := self._text_chunker.split(self._current_sentence):
+            text, self._current_sentence = chunk
+            await self._push_tts_frames(text)
+
+    def _report_first_audio(self):
+        if self._first_token_time is not None:
+            logger.debug(f"{self} LLM first token to first audio: {time.time() - self._first_token_time:.3f}s")
+            self._first_token_time = None
+
     async def _handle_interruption(self, frame: StartInterruptionFrame, direction: FrameDirection):
         await super()._handle_interruption(frame, direction)
-        self._context_id = None
-        self._context_id_start_timestamp = None
-        self._timestamped_words_buffer = []
+        self._text_chunker.reset()
+        self._first_token_time = None
+        self._tts_metrics.reset()
+        if self._context_id and self._connection:
+            # Stop Cartesia from generating the rest of the interrupted
+            # context. Not waited for here, so the interruption isn't
+            # delayed, but before the next context is sent.
+            self._cancel_task = self.get_event_loop().create_task(
+                self._cancel_context(self._connection, self._context_id))
+        self._reset_context(None)
+        self._cached_audio_secs = 0.0
+        self._reset_playout()
         await self.stop_all_metrics()
         await self.push_frame(LLMFullResponseEndFrame())
 
+    async def _cancel_context(self, connection: CartesiaConnection, context_id: str):
+        try:
+            await connection.send(json_dumps({"context_id": context_id, "cancel": True}))
+        except Exception as e:
+            logger.warning(f"{self} error cancelling context {context_id}: {e}")
+
+    async def _wait_cancel_context(self):
+        if self._cancel_task:
+            task = self._cancel_task
+            self._cancel_task = None
+            await task
+
+    def _reset_context(self, context_id: str | None):
+        if self._connection and self._context_id:
+            self._connection.unregister_context(self._context_id)
+        self._context_id = context_id
+        if context_id:
+            self._connection.register_context(context_id, self._messages)
+        self._context_start_secs = self._pushed_secs
+        self._context_text = []
+        self._context_words_received = 0
+        self._cache_recording = None
+        self._context_sentences.clear()
+        self._context_words_sent = 0
+        self._sentence_start_secs = 0.0
+
+    def _reset_playout(self):
+        # The transport drops the audio it has on interruptions, and counts
+        # playout from zero again.
+        self._timestamped_words_buffer.clear()
+        self._pushed_secs = 0.0
+        self._context_start_secs = 0.0
+        self._playout_anchor = None
+
+    def _build_msg(self, text: str) -> dict:
+        return {
+            "transcript": text + " ",
+            "continue": True,
+            "context_id": self._context_id,
+            "model_id": self._model_id,
+            "voice": {
+                "mode": "id",
+                "id": self._voice_id
+            },
+            "output_format": self._output_format,
+            "language": self._language,
+            "add_timestamps": True,
+        }
+
+    async def _on_connection_recovered(self, recovery_secs: float):
+        await self.push_frame(ConnectionRecoveryFrame(
+            service=str(self),
+            reconnects=self._connection.reconnects,
+            recovery_secs=recovery_secs))
+
+        if not self._context_id:
+            return
+
+        # The context died with the old websocket. Everything Cartesia
+        # returned timestamps for has been (or is being) played, so replay
+        # the remaining words on a new context, which starts after the audio
+        # we already pushed.
+        words = " ".join(self._context_text).split()
+        remaining = " ".join(words[self._context_words_received:])
+        logger.warning(
+            f"{self} replaying {len(words) - self._context_words_received} of {len(words)} "
+            f"words after reconnecting in {recovery_secs * 1000:.0f}ms")
+
+        self._reset_context(str(uuid.uuid4()))
+        if not remaining:
+            # Nothing was lost, later sentences go to the new context.
+            return
+
+        self._context_text.append(remaining)
+        self._context_words_sent = len(remaining.split())
+        try:
+            await self._connection.send(json_dumps(self._build_msg(remaining)))
+        except Exception as e:
+            logger.exception(f"{self} error replaying context: {e}")
+
     async def _receive_task_handler(self):
         try:
-            async for message in self._websocket:
-                msg = json.loads(message)
+            while True:
+                msg = await self._messages.get()
                 # logger.debug(f"Received message: {msg['type']} {msg['context_id']}")
                 if not msg or msg["context_id"] != self._context_id:
                     continue
                 if msg["type"] == "done":
                     await self.stop_ttfb_metrics()
-                    # unset _context_id but not the _context_id_start_timestamp because we are likely still
-                    # playing out audio and need the timestamp to set send context frames
-                    self._context_id = None
+                    self._finish_cache_recording(done=True)
+                    await self._finish_sentences()
+                    # unset _context_id, the words we still have to send are
+                    # already placed in the audio pushed
+                    self._reset_context(None)
                     self._timestamped_words_buffer.append(("LLMFullResponseEndFrame", 0))
+                    self._words_event.set()
                 elif msg["type"] == "timestamps":
                     # logger.debug(f"TIMESTAMPS: {msg}")
+                    words = msg["word_timestamps"]["words"]
+                    self._context_words_received += len(words)
+                    if self._cache_recording:
+                        self._cache_recording.add_words(list(zip(words, msg["word_timestamps"]["end"])))
+                        self._finish_cache_recording()
+                    await self._finish_sentences(msg["word_timestamps"]["end"])
                     self._timestamped_words_buffer.extend(
-                        list(zip(msg["word_timestamps"]["words"], msg["word_timestamps"]["end"]))
+                        (word, self._context_start_secs + end)
+                        for word, end in zip(words, msg["word_timestamps"]["end"])
                     )
+                    self._words_event.set()
                 elif msg["type"] == "chunk":
-                    await self.stop_ttfb_metrics()
-                    if not self._context_id_start_timestamp:
-                        self._context_id_start_timestamp = time.time()
-                    frame = AudioRawFrame(
-                        audio=base64.b64decode(msg["data"]),
-                        sample_rate=self._output_format["sample_rate"],
-                        num_channels=1
-                    )
-                    await self.push_frame(frame)
+                    sentence = self._context_sentences[0][0] if self._context_sentences else None
+                    if sentence and sentence.first_byte_time is None:
+                        await self.stop_ttfb_metrics()
+                    audio = b64decode(msg["data"])
+                    self._report_first_audio()
+                    self._tts_metrics.add_audio(sentence, len(audio))
+                    if self._cache_recording:
+                        self._cache_recording.audio.extend(audio)
+                        self._finish_cache_recording()
+                    await self._push_audio(audio)
         except Exception as e:
             logger.exception(f"{self} exception: {e}")
 
+    async def _finish_sentences(self, ends: list[float] | None = None):
+        # `ends` are the word end times from the last timestamps message,
+        # None finishes all the sentences (the context is done).
+        first_index = self._context_words_received - len(ends or [])
+        while self._context_sentences:
+            sentence, end_index = self._context_sentences[0]
+            if ends is not None and end_index > self._context_words_received:
+                break
+            self._context_sentences.popleft()
+            i = end_index - 1 - first_index
+            if ends and 0 <= i < len(ends):
+                # The audio received so far may already include the next
+                # sentence, the timestamps tell where this one ended.
+                sentence.audio_secs = ends[i] - self._sentence_start_secs
+                self._sentence_start_secs = ends[i]
+            metrics_frame = self._tts_metrics.finish(sentence)
+            if metrics_frame:
+                await self.push_frame(metrics_frame)
+
+    def _finish_cache_recording(self, done: bool = False):
+        recording = self._cache_recording
+        if not recording:
+            return
+        if done:
+            if len(recording.words) == recording.num_words:
+                cut = len(recording.audio)
+            else:
+                # Cartesia split the words differently, don't trust it.
+                self._cache_recording = None
+                return
+        else:
+            if recording.end_secs is None:
+                return
+            cut = int(recording.end_secs * self._bytes_per_second)
+            cut -= cut % self._sample_width
+            if len(recording.audio) < cut:
+                return
+        self._cache.put(recording.key, CachedAudio(audio=bytes(recording.audio[:cut]), words=recording.words))
+        self._cache_recording = None
+
+    async def _push_cached_audio(self, cached: CachedAudio):
+        self._report_first_audio()
+        self._tts_metrics.add_audio(None, len(cached.audio))
+        start_secs = self._pushed_secs
+        self._timestamped_words_buffer.extend((word, start_secs + end) for word, end in cached.words)
+        self._cached_audio_secs += len(cached.audio) / self._bytes_per_second
+        self._words_event.set()
+        for chunk in iter_audio_chunks(cached.audio, self._bytes_per_second // 10):
+            await self._push_audio(chunk)
+
+    async def _push_audio(self, audio: bytes):
+        played_secs = self._played_secs()
+        if played_secs is None or played_secs >= self._pushed_secs:
+            # Nothing is playing: this is the first audio, or everything
+            # before it (e.g. the previous context) has been played already.
+            # Until the transport tells us otherwise, assume the audio is
+            # played as soon as we push it.
+            self._playout_anchor = (time.time(), self._pushed_secs)
+            self._words_event.set()
+        self._pushed_secs += len(audio) / self._bytes_per_second
+        await self.push_frame(self._audio_frame_type(
+            audio=audio,
+            sample_rate=self._output_format["sample_rate"],
+            num_channels=1
+        ))
+
+    def _played_secs(self) -> float | None:
+        # Where playout is now in the audio pushed. It can't be further than
+        # the audio we have pushed.
+        if not self._playout_anchor:
+            return None
+        anchor_time, anchor_secs = self._playout_anchor
+        return min(anchor_secs + time.time() - anchor_time, self._pushed_secs)
+
+    def _next_word_delay(self) -> float | None:
+        # None means there is nothing to wait for until we are woken up.
+        played_secs = self._played_secs()
+        if played_secs is None or not self._timestamped_words_buffer:
+            return None
+        return max(self._timestamped_words_buffer[0][1] - played_secs, 0.0)
+
+    async def _push_spoken_words(self):
+        played_secs = self._played_secs()
+        if played_secs is None:
+            return
+        # pop all words from self._timestamped_words_buffer that have been
+        # played and push them as text frames
+        while self._timestamped_words_buffer and self._timestamped_words_buffer[0][1] <= played_secs:
+            word, timestamp = self._timestamped_words_buffer.popleft()
+            if word == "LLMFullResponseEndFrame" and timestamp == 0:
+                await self.push_frame(LLMFullResponseEndFrame())
+                continue
+            # print(f"Word '{word}' with timestamp {timestamp:.2f}s has been spoken.")
+            await self.push_frame(TextFrame(word))
+
     async def _context_appending_task_handler(self):
         try:
             while True:
-                await asyncio.sleep(0.1)
-                if not self._context_id_start_timestamp:
+                self._words_event.clear()
+                await self._push_spoken_words()
+
+                delay = self._next_word_delay()
+                if delay is None:
+                    await self._words_event.wait()
                     continue
-                elapsed_seconds = time.time() - self._context_id_start_timestamp
-                # pop all words from self._timestamped_words_buffer that are older than the
-                # elapsed time and print a message about them to the console
-                while self._timestamped_words_buffer and self._timestamped_words_buffer[0][1] <= elapsed_seconds:
-                    word, timestamp = self._timestamped_words_buffer.pop(0)
-                    if word == "LLMFullResponseEndFrame" and timestamp == 0:
-                        await self.push_frame(LLMFullResponseEndFrame())
-                        continue
-                    # print(f"Word '{word}' with timestamp {timestamp:.2f}s has been spoken.")
-                    await self.push_frame(TextFrame(word))
+                try:
+                    await asyncio.wait_for(self._words_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
         except Exception as e:
             logger.exception(f"{self} exception: {e}")
 
@@ -192,34 +506,45 @@ class CartesiaTTSService(TTSService):
         logger.debug(f"Generating TTS: [{text}]")
 
         try:
-            if not self._websocket:
+            cache_key = None
+            if not self._context_id and self._cache and self._cache.cacheable(text):
+                cache_key = tts_cache_key(
+                    "cartesia",
+                    self._voice_id,
+                    f"{self._model_id}/{self._language}",
+                    f"{self._output_format['encoding']}_{self._output_format['sample_rate']}",
+                    text)
+                cached = await self._cache.get(cache_key)
+                if cached:
+                    await self._push_cached_audio(cached)
+                    yield None
+                    return
+
+            if not self._connection or self._connection.closed:
+                await self._disconnect()
                 await self._connect()
 
             if not self._context_id:
+                await self._wait_cancel_context()
                 await self.start_ttfb_metrics()
-                self._context_id = str(uuid.uuid4())
-
-            msg = {
-                "transcript": text + " ",
-                "continue": True,
-                "context_id": self._context_id,
-                "model_id": self._model_id,
-                "voice": {
-                    "mode": "id",
-                    "id": self._voice_id
-                },
-                "output_format": self._output_format,
-                "language": self._language,
-                "add_timestamps": True,
-            }
-            # logger.debug(f"SENDING MESSAGE {json.dumps(msg)}")
+                # The context starts after any audio we just pushed from the
+                # cache.
+                self._reset_context(str(uuid.uuid4()))
+                self._cached_audio_secs = 0.0
+                if cache_key:
+                    self._cache_recording = _CacheRecording(cache_key, len(text.split()))
+
+            # Remember the text before sending it: if the connection drops it
+            # is replayed once the connection recovers.
+            self._context_text.append(text)
+            self._context_words_sent += len(text.split())
+            self._context_sentences.append((self._tts_metrics.start(text), self._context_words_sent))
+            msg = self._build_msg(text)
+            # logger.debug(f"SENDING MESSAGE {json_dumps(msg)}")
             try:
-                await self._websocket.send(json.dumps(msg))
+                await self._connection.send(json_dumps(msg))
             except Exception as e:
-                logger.exception(f"{self} error sending message: {e}")
-                await self._disconnect()
-                await self._connect()
-                return
+                logger.warning(f"{self} error sending message, will replay after reconnecting: {e}")
             yield None
         except Exception as e:
             logger.exception(f"{self} exception: {e}")
\ No newline at end of file
@@ -0,0 +1,45 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# JSON and base64 helpers for the per-frame paths (Twilio media events,
+# Cartesia audio chunks). orjson is used when it is installed, otherwise the
+# standard library. base64 goes straight to binascii, which skips the
+# argument checking and conversions the base64 module adds on every call.
+
+import binascii
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+import json
+
+JSON_BACKEND = "orjson" if orjson else "json"
+
+if orjson:
+    def json_loads(data: str | bytes):
+        return orjson.loads(data)
+
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    _decoder = json.JSONDecoder()
+
+    def json_loads(data: str | bytes):
+        if not isinstance(data, str):
+            data = data.decode("utf-8")
+        return _decoder.decode(data)
+
+    def json_dumps(obj) -> str:
+        return _encoder.encode(obj)
+
+
+def b64decode(data: str | bytes) -> bytes:
+    return binascii.a2b_base64(data)
+
+
+def b64encode(data: bytes) -> str:
+    return binascii.b2a_base64(data, newline=False).decode("ascii")
@@ -7,8 +7,12 @@
 # Edited by Kyle Jeong
 
 import aiohttp
+import asyncio
+import dataclasses
+import random
 import time
 
+from collections import deque
 from typing import AsyncGenerator
 
 from pipecat.frames.frames import (
@@ -19,12 +23,28 @@ from pipecat.frames.frames import (
     Frame,
     InterimTranscriptionFrame,
     StartFrame,
+    StartInterruptionFrame,
     SystemFrame,
-    TranscriptionFrame)
+    TranscriptionFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame)
 from pipecat.processors.frame_processor import FrameDirection
 from pipecat.services.ai_services import AsyncAIService, TTSService
 from pipecat.utils.time import time_now_iso8601
 
+from custom_services.audio_dsp import UlawEncoder
+from custom_services.audio_reframer import reframe_audio
+from custom_services.codec import json_dumps
+from custom_services.frames import (
+    AudioPlayoutFrame,
+    ConnectionRecoveryFrame,
+    TelephonyAudioRawFrame,
+    UlawAudioRawFrame)
+from custom_services.stt_metrics import STTMetricsTracker
+from custom_services.tts_cache import CachedAudio, TTSCache, iter_audio_chunks, tts_cache_key
+from custom_services.tts_metrics import TTSMetricsTracker
+from custom_services.tts_prefetch import TTSPrefetchMixin
+
 from loguru import logger
 # See .env.example for Deepgram configuration needed
 try:
@@ -41,7 +61,7 @@ except ModuleNotFoundError as e:
     raise Exception(f"Missing module: {e}")
 
 
-class DeepgramTTSService(TTSService):
+class DeepgramTTSService(TTSPrefetchMixin, TTSService):
 
     def __init__(
             self,
@@ -50,13 +70,29 @@ class DeepgramTTSService(TTSService):
             api_key: str,
             voice: str = "aura-helios-en",
             base_url: str = "https://api.deepgram.com/v1/speak",
+            encoding: str = "linear16",
+            sample_rate: int = 16000,
+            cache: TTSCache | None = None,
+            frame_ms: int = 100,
+            prefetch_depth: int = 2,
             **kwargs):
-        super().__init__(**kwargs)
+        # Synthesizes the next sentences while the current one streams, see
+        # TTSPrefetchMixin.
+        super().__init__(prefetch_depth=prefetch_depth, **kwargs)
 
         self._voice = voice
         self._api_key = api_key
         self._aiohttp_session = aiohttp_session
         self._base_url = base_url
+        # "mulaw" at 8000Hz is what Twilio plays natively.
+        self._encoding = encoding
+        self._sample_rate = sample_rate
+        self._audio_frame_type = UlawAudioRawFrame if encoding == "mulaw" else AudioRawFrame
+        self._sample_width = 1 if encoding in ("mulaw", "alaw") else 2
+        self._bytes_per_second = sample_rate * self._sample_width
+        self._frame_size = self._bytes_per_second * frame_ms // 1000
+        self._cache = cache
+        self._tts_metrics = TTSMetricsTracker(str(self), self._bytes_per_second)
 
     def can_generate_metrics(self) -> bool:
         return True
@@ -65,16 +101,38 @@ class DeepgramTTSService(TTSService):
         logger.debug(f"Switching TTS voice to: [{voice}]")
         self._voice = voice
 
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        if isinstance(frame, AudioPlayoutFrame):
+            self._tts_metrics.handle_playout(frame)
+        await super().process_frame(frame, direction)
+
+    async def _handle_interruption(self, frame: StartInterruptionFrame, direction: FrameDirection):
+        await super()._handle_interruption(frame, direction)
+        self._tts_metrics.reset()
+
     async def run_tts(self, text: str) -> AsyncGenerator[Frame, None]:
         logger.debug(f"Generating TTS: [{text}]")
 
+        cache_key = None
+        if self._cache and self._cache.cacheable(text):
+            cache_key = tts_cache_key(
+                "deepgram", self._voice, self._voice, f"{self._encoding}_{self._sample_rate}", text)
+            cached = await self._cache.get(cache_key)
+            if cached:
+                self._tts_metrics.add_audio(None, len(cached.audio))
+                for chunk in iter_audio_chunks(cached.audio, self._frame_size):
+                    yield self._audio_frame_type(audio=chunk, sample_rate=self._sample_rate, num_channels=1)
+                return
+        audio = bytearray()
+
         base_url = self._base_url
-        request_url = f"{base_url}?model={self._voice}&encoding=linear16&container=none&sample_rate=16000"
+        request_url = f"{base_url}?model={self._voice}&encoding={self._encoding}&container=none&sample_rate={self._sample_rate}"
         headers = {"authorization": f"token {self._api_key}"}
         body = {"text": text}
 
         try:
             await self.start_ttfb_metrics()
+            sentence = self._tts_metrics.start(text)
             async with self._aiohttp_session.post(request_url, headers=headers, json=body) as r:
                 if r.status != 200:
                     response_text = await r.text()
@@ -90,10 +148,21 @@ class DeepgramTTSService(TTSService):
                     yield ErrorFrame(f"Error getting audio (status: {r.status}, error: {response_text})")
                     return
 
-                async for data in r.content:
-                    await self.stop_ttfb_metrics()
-                    frame = AudioRawFrame(audio=data, sample_rate=16000, num_channels=1)
+                async for data in reframe_audio(r.content.iter_chunked(4096), self._frame_size, self._sample_width):
+                    if sentence.first_byte_time is None:
+                        await self.stop_ttfb_metrics()
+                    self._tts_metrics.add_audio(sentence, len(data))
+                    if cache_key:
+                        audio.extend(data)
+                    frame = self._audio_frame_type(audio=data, sample_rate=self._sample_rate, num_channels=1)
                     yield frame
+
+            if cache_key:
+                self._cache.put(cache_key, CachedAudio(audio=bytes(audio)))
+
+            metrics_frame = self._tts_metrics.finish(sentence)
+            if metrics_frame:
+                yield metrics_frame
         except Exception as e:
             logger.exception(f"{self} exception: {e}")
 
@@ -112,15 +181,79 @@ class DeepgramSTTService(AsyncAIService):
                      interim_results=True,
                      smart_format=True,
                  ),
+                 vad_gated: bool = False,
+                 pre_roll_ms: int = 500,
+                 keepalive_interval: float = 5.0,
+                 finalize_on_vad_stop: bool = True,
+                 endpointing: int | bool | None = None,
+                 utterance_end_ms: int | None = None,
+                 replay_ms: int = 3000,
+                 min_backoff: float = 0.05,
+                 max_backoff: float = 2.0,
                  **kwargs):
         super().__init__(**kwargs)
 
-        self._live_options = live_options
+        # Deepgram's own end of speech detection: `endpointing` is the
+        # silence (ms) after which it finalizes a transcript, or False to
+        # disable it; `utterance_end_ms` makes it send UtteranceEnd
+        # messages. None keeps what `live_options` says.
+        overrides = {}
+        if endpointing is not None:
+            overrides["endpointing"] = endpointing
+        if utterance_end_ms is not None:
+            overrides["utterance_end_ms"] = str(utterance_end_ms)
+        self._live_options = dataclasses.replace(live_options, **overrides)
+        # When the transport's VAD says the user stopped speaking, ask
+        # Deepgram to finalize right away instead of waiting for its
+        # endpointing.
+        self._finalize_on_vad_stop = finalize_on_vad_stop
+        sample_width = 1 if live_options.encoding in ("mulaw", "alaw") else 2
+        self._bytes_per_second = (live_options.sample_rate or 16000) * (live_options.channels or 1) * sample_width
+        self._stt_metrics = STTMetricsTracker(str(self))
+        # PCM audio sent to a μ-law stream is encoded, see
+        # `_get_audio_payload`.
+        self._ulaw_encoder = None
+        self._ulaw_encoder_sample_rate = None
+
+        # In VAD-gated mode audio is only sent while the user speaks (this
+        # needs the transport's VAD). The last `pre_roll_ms` of audio before
+        # VAD detects speech is kept and sent first, so the start of the
+        # utterance isn't cut. During silence Deepgram gets a KeepAlive
+        # every `keepalive_interval` seconds instead.
+        self._vad_gated = vad_gated
+        self._pre_roll = deque()
+        self._pre_roll_bytes = 0
+        self._max_pre_roll_bytes = self._bytes_per_second * pre_roll_ms // 1000
+        self._keepalive_interval = keepalive_interval
+        self._keepalive_task = None
+        self._user_speaking = False
+        self._last_send_time = 0.0
+        self._bytes_received = 0
+        self._bytes_sent = 0
+
+        # The connection is supervised: when it closes (or a send fails) a
+        # new one is opened right away, retrying with jittered exponential
+        # backoff. The last `replay_ms` of audio sent is kept until Deepgram
+        # has finalized it, and whatever is left (plus what arrived during
+        # the outage) is replayed into the new connection. Positions are in
+        # seconds of audio sent over the call; `_stream_offset_secs` is
+        # where the current connection's stream starts.
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._replay = deque()
+        self._replay_bytes = 0
+        self._max_replay_bytes = self._bytes_per_second * replay_ms // 1000
+        self._sent_secs = 0.0
+        self._transcribed_secs = 0.0
+        self._stream_offset_secs = 0.0
+        self._reconnects = 0
+        self._closing = False
+        self._connection_lost = asyncio.Event()
+        self._supervisor_task = None
 
         self._client = DeepgramClient(
             api_key, config=DeepgramClientOptions(url=url, options={"keepalive": "true"}))
-        self._connection = self._client.listen.asynclive.v("1")
-        self._connection.on(LiveTranscriptionEvents.Transcript, self._on_message)
+        self._connection = None
         
     def can_generate_metrics(self) -> bool:
         return True
@@ -128,34 +261,255 @@ class DeepgramSTTService(AsyncAIService):
     async def process_frame(self, frame: Frame, direction: FrameDirection):
         await super().process_frame(frame, direction)
 
+        if isinstance(frame, UserStartedSpeakingFrame):
+            metrics_frame = self._stt_metrics.speech_started()
+            if metrics_frame:
+                await self.queue_frame(metrics_frame)
+            self._user_speaking = True
+            if self._pre_roll:
+                pre_roll = b"".join(self._pre_roll)
+                self._pre_roll.clear()
+                self._pre_roll_bytes = 0
+                await self._send_audio(pre_roll)
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            # TTFB is the time from the end of speech to the final transcript.
+            self._stt_metrics.speech_stopped()
+            self._user_speaking = False
+            await self.start_ttfb_metrics()
+            if self._finalize_on_vad_stop:
+                await self._finalize()
+
         if isinstance(frame, SystemFrame):
             await self.push_frame(frame, direction)
         elif isinstance(frame, AudioRawFrame):
-            await self.start_ttfb_metrics()
-            await self._connection.send(frame.audio)
+            payload = self._get_audio_payload(frame)
+            self._bytes_received += len(payload)
+            if self._vad_gated and not self._user_speaking:
+                self._add_pre_roll(payload)
+            else:
+                await self._send_audio(payload)
         else:
             await self.queue_frame(frame, direction)
 
+    def _get_audio_payload(self, frame: AudioRawFrame) -> bytes:
+        if self._live_options.encoding != "mulaw":
+            return frame.audio
+        # In telephony-native mode Deepgram takes the caller's μ-law audio as
+        # it came from Twilio. Anything else (PCM from binary clients) is
+        # encoded to the 8kHz μ-law the stream expects.
+        if isinstance(frame, TelephonyAudioRawFrame):
+            return frame.ulaw
+        if frame.sample_rate != self._ulaw_encoder_sample_rate:
+            self._ulaw_encoder = UlawEncoder(frame.sample_rate)
+            self._ulaw_encoder_sample_rate = frame.sample_rate
+        return self._ulaw_encoder.encode(frame.audio)
+
+    def _add_pre_roll(self, payload: bytes):
+        self._pre_roll.append(payload)
+        self._pre_roll_bytes += len(payload)
+        while self._pre_roll_bytes - len(self._pre_roll[0]) >= self._max_pre_roll_bytes:
+            self._pre_roll_bytes -= len(self._pre_roll.popleft())
+
+    async def _send_audio(self, payload: bytes):
+        self._stt_metrics.audio_sent(len(payload) / self._bytes_per_second)
+        self._bytes_sent += len(payload)
+        self._last_send_time = time.monotonic()
+        self._add_replay(payload)
+        # While reconnecting the audio is only buffered, it will be replayed.
+        if self._connected():
+            await self._send(payload)
+
+    def _add_replay(self, payload: bytes):
+        self._replay.append((self._sent_secs, payload))
+        self._replay_bytes += len(payload)
+        self._sent_secs += len(payload) / self._bytes_per_second
+        while self._replay_bytes > self._max_replay_bytes:
+            self._replay_bytes -= len(self._replay.popleft()[1])
+
+    def _trim_replay(self, end_secs: float):
+        # Drops the audio Deepgram has finalized.
+        while self._replay:
+            start, payload = self._replay[0]
+            if start + len(payload) / self._bytes_per_second > end_secs:
+                break
+            self._replay.popleft()
+            self._replay_bytes -= len(payload)
+
+    def _connected(self) -> bool:
+        return self._connection is not None and not self._connection_lost.is_set()
+
+    async def _send(self, data: bytes | str) -> bool:
+        try:
+            # The SDK returns False if the socket is gone.
+            if await self._connection.send(data) is not False:
+                return True
+        except Exception as e:
+            logger.warning(f"{self} error sending to Deepgram: {e}")
+        self._set_connection_lost()
+        return False
+
+    def _set_connection_lost(self):
+        if not self._closing:
+            self._connection_lost.set()
+
+    async def _finalize(self):
+        # Deepgram transcribes whatever audio it has buffered and sends it
+        # back as a final result.
+        if not self._connected():
+            return
+        self._last_send_time = time.monotonic()
+        await self._send(json_dumps({"type": "Finalize"}))
+
+    async def _keepalive_task_handler(self):
+        while True:
+            await asyncio.sleep(self._keepalive_interval / 2)
+            if time.monotonic() - self._last_send_time < self._keepalive_interval:
+                continue
+            if self._connected():
+                self._last_send_time = time.monotonic()
+                await self._send(json_dumps({"type": "KeepAlive"}))
+
+    async def _connect(self) -> bool:
+        connection = self._client.listen.asynclive.v("1")
+        connection.on(LiveTranscriptionEvents.Transcript, self._on_message)
+        connection.on(LiveTranscriptionEvents.Close, self._on_connection_closed)
+        connection.on(LiveTranscriptionEvents.Error, self._on_connection_closed)
+        try:
+            started = await connection.start(self._live_options)
+        except Exception as e:
+            logger.warning(f"{self} error connecting to Deepgram: {e}")
+            started = False
+        if started:
+            self._connection = connection
+        return bool(started)
+
+    async def _finish_connection(self, connection):
+        try:
+            await connection.finish()
+        except Exception as e:
+            logger.debug(f"{self} error closing Deepgram connection: {e}")
+
+    async def _on_connection_closed(self, connection, *args, **kwargs):
+        # Closes of connections we already replaced don't matter.
+        if connection is self._connection:
+            self._set_connection_lost()
+
+    async def _supervisor_task_handler(self):
+        while True:
+            await self._connection_lost.wait()
+            lost_time = time.monotonic()
+            logger.warning(f"{self} Deepgram connection lost, reconnecting")
+
+            if self._connection:
+                self.get_event_loop().create_task(self._finish_connection(self._connection))
+                self._connection = None
+            await self._reconnect()
+
+            self._reconnects += 1
+            recovery_secs = time.monotonic() - lost_time
+            # Deepgram's timestamps restart at zero on the new connection.
+            self._stream_offset_secs = self._replay[0][0] if self._replay else self._sent_secs
+            lost_audio_secs = max(self._stream_offset_secs - self._transcribed_secs, 0.0)
+            replay = b"".join(payload for _, payload in self._replay)
+            self._connection_lost.clear()
+            # Nothing awaits between clearing the flag and this send, so the
+            # replay goes out before any new audio.
+            if replay and not await self._send(replay):
+                continue
+            if replay and self._finalize_on_vad_stop and not self._user_speaking:
+                # We may have missed the end of the utterance.
+                await self._finalize()
+
+            self._stt_metrics.reconnected(recovery_secs, lost_audio_secs)
+            logger.info(
+                f"{self} Deepgram connection recovered in {recovery_secs * 1000:.0f}ms "
+                f"(reconnects: {self._reconnects}), replayed {len(replay) / self._bytes_per_second:.2f}s "
+                f"of audio, lost {lost_audio_secs:.2f}s")
+            await self.queue_frame(ConnectionRecoveryFrame(
+                service=str(self),
+                reconnects=self._reconnects,
+                recovery_secs=recovery_secs,
+                lost_audio_secs=lost_audio_secs))
+
+    async def _reconnect(self):
+        backoff = self._min_backoff
+        while not await self._connect():
+            delay = backoff * random.uniform(0.5, 1.0)
+            logger.warning(f"{self} Deepgram reconnect failed, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, self._max_backoff)
+
     async def start(self, frame: StartFrame):
-        if await self._connection.start(self._live_options):
+        self._supervisor_task = self.get_event_loop().create_task(self._supervisor_task_handler())
+        if await self._connect():
             logger.debug(f"{self}: Connected to Deepgram")
         else:
-            logger.error(f"{self}: Unable to connect to Deepgram")
+            logger.error(f"{self}: Unable to connect to Deepgram, retrying")
+            self._set_connection_lost()
+        self._last_send_time = time.monotonic()
+        if self._vad_gated:
+            self._keepalive_task = self.get_event_loop().create_task(self._keepalive_task_handler())
 
     async def stop(self, frame: EndFrame):
-        await self._connection.finish()
+        await self._disconnect()
         await self.stop_all_metrics()
+        self._report_bytes_sent()
 
     async def cancel(self, frame: CancelFrame):
-        await self._connection.finish()
+        await self._disconnect()
         await self.stop_all_metrics()
+        self._report_bytes_sent()
+
+    async def _disconnect(self):
+        self._closing = True
+        await self._stop_keepalive()
+        if self._supervisor_task:
+            self._supervisor_task.cancel()
+            try:
+                await self._supervisor_task
+            except asyncio.CancelledError:
+                pass
+            self._supervisor_task = None
+        if self._connection:
+            await self._finish_connection(self._connection)
+            self._connection = None
+
+    async def _stop_keepalive(self):
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+
+    def _report_bytes_sent(self):
+        if not self._bytes_received:
+            return
+        saved = 1 - self._bytes_sent / self._bytes_received
+        logger.info(
+            f"{self}: sent {self._bytes_sent} of {self._bytes_received} audio bytes to Deepgram "
+            f"({saved:.0%} saved)")
 
     async def _on_message(self, *args, **kwargs):
+        # Results from a replaced connection would duplicate the replay.
+        if args and args[0] is not self._connection:
+            return
         result = kwargs["result"]
         is_final = result.is_final
         transcript = result.channel.alternatives[0].transcript
-        if len(transcript) > 0:
+        start = self._stream_offset_secs + result.start
+        if is_final:
+            self._transcribed_secs = max(self._transcribed_secs, start + result.duration)
+            self._trim_replay(self._transcribed_secs)
+        metrics_frame = self._stt_metrics.result(transcript, is_final, start, result.duration)
+        if metrics_frame:
+            await self.queue_frame(metrics_frame)
+        if is_final:
+            # Also on the empty answer to Finalize, when the transcript was
+            # final before the end of speech.
             await self.stop_ttfb_metrics()
+        if len(transcript) > 0:
             if is_final:
                 await self.queue_frame(TranscriptionFrame(transcript, "", time_now_iso8601()))
             else:
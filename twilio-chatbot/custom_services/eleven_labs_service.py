@@ -8,15 +8,53 @@
 
 # ElevenLabs TTS Service usually has a processing time of 0.85 - 0.95 s 
 import aiohttp
+import asyncio
 
 from typing import AsyncGenerator
 
-from pipecat.frames.frames import AudioRawFrame, ErrorFrame, Frame
+from pipecat.frames.frames import (
+    AudioRawFrame,
+    CancelFrame,
+    EndFrame,
+    ErrorFrame,
+    Frame,
+    LLMFullResponseEndFrame,
+    StartFrame,
+    StartInterruptionFrame,
+    TextFrame,
+    TTSStartedFrame,
+    TTSStoppedFrame)
+from pipecat.processors.frame_processor import FrameDirection
 from pipecat.services.ai_services import TTSService
 
+from custom_services.audio_reframer import reframe_audio
+from custom_services.codec import b64decode, json_dumps, json_loads
+from custom_services.frames import AudioPlayoutFrame, UlawAudioRawFrame
+from custom_services.tts_cache import CachedAudio, TTSCache, iter_audio_chunks, tts_cache_key
+from custom_services.tts_metrics import TTSMetricsTracker
+from custom_services.tts_prefetch import TTSPrefetchMixin
+
 from loguru import logger
 
-class ElevenLabsTTSService(TTSService):
+try:
+    import websockets
+except ModuleNotFoundError as e:
+    logger.error(f"Exception: {e}")
+    logger.error(
+        "In order to use ElevenLabs, you need to `pip install websockets`. Also, set `ELEVENLABS_API_KEY` environment variable.")
+    raise Exception(f"Missing module: {e}")
+
+
+def _parse_output_format(output_format: str) -> tuple[int, type, int]:
+    # e.g. "pcm_16000", or "ulaw_8000" to get audio Twilio plays natively.
+    encoding, sample_rate = output_format.split("_")
+    sample_rate = int(sample_rate)
+    if encoding == "ulaw":
+        return sample_rate, UlawAudioRawFrame, sample_rate
+    return sample_rate, AudioRawFrame, sample_rate * 2
+
+
+class ElevenLabsTTSService(TTSPrefetchMixin, TTSService):
 
     def __init__(
             self,
@@ -25,17 +63,38 @@ class ElevenLabsTTSService(TTSService):
             api_key: str,
             voice_id: str,
             model: str = "eleven_turbo_v2_5",
+            output_format: str = "pcm_16000",
+            cache: TTSCache | None = None,
+            frame_ms: int = 100,
+            prefetch_depth: int = 2,
             **kwargs):
-        super().__init__(**kwargs)
+        # Synthesizes the next sentences while the current one streams, see
+        # TTSPrefetchMixin.
+        super().__init__(prefetch_depth=prefetch_depth, **kwargs)
 
         self._api_key = api_key
         self._voice_id = voice_id
         self._aiohttp_session = aiohttp_session
         self._model = model
+        self._output_format = output_format
+        self._sample_rate, self._audio_frame_type, self._bytes_per_second = _parse_output_format(output_format)
+        self._sample_width = self._bytes_per_second // self._sample_rate
+        self._frame_size = self._bytes_per_second * frame_ms // 1000
+        self._cache = cache
+        self._tts_metrics = TTSMetricsTracker(str(self), self._bytes_per_second)
 
     def can_generate_metrics(self) -> bool:
         return True
 
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        if isinstance(frame, AudioPlayoutFrame):
+            self._tts_metrics.handle_playout(frame)
+        await super().process_frame(frame, direction)
+
+    async def _handle_interruption(self, frame: StartInterruptionFrame, direction: FrameDirection):
+        await super()._handle_interruption(frame, direction)
+        self._tts_metrics.reset()
+
     async def set_voice(self, voice: str):
         logger.debug(f"Switching TTS voice to: [{voice}]")
         self._voice_id = voice
@@ -43,12 +102,23 @@ class ElevenLabsTTSService(TTSService):
     async def run_tts(self, text: str) -> AsyncGenerator[Frame, None]:
         logger.debug(f"Generating TTS: [{text}]")
 
+        cache_key = None
+        if self._cache and self._cache.cacheable(text):
+            cache_key = tts_cache_key("elevenlabs", self._voice_id, self._model, self._output_format, text)
+            cached = await self._cache.get(cache_key)
+            if cached:
+                self._tts_metrics.add_audio(None, len(cached.audio))
+                for chunk in iter_audio_chunks(cached.audio, self._frame_size):
+                    yield self._audio_frame_type(chunk, self._sample_rate, 1)
+                return
+        audio = bytearray()
+
         url = f"https://api.elevenlabs.io/v1/text-to-speech/{self._voice_id}/stream"
 
         payload = {"text": text, "model_id": self._model}
 
         querystring = {
-            "output_format": "pcm_16000",
+            "output_format": self._output_format,
             "optimize_streaming_latency": 0} # 0 is fastest, 1 is faster, 2 is normal 
 
         headers = {
@@ -57,6 +127,7 @@ class ElevenLabsTTSService(TTSService):
         }
 
         await self.start_ttfb_metrics()
+        sentence = self._tts_metrics.start(text)
 
         async with self._aiohttp_session.post(url, json=payload, headers=headers, params=querystring) as r:
             if r.status != 200:
@@ -65,8 +136,314 @@ class ElevenLabsTTSService(TTSService):
                 yield ErrorFrame(f"Error getting audio (status: {r.status}, error: {text})")
                 return
 
-            async for chunk in r.content:
-                if len(chunk) > 0:
+            async for chunk in reframe_audio(r.content.iter_chunked(4096), self._frame_size, self._sample_width):
+                if sentence.first_byte_time is None:
                     await self.stop_ttfb_metrics()
-                    frame = AudioRawFrame(chunk, 16000, 1)
-                    yield frame
+                self._tts_metrics.add_audio(sentence, len(chunk))
+                if cache_key:
+                    audio.extend(chunk)
+                frame = self._audio_frame_type(chunk, self._sample_rate, 1)
+                yield frame
+
+        if cache_key:
+            self._cache.put(cache_key, CachedAudio(audio=bytes(audio)))
+
+        metrics_frame = self._tts_metrics.finish(sentence)
+        if metrics_frame:
+            yield metrics_frame
+
+
+class ElevenLabsWebsocketTTSService(TTSService):
+    """Streams the LLM text to ElevenLabs' stream-input websocket as it
+    arrives, over one connection per call, instead of making an HTTP request
+    per sentence. ElevenLabs buffers the text and starts synthesizing once it
+    has `chunk_length_schedule[0]` characters, so the first audio doesn't
+    wait for the end of the sentence and there's no per-request setup.
+
+    """
+
+    def __init__(
+            self,
+            *,
+            api_key: str,
+            voice_id: str,
+            model: str = "eleven_turbo_v2_5",
+            output_format: str = "pcm_16000",
+            url: str = "wss://api.elevenlabs.io/v1/text-to-speech",
+            optimize_streaming_latency: int = 3,
+            chunk_length_schedule: tuple[int, ...] = (50, 120, 160, 250),
+            inactivity_timeout: int = 180,
+            stop_timeout: float = 5.0,
+            **kwargs):
+        super().__init__(**kwargs)
+
+        self._api_key = api_key
+        self._voice_id = voice_id
+        self._model = model
+        self._output_format = output_format
+        self._url = url
+        self._optimize_streaming_latency = optimize_streaming_latency
+        self._chunk_length_schedule = list(chunk_length_schedule)
+        self._inactivity_timeout = inactivity_timeout
+        # How long to wait on EndFrame for the audio still being synthesized.
+        self._stop_timeout = stop_timeout
+        self._sample_rate, self._audio_frame_type, self._bytes_per_second = _parse_output_format(output_format)
+
+        self._websocket = None
+        self._receive_task = None
+        self._connect_task = None
+        # Streams dropped on interruptions, closing in the background.
+        self._close_tasks = set()
+
+        # Text sent for the current LLM response. TTSStartedFrame, the
+        # processing metrics, TTSStoppedFrame and the TextFrame are pushed
+        # once per response, not for every word we send.
+        self._response_words = None
+
+        # The response being spoken is tracked as one sentence for the
+        # metrics. It is done once ElevenLabs has aligned as many characters
+        # as we sent, after the flush at the end of the response.
+        self._tts_metrics = TTSMetricsTracker(str(self), self._bytes_per_second)
+        self._response = None
+        self._response_chars_sent = 0
+        self._response_chars_received = 0
+        self._flushed = False
+
+    def can_generate_metrics(self) -> bool:
+        return True
+
+    async def set_voice(self, voice: str):
+        logger.debug(f"Switching TTS voice to: [{voice}]")
+        self._voice_id = voice
+        await self._disconnect()
+        await self._connect()
+
+    async def start(self, frame: StartFrame):
+        await super().start(frame)
+        await self._connect()
+
+    async def stop(self, frame: EndFrame):
+        await super().stop(frame)
+        # The response ends with the call: wait for its last audio before
+        # ending it and closing the stream.
+        await self._finish_stream()
+        await self._end_response()
+        await self._disconnect()
+
+    async def cancel(self, frame: CancelFrame):
+        await super().cancel(frame)
+        await self._disconnect()
+
+    async def _connect(self):
+        url = (f"{self._url}/{self._voice_id}/stream-input"
+               f"?model_id={self._model}&output_format={self._output_format}"
+               f"&optimize_streaming_latency={self._optimize_streaming_latency}"
+               f"&inactivity_timeout={self._inactivity_timeout}")
+        try:
+            self._websocket = await websockets.connect(url)
+            # The first message opens the stream.
+            await self._websocket.send(json_dumps({
+                "text": " ",
+                "xi_api_key": self._api_key,
+                "generation_config": {"chunk_length_schedule": self._chunk_length_schedule},
+            }))
+            self._receive_task = self.get_event_loop().create_task(self._receive_task_handler())
+        except Exception as e:
+            logger.exception(f"{self} initialization error: {e}")
+            self._websocket = None
+
+    async def _disconnect(self):
+        try:
+            await self._cancel_connect()
+            if self._close_tasks:
+                await asyncio.gather(*self._close_tasks, return_exceptions=True)
+            if self._receive_task:
+                self._receive_task.cancel()
+                try:
+                    await self._receive_task
+                except asyncio.CancelledError:
+                    pass
+                self._receive_task = None
+            if self._websocket:
+                ws = self._websocket
+                self._websocket = None
+                await ws.close()
+            self._response = None
+            await self.stop_all_metrics()
+        except Exception as e:
+            logger.exception(f"{self} error closing websocket: {e}")
+
+    async def _cancel_connect(self):
+        if self._connect_task:
+            self._connect_task.cancel()
+            try:
+                await self._connect_task
+            except asyncio.CancelledError:
+                pass
+            self._connect_task = None
+
+    async def _ensure_connected(self):
+        if self._connect_task:
+            await self._connect_task
+            self._connect_task = None
+        if not self._websocket or not self._receive_task or self._receive_task.done():
+            await self._disconnect()
+            await self._connect()
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        if isinstance(frame, AudioPlayoutFrame):
+            self._tts_metrics.handle_playout(frame)
+        elif isinstance(frame, (LLMFullResponseEndFrame, EndFrame)):
+            # Send the rest of the text and end the response before
+            # TTSService pushes the frame, so the response's TextFrame goes
+            # before it. On EndFrame, `stop()` ends the response once the
+            # audio has arrived.
+            await self._push_tts_frames(self._current_sentence)
+            self._current_sentence = ""
+            await self._flush()
+            if isinstance(frame, LLMFullResponseEndFrame):
+                await self._end_response()
+        await super().process_frame(frame, direction)
+
+    async def _process_text_frame(self, frame: TextFrame):
+        # ElevenLabs does its own buffering (see `chunk_length_schedule`), so
+        # send the text word by word instead of waiting for sentences. Whole
+        # words only: TTSService strips the text it passes to `run_tts`, so a
+        # word split across tokens would lose the space around it. The rest
+        # is sent at the end of the response.
+        self._current_sentence += frame.text
+        end = max(self._current_sentence.rfind(" "), self._current_sentence.rfind("\n"))
+        if end > 0:
+            text = self._current_sentence[:end]
+            self._current_sentence = self._current_sentence[end:]
+            await self._push_tts_frames(text)
+
+    async def _push_tts_frames(self, text: str, text_passthrough: bool = True):
+        text = text.strip()
+        if not text:
+            return
+        if self._response_words is None:
+            self._response_words = []
+            await self.push_frame(TTSStartedFrame())
+            await self.start_processing_metrics()
+        if text_passthrough:
+            self._response_words.append(text)
+        async for frame in self.run_tts(text):
+            if frame:
+                await self.push_frame(frame)
+
+    async def _end_response(self):
+        if self._response_words is None:
+            return
+        text = " ".join(self._response_words)
+        self._response_words = None
+        await self.stop_processing_metrics()
+        await self.push_frame(TTSStoppedFrame())
+        if self._push_text_frames and text:
+            await self.push_frame(TextFrame(text))
+
+    async def _handle_interruption(self, frame: StartInterruptionFrame, direction: FrameDirection):
+        await super()._handle_interruption(frame, direction)
+        self._tts_metrics.reset()
+        # Interrupted text isn't added to the context.
+        self._response_words = None
+        # A stream can't be cancelled, whatever ElevenLabs has buffered would
+        # still be spoken. Drop it and open a new one in the background; the
+        # close handshake isn't waited for either, so barge-in isn't delayed.
+        await self._cancel_connect()
+        if self._receive_task:
+            self._receive_task.cancel()
+            try:
+                await self._receive_task
+            except asyncio.CancelledError:
+                pass
+            self._receive_task = None
+        if self._websocket:
+            task = self.get_event_loop().create_task(self._close_websocket(self._websocket))
+            self._close_tasks.add(task)
+            task.add_done_callback(self._close_tasks.discard)
+            self._websocket = None
+        self._response = None
+        await self.stop_all_metrics()
+        self._connect_task = self.get_event_loop().create_task(self._connect())
+
+    async def _close_websocket(self, websocket):
+        try:
+            await websocket.close()
+        except Exception as e:
+            logger.debug(f"{self} error closing websocket: {e}")
+
+    async def _finish_stream(self):
+        # An empty text closes the stream: ElevenLabs synthesizes what is
+        # left, sends a final message and closes the websocket, which ends
+        # the receive task.
+        if not self._websocket or not self._receive_task or self._receive_task.done():
+            return
+        try:
+            await self._websocket.send(json_dumps({"text": ""}))
+            await asyncio.wait_for(asyncio.shield(self._receive_task), timeout=self._stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self} timed out waiting for the last audio")
+        except Exception as e:
+            logger.exception(f"{self} error closing stream: {e}")
+
+    async def _flush(self):
+        # Synthesize whatever is still buffered.
+        if not self._websocket or not self._response:
+            return
+        try:
+            await self._websocket.send(json_dumps({"text": " ", "flush": True}))
+            self._flushed = True
+        except Exception as e:
+            logger.exception(f"{self} error flushing: {e}")
+
+    async def _receive_task_handler(self):
+        try:
+            async for message in self._websocket:
+                msg = json_loads(message)
+                if msg.get("audio"):
+                    audio = b64decode(msg["audio"])
+                    if self._response and self._response.first_byte_time is None:
+                        await self.stop_ttfb_metrics()
+                    self._tts_metrics.add_audio(self._response, len(audio))
+                    await self.push_frame(self._audio_frame_type(audio, self._sample_rate, 1))
+                alignment = msg.get("alignment")
+                if alignment and self._response:
+                    self._response_chars_received += sum(not c.isspace() for c in alignment["chars"])
+                    if self._flushed and self._response_chars_received >= self._response_chars_sent:
+                        await self._finish_response_metrics()
+                if msg.get("isFinal"):
+                    break
+        except Exception as e:
+            logger.exception(f"{self} exception: {e}")
+
+    async def _finish_response_metrics(self):
+        metrics_frame = self._tts_metrics.finish(self._response)
+        self._response = None
+        if metrics_frame:
+            await self.push_frame(metrics_frame)
+
+    async def run_tts(self, text: str) -> AsyncGenerator[Frame, None]:
+        logger.debug(f"Generating TTS: [{text}]")
+
+        try:
+            await self._ensure_connected()
+
+            if self._response and self._flushed:
+                # ElevenLabs aligned fewer characters than we sent for the
+                # previous response; don't let it run into this one.
+                await self._finish_response_metrics()
+            if not self._response:
+                await self.start_ttfb_metrics()
+                self._response = self._tts_metrics.start(text)
+                self._response_chars_sent = 0
+                self._response_chars_received = 0
+                self._flushed = False
+            else:
+                self._response.text += " " + text
+            self._response_chars_sent += sum(not c.isspace() for c in text)
+
+            await self._websocket.send(json_dumps({"text": text + " ", "try_trigger_generation": True}))
+            yield None
+        except Exception as e:
+            logger.exception(f"{self} exception: {e}")
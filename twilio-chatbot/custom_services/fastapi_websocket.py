@@ -7,21 +7,31 @@
 
 import asyncio
 import io
+import time
 import wave
 
 from typing import Awaitable, Callable
 from pydantic.main import BaseModel
 
-from pipecat.processors.frame_processor import FrameProcessor
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
 from pipecat.serializers.base_serializer import FrameSerializer
 from pipecat.transports.base_input import BaseInputTransport
 from pipecat.transports.base_output import BaseOutputTransport
 from pipecat.transports.base_transport import BaseTransport, TransportParams
 from pipecat.frames.frames import (
     AudioRawFrame,
+    CancelFrame,
+    EndFrame,
+    Frame,
     StartFrame,
     StartInterruptionFrame,
-    StopInterruptionFrame)
+    StopInterruptionFrame,
+    TTSStoppedFrame)
+from pipecat.vad.vad_analyzer import VADAnalyzer, VADState
+
+from custom_services.frames import AudioPlayoutFrame, PlayoutMarkFrame, UlawAudioRawFrame
+from custom_services.jitter_buffer import AudioJitterBuffer
+from custom_services.ring_buffer import AudioRingBuffer
 
 from loguru import logger
 
@@ -37,12 +47,166 @@ except ModuleNotFoundError as e:
 
 class FastAPIWebsocketParams(TransportParams):
     add_wav_header: bool = False
-    audio_frame_size: int = 6400  # 200ms
+    # If not set, the frame size is derived from `audio_frame_ms` and the
+    # output sample rate.
+    audio_frame_size: int | None = None
+    audio_frame_ms: int = 20
+    # How much audio we are allowed to send ahead of real time. Anything sent
+    # ahead is queued on the client and can't be interrupted.
+    audio_send_lead_ms: int = 100
+    # Send a playout mark to the client every `audio_mark_ms` of audio. The
+    # acknowledgements tell us how much audio the caller actually heard. Set
+    # to 0 to disable.
+    audio_mark_ms: int = 100
+    # Output audio is already μ-law (telephony-native TTS output) and is sent
+    # without transcoding.
+    audio_out_ulaw: bool = False
+    # Receive binary websocket messages instead of text. Use it with a
+    # serializer that produces bytes (e.g. BinaryFrameSerializer).
+    binary_mode: bool = False
+    # Group inbound packets into blocks of `audio_in_block_ms` before pushing
+    # them into the pipeline, reordering them by sequence number and waiting
+    # at most `audio_in_jitter_ms` for late ones. Set to 0 to push every
+    # packet as it arrives.
+    audio_in_block_ms: int = 0
+    audio_in_jitter_ms: int = 60
+    # Inbound audio waits for the VAD/audio task in a bounded per-call
+    # queue. When that task falls behind, the oldest audio is dropped once
+    # the queue is full or once it has waited `audio_in_max_age_ms` (0
+    # disables the age check), so the bot answers what the caller is saying
+    # now and memory stays bounded.
+    audio_in_queue_size: int = 50
+    audio_in_max_age_ms: int = 500
+    # The VAD/audio task hands audio to the task pushing frames downstream
+    # through another queue, which holds at most `audio_in_push_queue_size`
+    # audio frames. Once full, the oldest audio frame is dropped. Other
+    # frames are never dropped.
+    audio_in_push_queue_size: int = 50
+    # Outbound frames wait to be sent in a queue holding at most
+    # `audio_out_queue_ms` of audio. Once it is full, pushing more audio
+    # waits, so the audio queued per call stays bounded.
+    audio_out_queue_ms: int = 1000
     serializer: FrameSerializer
 
+    def get_audio_out_bytes_per_second(self) -> int:
+        sample_width = 1 if self.audio_out_ulaw else 2
+        return self.audio_out_sample_rate * self.audio_out_channels * sample_width
+
+    def get_audio_frame_size(self) -> int:
+        if self.audio_frame_size:
+            return self.audio_frame_size
+        return self.get_audio_out_bytes_per_second() // 1000 * self.audio_frame_ms
+
 class FastAPIWebsocketCallbacks(BaseModel):
     on_client_connected: Callable[[WebSocket], Awaitable[None]]
     on_client_disconnected: Callable[[WebSocket], Awaitable[None]]
+    on_playout_mark: Callable[[str], Awaitable[None]]
+
+class AudioInputQueueStats:
+    """Counters for the bounded inbound audio queue."""
+
+    def __init__(self):
+        self.queued = 0
+        self.dropped_full = 0
+        self.dropped_stale = 0
+        self.dropped_push = 0
+        self.depth = 0
+        self.max_depth = 0
+
+    def __str__(self):
+        return (f"queued: {self.queued}, dropped (full): {self.dropped_full}, "
+                f"dropped (stale): {self.dropped_stale}, dropped (push): {self.dropped_push}, "
+                f"max depth: {self.max_depth}")
+
+
+class AudioInputQueue(asyncio.Queue):
+    """Replaces BaseInputTransport's unbounded audio-in queue, so the limits
+    apply where the audio is consumed (by the VAD/audio task). Puts never
+    block: when the queue is full the oldest frame is dropped. Frames that
+    waited more than `max_age` seconds are dropped when they are taken.
+
+    """
+
+    def __init__(self, size: int, max_age: float, stats: AudioInputQueueStats):
+        super().__init__()
+        self._size = size
+        self._max_age = max_age
+        self._stats = stats
+        # Set while the consumer waits for audio, i.e. it has processed
+        # everything it took.
+        self._idle = asyncio.Event()
+
+    def put_nowait(self, frame: AudioRawFrame):
+        stats = self._stats
+        if self.qsize() >= self._size:
+            super().get_nowait()
+            self.task_done()
+            stats.dropped_full += 1
+
+        super().put_nowait((time.monotonic(), frame))
+        self._idle.clear()
+
+        stats.queued += 1
+        stats.depth = self.qsize()
+        stats.max_depth = max(stats.max_depth, stats.depth)
+
+    async def get(self) -> AudioRawFrame:
+        stats = self._stats
+        while True:
+            if self.empty():
+                self._idle.set()
+            queued_time, frame = await super().get()
+            stats.depth = self.qsize()
+            if self._max_age and time.monotonic() - queued_time > self._max_age:
+                self.task_done()
+                stats.dropped_stale += 1
+                continue
+            return frame
+
+    async def wait_idle(self):
+        """Waits until the consumer has processed all the queued audio.
+        Unlike join(), this doesn't depend on the consumer calling
+        task_done(): BaseInputTransport skips it when processing a frame
+        fails.
+
+        """
+        await self._idle.wait()
+
+
+class PushFrameQueue(asyncio.Queue):
+    """Replaces BaseInputTransport's unbounded push queue, which holds
+    `(frame, direction)` pairs. Puts never block: when it already holds
+    `audio_size` audio frames the oldest one is dropped. Other frames are
+    always kept, in order.
+
+    """
+
+    def __init__(self, audio_size: int, stats: AudioInputQueueStats):
+        super().__init__()
+        self._audio_size = audio_size
+        self._stats = stats
+        self._audio = 0
+
+    def _put(self, item: tuple[Frame, FrameDirection]):
+        frame, _ = item
+        if isinstance(frame, AudioRawFrame):
+            if self._audio >= self._audio_size:
+                for i, (queued, _) in enumerate(self._queue):
+                    if isinstance(queued, AudioRawFrame):
+                        del self._queue[i]
+                        break
+                self._audio -= 1
+                self.task_done()
+                self._stats.dropped_push += 1
+            self._audio += 1
+        self._queue.append(item)
+
+    def _get(self) -> tuple[Frame, FrameDirection]:
+        item = self._queue.popleft()
+        if isinstance(item[0], AudioRawFrame):
+            self._audio -= 1
+        return item
+
 
 class FastAPIWebsocketInputTransport(BaseInputTransport):
 
@@ -52,47 +216,330 @@ class FastAPIWebsocketInputTransport(BaseInputTransport):
             params: FastAPIWebsocketParams,
             callbacks: FastAPIWebsocketCallbacks,
             **kwargs):
+        # Used by `_create_push_task()`, which the base class calls.
+        self._audio_queue_stats = AudioInputQueueStats()
+
         super().__init__(params, **kwargs)
 
         self._websocket = websocket
         self._params = params
         self._callbacks = callbacks
 
+        self._jitter_buffer = None
+        if self._params.audio_in_block_ms:
+            self._jitter_buffer = AudioJitterBuffer(
+                block_ms=self._params.audio_in_block_ms,
+                max_delay_ms=self._params.audio_in_jitter_ms)
+
+    @property
+    def audio_queue_stats(self) -> AudioInputQueueStats:
+        return self._audio_queue_stats
+
     async def start(self, frame: StartFrame):
         await self._callbacks.on_client_connected(self._websocket)
         await super().start(frame)
+        if self._params.audio_in_enabled or self._params.vad_enabled:
+            # The audio task hasn't run yet and looks the queue up on every
+            # iteration, so it only ever sees this one.
+            self._audio_in_queue = AudioInputQueue(
+                self._params.audio_in_queue_size,
+                self._params.audio_in_max_age_ms / 1000,
+                self._audio_queue_stats)
         self._receive_task = self.get_event_loop().create_task(self._receive_messages())
 
+    def _create_push_task(self):
+        # Same as BaseInputTransport but with a queue bounded on audio. It is
+        # created again after every interruption.
+        self._push_queue = PushFrameQueue(self._params.audio_in_push_queue_size, self._audio_queue_stats)
+        self._push_frame_task = self.get_event_loop().create_task(self._push_frame_task_handler())
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        if isinstance(frame, (EndFrame, CancelFrame)):
+            await self._flush_jitter_buffer(wait=isinstance(frame, EndFrame))
+        await super().process_frame(frame, direction)
+
     async def stop(self):
+        logger.debug(f"{self} audio queue stats: {self._audio_queue_stats}")
+        if self._jitter_buffer:
+            logger.debug(f"{self} jitter buffer stats: {self._jitter_buffer}")
         if self._websocket.client_state != WebSocketState.DISCONNECTED:
             await self._websocket.close()
         await super().stop()
 
+    async def _handle_audio_packet(self, frame: AudioRawFrame):
+        if not self._jitter_buffer:
+            await self.push_audio_frame(frame)
+            return
+
+        for block in self._jitter_buffer.push(frame):
+            await self.push_audio_frame(block)
+
+    async def _flush_jitter_buffer(self, wait: bool):
+        if not self._jitter_buffer:
+            return
+        blocks = self._jitter_buffer.flush()
+        for block in blocks:
+            await self.push_audio_frame(block)
+        if not blocks or not wait or not isinstance(getattr(self, "_audio_in_queue", None), AudioInputQueue):
+            return
+        # Let the audio task process the tail of the call before the base
+        # class stops it.
+        try:
+            await asyncio.wait_for(self._audio_in_queue.wait_idle(), timeout=1.0)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self} timed out processing the flushed inbound audio")
+
+    async def _vad_analyze(self, audio_frames: bytes) -> VADState:
+        vad_analyzer = self.vad_analyzer()
+        if not vad_analyzer:
+            return VADState.QUIET
+        return await self.get_event_loop().run_in_executor(
+            self._executor, self._analyze_vad_windows, vad_analyzer, audio_frames)
+
+    def _analyze_vad_windows(self, vad_analyzer: VADAnalyzer, audio: bytes) -> VADState:
+        # VADAnalyzer.analyze_audio() runs the model on a single window per
+        # call and keeps the rest. Blocks longer than a window (e.g. 40ms of
+        # 8kHz audio against Silero's 32ms window) would pile up in its
+        # buffer and VAD would fall further behind for the whole call, so
+        # feed it one window at a time.
+        window = vad_analyzer.num_frames_required() * self._params.audio_in_channels * 2
+        state = vad_analyzer.analyze_audio(audio[:window])
+        for i in range(window, len(audio), window):
+            state = vad_analyzer.analyze_audio(audio[i:i + window])
+        return state
+
     async def _receive_messages(self):
-        async for message in self._websocket.iter_text():
+        if self._params.binary_mode:
+            messages = self._websocket.iter_bytes()
+        else:
+            messages = self._websocket.iter_text()
+
+        async for message in messages:
             frame = self._params.serializer.deserialize(message)
 
             if not frame:
                 continue
 
             if isinstance(frame, AudioRawFrame):
-                await self.push_audio_frame(frame)
+                await self._handle_audio_packet(frame)
+            elif isinstance(frame, PlayoutMarkFrame):
+                await self._callbacks.on_playout_mark(frame.mark)
 
         await self._callbacks.on_client_disconnected(self._websocket)
 
 
+class AudioSendStats:
+    """Tracks how late the output clock wakes up compared to when it wanted
+    to send a frame.
+
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.paced_frames = 0
+        self.mean_jitter = 0.0
+        self.max_jitter = 0.0
+
+    def add_frame(self):
+        self.frames += 1
+
+    def add_paced_frame(self, jitter: float):
+        self.paced_frames += 1
+        self.mean_jitter += (jitter - self.mean_jitter) / self.paced_frames
+        self.max_jitter = max(self.max_jitter, jitter)
+
+    def __str__(self):
+        return (f"frames: {self.frames}, paced: {self.paced_frames}, "
+                f"mean jitter: {self.mean_jitter * 1000:.2f}ms, "
+                f"max jitter: {self.max_jitter * 1000:.2f}ms")
+
+
 class FastAPIWebsocketOutputTransport(BaseOutputTransport):
     def __init__(self, websocket: WebSocket, params: FastAPIWebsocketParams, **kwargs):
         super().__init__(params, **kwargs)
         self._websocket = websocket
         self._params = params
-        self._audio_buffer = bytes()
+
+        frame_size = self._params.get_audio_frame_size()
+        # Audio is copied into the ring once and frames are sent as views
+        # into it, so long TTS replies don't copy the pending buffer over and
+        # over again.
+        self._audio_buffer = AudioRingBuffer(frame_size)
+        self._audio_frame_type = UlawAudioRawFrame if self._params.audio_out_ulaw else AudioRawFrame
+
+        # Playout clock. Frames are sent at real time with at most
+        # `audio_send_lead_ms` queued on the client, so the memory used by a
+        # call doesn't depend on how long the reply is.
+        bytes_per_second = self._params.get_audio_out_bytes_per_second()
+        self._bytes_per_second = bytes_per_second
+        self._send_interval = frame_size / bytes_per_second
+        self._send_lead = self._params.audio_send_lead_ms / 1000
+        self._next_send_time = 0.0
+        self._send_stats = AudioSendStats()
+
+        # Time from receiving a StartInterruptionFrame until the client has
+        # been told to drop its audio, one entry per interruption.
+        self._interruption_latencies = []
+
+        # Playout tracking. Marks are named after the segment and the amount
+        # of audio sent before them, and are kept in send order.
+        # `_stream_sent_secs` is the audio sent since the last interruption.
+        self._mark_interval = self._params.audio_mark_ms / 1000
+        self._playout_segment = 0
+        self._segment_sent_secs = 0.0
+        self._segment_marked_secs = 0.0
+        self._stream_sent_secs = 0.0
+        self._pending_marks = {}
+
+    @property
+    def send_stats(self) -> AudioSendStats:
+        return self._send_stats
+
+    def _create_sink_task(self):
+        # Same as BaseOutputTransport but with a bounded queue. Audio is
+        # queued in chunks of `_audio_chunk_size` bytes.
+        chunk_secs = self._audio_chunk_size / self._params.get_audio_out_bytes_per_second()
+        maxsize = max(round(self._params.audio_out_queue_ms / 1000 / chunk_secs), 1)
+        self._sink_queue = asyncio.Queue(maxsize=maxsize)
+        self._sink_task = self.get_event_loop().create_task(self._sink_task_handler())
+
+    async def _handle_audio(self, frame: AudioRawFrame):
+        # Same as BaseOutputTransport, but the queue might be replaced by an
+        # interruption while we wait for room. The rest of the frame belongs
+        # to the interrupted reply.
+        queue = self._sink_queue
+        audio = frame.audio
+        for i in range(0, len(audio), self._audio_chunk_size):
+            chunk = AudioRawFrame(audio[i: i + self._audio_chunk_size],
+                                  sample_rate=frame.sample_rate, num_channels=frame.num_channels)
+            await queue.put(chunk)
+            if queue is not self._sink_queue:
+                return
+
+    async def _handle_interruptions(self, frame: Frame):
+        queue = self._sink_queue
+        await super()._handle_interruptions(frame)
+        if queue is not self._sink_queue:
+            # The old queue is dropped, make room in it so whoever is waiting
+            # to push into it isn't blocked forever.
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def _internal_push_frame(
+            self,
+            frame: Frame | None,
+            direction: FrameDirection | None = FrameDirection.DOWNSTREAM):
+        # Frames other than audio come through the sink queue after the audio
+        # before them has been written. Mark the end of the reply, otherwise
+        # up to `audio_mark_ms` of it would never be acknowledged.
+        if isinstance(frame, TTSStoppedFrame) and self._segment_sent_secs > self._segment_marked_secs:
+            await self._write_playout_mark()
+        await super()._internal_push_frame(frame, direction)
+
+    @property
+    def interruption_latencies(self) -> list[float]:
+        return self._interruption_latencies
+
+    async def stop(self):
+        logger.debug(f"{self} audio send stats: {self._send_stats}")
+        if self._interruption_latencies:
+            latencies = self._interruption_latencies
+            logger.debug(
+                f"{self} interruptions: {len(latencies)}, "
+                f"mean latency: {sum(latencies) / len(latencies) * 1000:.2f}ms, "
+                f"max latency: {max(latencies) * 1000:.2f}ms")
+        await super().stop()
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        interruption_time = time.monotonic()
+
+        # The base class cancels the task writing audio, so by the time it
+        # returns nothing else will be sent for the interrupted reply.
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, StartInterruptionFrame):
+            await self._handle_start_interruption(frame, interruption_time)
+
+    async def handle_playout_mark(self, name: str):
+        if name not in self._pending_marks:
+            # Marks we dropped on interruption are sent back by the client
+            # when it clears its buffer.
+            return
+
+        # Marks are acknowledged in order, so anything sent before this one
+        # has been played as well.
+        while True:
+            mark_name, (segment, played_secs, stream_secs) = next(iter(self._pending_marks.items()))
+            del self._pending_marks[mark_name]
+            if mark_name == name:
+                break
+
+        await self.push_frame(
+            AudioPlayoutFrame(segment=segment, played_secs=played_secs, stream_secs=stream_secs),
+            FrameDirection.UPSTREAM)
+
+    def _start_playout_segment(self):
+        self._playout_segment += 1
+        self._segment_sent_secs = 0.0
+        self._segment_marked_secs = 0.0
+
+    async def _write_playout_mark(self):
+        name = f"{self._playout_segment}:{self._segment_sent_secs:.3f}"
+        self._pending_marks[name] = (self._playout_segment, self._segment_sent_secs, self._stream_sent_secs)
+        self._segment_marked_secs = self._segment_sent_secs
+        await self._write_frame(PlayoutMarkFrame(mark=name))
+
+    async def _handle_start_interruption(self, frame: StartInterruptionFrame, interruption_time: float):
+        # Audio the client still had queued when we were interrupted.
+        queued = max(self._next_send_time - interruption_time, 0.0)
+
+        self._audio_buffer.clear()
+        self._next_send_time = 0.0
+        self._pending_marks.clear()
+        self._stream_sent_secs = 0.0
+
+        # Ask the client to drop whatever it has buffered (Twilio "clear").
+        await self._write_frame(frame)
+
+        latency = time.monotonic() - interruption_time
+        self._interruption_latencies.append(latency)
+        logger.debug(
+            f"{self} interrupted, dropped {queued * 1000:.0f}ms of queued audio "
+            f"in {latency * 1000:.2f}ms")
+
+    async def _write_frame(self, frame: Frame):
+        payload = self._params.serializer.serialize(frame)
+        if not payload or self._websocket.client_state != WebSocketState.CONNECTED:
+            return
+        if isinstance(payload, bytes):
+            await self._websocket.send_bytes(payload)
+        else:
+            await self._websocket.send_text(payload)
+
+    async def _write_audio_sleep(self):
+        now = time.monotonic()
+        # If we ran out of audio the client is not playing anything, so start
+        # the clock again from now.
+        if self._next_send_time < now:
+            self._next_send_time = now
+            self._start_playout_segment()
+
+        wait = self._next_send_time - now - self._send_lead
+        if wait > 0:
+            await asyncio.sleep(wait)
+            jitter = time.monotonic() - (self._next_send_time - self._send_lead)
+            self._send_stats.add_paced_frame(max(jitter, 0.0))
+        self._send_stats.add_frame()
+
+        self._next_send_time += self._send_interval
 
     async def write_raw_audio_frames(self, frames: bytes):
-        self._audio_buffer += frames
-        while len(self._audio_buffer) >= self._params.audio_frame_size:
-            frame = AudioRawFrame(
-                audio=self._audio_buffer[:self._params.audio_frame_size],
+        self._audio_buffer.write(frames)
+        while (audio := self._audio_buffer.read_frame()) is not None:
+            await self._write_audio_sleep()
+
+            frame = self._audio_frame_type(
+                audio=audio,
                 sample_rate=self._params.audio_out_sample_rate,
                 num_channels=self._params.audio_out_channels
             )
@@ -112,11 +559,12 @@ class FastAPIWebsocketOutputTransport(BaseOutputTransport):
                     num_channels=frame.num_channels)
                 frame = wav_frame
 
-            payload = self._params.serializer.serialize(frame)
-            if payload and self._websocket.client_state == WebSocketState.CONNECTED:
-                await self._websocket.send_text(payload)
+            await self._write_frame(frame)
 
-            self._audio_buffer = self._audio_buffer[self._params.audio_frame_size:]
+            self._segment_sent_secs += len(audio) / self._bytes_per_second
+            self._stream_sent_secs += len(audio) / self._bytes_per_second
+            if self._mark_interval and self._segment_sent_secs - self._segment_marked_secs >= self._mark_interval:
+                await self._write_playout_mark()
 
 class FastAPIWebsocketTransport(BaseTransport):
     def __init__(
@@ -132,6 +580,7 @@ class FastAPIWebsocketTransport(BaseTransport):
         self._callbacks = FastAPIWebsocketCallbacks(
             on_client_connected=self._on_client_connected,
             on_client_disconnected=self._on_client_disconnected,
+            on_playout_mark=self._on_playout_mark,
         )
 
         self._input = FastAPIWebsocketInputTransport(
@@ -154,4 +603,7 @@ class FastAPIWebsocketTransport(BaseTransport):
         await self._call_event_handler("on_client_connected", websocket)
 
     async def _on_client_disconnected(self, websocket):
-        await self._call_event_handler("on_client_disconnected", websocket)
\ No newline at end of file
+        await self._call_event_handler("on_client_disconnected", websocket)
+
+    async def _on_playout_mark(self, name: str):
+        await self._output.handle_playout_mark(name)
\ No newline at end of file
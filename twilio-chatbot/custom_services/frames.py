@@ -0,0 +1,102 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Frames used by the custom services on top of the ones pipecat provides.
+
+from dataclasses import dataclass
+
+from pipecat.frames.frames import AudioRawFrame, SystemFrame
+
+
+@dataclass
+class UlawAudioRawFrame(AudioRawFrame):
+    """Audio that is already G.711 μ-law encoded (one byte per sample), as
+    produced by TTS services in telephony-native mode. Serializers send it as
+    is instead of transcoding.
+
+    """
+    pass
+
+
+@dataclass
+class SequencedAudioRawFrame(AudioRawFrame):
+    """Inbound audio tagged with the sequence number the client gave it, so
+    the input transport can put packets back in order.
+
+    """
+    sequence_number: int
+
+
+@dataclass
+class TelephonyAudioRawFrame(SequencedAudioRawFrame):
+    """Inbound telephony audio. `audio` is 16-bit PCM at the line rate (so
+    VAD keeps working) and `ulaw` is the original μ-law payload, which STT
+    services can send untouched.
+
+    """
+    ulaw: bytes
+
+
+@dataclass
+class PlayoutMarkFrame(SystemFrame):
+    """A named marker in the outbound audio stream. The output transport sends
+    it after a chunk of audio and the client sends it back once everything
+    before it has been played. The mark name is `mark`, `name` is taken by
+    pipecat's frame name.
+
+    """
+    mark: str
+
+
+@dataclass
+class AudioPlayoutFrame(SystemFrame):
+    """Pushed upstream by the output transport when the client confirms
+    playout. `played_secs` is how much audio of the current playout segment
+    the caller has heard. A segment starts whenever the client was idle (or
+    was interrupted) and new audio is sent. `stream_secs` is how much audio
+    the caller has heard since the last interruption, across segments, so it
+    can be matched with the audio pushed downstream since then.
+
+    """
+    segment: int
+    played_secs: float
+    stream_secs: float
+
+
+@dataclass
+class ConnectionRecoveryFrame(SystemFrame):
+    """Pushed by a service after its streaming connection dropped and was
+    reopened. `reconnects` counts the connection's reconnects so far and
+    `recovery_secs` is how long this outage lasted. `lost_audio_secs` is the
+    audio that couldn't be replayed into the new connection.
+
+    """
+    service: str
+    reconnects: int
+    recovery_secs: float
+    lost_audio_secs: float = 0.0
+
+
+@dataclass
+class STTUtteranceMetricsFrame(SystemFrame):
+    """Latency metrics of one user utterance transcribed by an STT service,
+    see custom_services/stt_metrics.py.
+
+    """
+    service: str
+    final_latency_secs: float
+    interim_results: int
+    mean_interim_interval_secs: float | None
+    words_per_second: float
+    max_processing_lag_secs: float
+
+
+@dataclass
+class SpeculativeTranscriptionFrame(SystemFrame):
+    """What the user has said so far in the current turn, once the interim
+    transcripts stopped changing. The LLM may start generating a response to
+    it before the turn is over.
+
+    """
+    text: str
@@ -5,7 +5,9 @@
 #
 
 # Edited by Kyle Jeong
-import base64
+import asyncio
+import re
+import time
 
 from pipecat.frames.frames import (
     Frame,
@@ -20,6 +22,9 @@ from pipecat.processors.frame_processor import FrameDirection
 from pipecat.services.ai_services import LLMService
 from pipecat.processors.aggregators.openai_llm_context import OpenAILLMContext, OpenAILLMContextFrame
 
+from custom_services.codec import b64encode
+from custom_services.frames import SpeculativeTranscriptionFrame
+
 from loguru import logger
 
 try:
@@ -30,6 +35,47 @@ except ModuleNotFoundError as e:
         "In order to use Groq, you need to `pip install groq`. Also, set `GROQ_API_KEY` environment variable.")
     raise Exception(f"Missing module: {e}")
 
+
+def _normalize_transcript(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+class _Speculation:
+
+    def __init__(self, text: str, messages: list):
+        self.text = text
+        # The conversation the completion was generated for.
+        self.messages = messages
+        self.start_time = time.time()
+        self.first_token_time = None
+        self.turn_time = None
+        self.error = None
+        # Generated text, None once the completion is over.
+        self.chunks = asyncio.Queue()
+        self.task = None
+
+    def failed(self) -> bool:
+        return self.error is not None and self.first_token_time is None
+
+
+class SpeculationStats:
+    """Counters for speculative responses."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved_secs = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self):
+        return (f"hit rate {self.hit_rate:.0%} ({self.hits}/{self.hits + self.misses}), "
+                f"{self.saved_secs / max(self.hits, 1):.3f}s saved per hit")
+
+
 class GroqLLMService(LLMService):
     def __init__(
             self,
@@ -41,6 +87,17 @@ class GroqLLMService(LLMService):
         self._client = AsyncGroq(api_key=api_key)
         self._model = model
         self._max_tokens = max_tokens
+
+        # Speculative turns (see SpeculativeTurnProcessor): a response to
+        # the user's turn so far is generated before the turn is over and
+        # kept if the final transcript matches.
+        self._messages = None
+        self._speculation = None
+        self._speculation_stats = SpeculationStats()
+
+    @property
+    def speculation_stats(self) -> SpeculationStats:
+        return self._speculation_stats
     
     def can_generate_metrics(self) -> bool:
         return True
@@ -57,7 +114,7 @@ class GroqLLMService(LLMService):
                 role = "user"
             if message.get("mime_type") == "image/jpeg":
                 # vision frame
-                encoded_image = base64.b64encode(message["data"].getvalue()).decode("utf-8")
+                encoded_image = b64encode(message["data"].getvalue())
                 groq_messages.append({
                     "role": role,
                     "content": [{
@@ -87,6 +144,97 @@ class GroqLLMService(LLMService):
 
         return groq_messages
 
+    def _start_speculation(self, text: str):
+        self._cancel_speculation()
+        # The user aggregator adds the turn to the messages once it's over.
+        messages = list(self._messages) + [{"role": "user", "content": text}]
+        speculation = _Speculation(text, messages)
+        context = OpenAILLMContext.from_messages(messages)
+        speculation.task = self.get_event_loop().create_task(self._speculate(speculation, context))
+        self._speculation = speculation
+
+    def _cancel_speculation(self):
+        if self._speculation:
+            self._speculation.task.cancel()
+            self._speculation = None
+
+    async def _speculate(self, speculation: _Speculation, context: OpenAILLMContext):
+        try:
+            response = await self._client.chat.completions.create(
+                messages=self._get_messages_from_openai_context(context),
+                model=self._model,
+                max_tokens=self._max_tokens,
+                stream=True
+            )
+            async for chunk in response:
+                if chunk.choices[0].delta.content is not None:
+                    if speculation.first_token_time is None:
+                        speculation.first_token_time = time.time()
+                    speculation.chunks.put_nowait(chunk.choices[0].delta.content)
+        except Exception as e:
+            speculation.error = e
+            logger.exception(f"{self} speculation exception: {e}")
+        finally:
+            speculation.chunks.put_nowait(None)
+
+    def _take_speculation(self, messages: list) -> _Speculation | None:
+        """Returns the speculation if it answered the same conversation as
+        `messages`, cancelling it otherwise.
+
+        """
+        speculation = self._speculation
+        self._speculation = None
+        if not speculation:
+            return None
+
+        speculation.turn_time = time.time()
+        last = messages[-1] if messages else {}
+        # Anything added to the conversation after the speculation started
+        # (e.g. a partial assistant reply) makes it answer a different one.
+        if (messages[:-1] == speculation.messages[:-1] and
+                last.get("role") == "user" and
+                _normalize_transcript(str(last.get("content"))) == _normalize_transcript(speculation.text) and
+                not speculation.failed()):
+            return speculation
+
+        speculation.task.cancel()
+        self._record_speculation(None)
+        return None
+
+    def _record_speculation(self, hit: _Speculation | None):
+        stats = self._speculation_stats
+        if hit:
+            # Without speculation the first token would come a full TTFT
+            # after the turn.
+            ttft = (hit.first_token_time or hit.turn_time) - hit.start_time
+            stats.hits += 1
+            stats.saved_secs += max(min(hit.turn_time - hit.start_time, ttft), 0.0)
+        else:
+            stats.misses += 1
+        logger.debug(f"{self} speculation {'hit' if hit else 'miss'}: {stats}")
+
+    async def _process_speculation(self, speculation: _Speculation) -> bool:
+        """Pushes the speculative response. Returns False, without pushing
+        anything, if the completion failed before producing any text.
+
+        """
+        await self.start_ttfb_metrics()
+        text = await speculation.chunks.get()
+        if speculation.failed():
+            self._record_speculation(None)
+            return False
+        await self.stop_ttfb_metrics()
+        self._record_speculation(speculation)
+
+        await self.push_frame(LLMFullResponseStartFrame())
+        try:
+            while text is not None:
+                await self.push_frame(TextFrame(text))
+                text = await speculation.chunks.get()
+        finally:
+            await self.push_frame(LLMFullResponseEndFrame())
+        return True
+
     async def _process_context(self, context: OpenAILLMContext):
         await self.push_frame(LLMFullResponseStartFrame())
         try:
@@ -121,7 +269,15 @@ class GroqLLMService(LLMService):
 
         if isinstance(frame, OpenAILLMContextFrame):
             context: OpenAILLMContext = frame.context
+        elif isinstance(frame, SpeculativeTranscriptionFrame):
+            if self._messages is not None:
+                self._start_speculation(frame.text)
         elif isinstance(frame, LLMMessagesFrame):
+            # The aggregators keep adding to this same list.
+            self._messages = frame.messages
+            speculation = self._take_speculation(frame.messages)
+            if speculation and await self._process_speculation(speculation):
+                return
             context = OpenAILLMContext.from_messages(frame.messages)
         elif isinstance(frame, VisionImageRawFrame):
             context = OpenAILLMContext.from_image_frame(frame)
@@ -0,0 +1,146 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Inbound jitter buffer for the websocket input transport. Clients send small
+# (usually 20ms) packets. We put them back in sequence order, conceal the
+# ones that never arrive and hand larger blocks to the pipeline, so VAD, STT
+# and the rest of the processors run a few times less per second.
+
+import numpy as np
+
+from pipecat.frames.frames import AudioRawFrame
+
+from custom_services.audio_dsp import ulaw_encode
+from custom_services.frames import SequencedAudioRawFrame, TelephonyAudioRawFrame
+
+
+def _sequence_delta(sequence_number: int, expected: int) -> int:
+    # Sequence numbers may be 16-bit and wrap around.
+    return (sequence_number - expected + 0x8000) % 0x10000 - 0x8000
+
+
+class AudioJitterBuffer:
+    """Reorders inbound packets and groups them into `block_ms` blocks.
+
+    A missing packet is waited for until `max_delay_ms` of newer audio has
+    arrived behind it. It is then concealed: the previous packet is repeated
+    once and longer gaps are filled with silence. The delay added to any
+    packet is at most `block_ms + max_delay_ms`.
+
+    """
+
+    def __init__(self, block_ms: int = 60, max_delay_ms: int = 60, packet_ms: int = 20):
+        self._block_secs = block_ms / 1000
+        self._reorder_window = max(max_delay_ms // packet_ms, 1)
+
+        self._packets = {}
+        self._next_sequence_number = None
+        self._last_packet = None
+        self._concealing = False
+
+        self._block = []
+        self._block_secs_pending = 0.0
+
+        self.received = 0
+        self.late = 0
+        self.concealed = 0
+        self.blocks = 0
+
+    def __str__(self):
+        return (f"received: {self.received}, late: {self.late}, "
+                f"concealed: {self.concealed}, blocks: {self.blocks}")
+
+    def push(self, frame: AudioRawFrame) -> list[AudioRawFrame]:
+        """Adds a packet and returns the blocks that are ready, if any."""
+        self.received += 1
+        blocks = []
+
+        if not isinstance(frame, SequencedAudioRawFrame):
+            self._append(frame, blocks)
+            return blocks
+
+        if self._next_sequence_number is None:
+            self._next_sequence_number = frame.sequence_number
+
+        delta = _sequence_delta(frame.sequence_number, self._next_sequence_number)
+        if delta < 0:
+            # Already concealed (or a duplicate), too late to use it.
+            self.late += 1
+            return blocks
+
+        self._packets[self._next_sequence_number + delta] = frame
+        self._drain(blocks)
+        return blocks
+
+    def flush(self) -> list[AudioRawFrame]:
+        """Returns whatever is buffered, concealing any gaps."""
+        blocks = []
+        while self._packets:
+            self._append(self._next_packet(), blocks)
+        if self._block:
+            blocks.append(self._merge_block())
+        return blocks
+
+    def _drain(self, blocks: list[AudioRawFrame]):
+        while self._packets:
+            if self._next_sequence_number not in self._packets:
+                newest = max(self._packets)
+                if newest - self._next_sequence_number < self._reorder_window:
+                    break
+            self._append(self._next_packet(), blocks)
+
+    def _next_packet(self) -> AudioRawFrame:
+        frame = self._packets.pop(self._next_sequence_number, None)
+        self._next_sequence_number += 1
+        if frame:
+            self._last_packet = frame
+            self._concealing = False
+            return frame
+
+        self.concealed += 1
+        last = self._last_packet
+        if not self._concealing:
+            # Repeating the previous packet once sounds better than a hole.
+            self._concealing = True
+            return last
+
+        audio = bytes(len(last.audio))
+        if isinstance(last, TelephonyAudioRawFrame):
+            return TelephonyAudioRawFrame(
+                audio=audio,
+                sample_rate=last.sample_rate,
+                num_channels=last.num_channels,
+                sequence_number=self._next_sequence_number - 1,
+                ulaw=b"\xff" * len(last.ulaw))
+        return AudioRawFrame(audio=audio, sample_rate=last.sample_rate, num_channels=last.num_channels)
+
+    def _append(self, frame: AudioRawFrame, blocks: list[AudioRawFrame]):
+        self._block.append(frame)
+        self._block_secs_pending += len(frame.audio) / (frame.sample_rate * frame.num_channels * 2)
+        if self._block_secs_pending >= self._block_secs:
+            blocks.append(self._merge_block())
+
+    def _merge_block(self) -> AudioRawFrame:
+        frames = self._block
+        self._block = []
+        self._block_secs_pending = 0.0
+        self.blocks += 1
+
+        first = frames[0]
+        audio = b"".join(f.audio for f in frames)
+        telephony = [f for f in frames if isinstance(f, TelephonyAudioRawFrame)]
+        if telephony:
+            # Keep the μ-law payload for the whole block, STT services send
+            # it as is. Any other frame in a telephony stream is 8kHz PCM
+            # and is encoded.
+            ulaw = b"".join(
+                f.ulaw if isinstance(f, TelephonyAudioRawFrame) else ulaw_encode(np.frombuffer(f.audio, dtype=np.int16))
+                for f in frames)
+            return TelephonyAudioRawFrame(
+                audio=audio,
+                sample_rate=first.sample_rate,
+                num_channels=first.num_channels,
+                sequence_number=telephony[0].sequence_number,
+                ulaw=ulaw)
+        return AudioRawFrame(audio=audio, sample_rate=first.sample_rate, num_channels=first.num_channels)
@@ -0,0 +1,176 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Event loop monitor. Every call's pipeline runs on the same uvicorn event
+# loop, so one blocking coroutine delays all calls. The monitor samples loop
+# lag and, with `trace_tasks`, times every step of every task and attributes
+# it to the call and the frame processor (or other object) that owns the
+# coroutine. Tracing wraps every coroutine, so it is meant for debugging a
+# slow loop rather than for production.
+#
+# Calls are identified through the `current_call` context variable: set it
+# before starting the call's pipeline and every task created from there on
+# is attributed to that call.
+
+import asyncio
+import collections.abc
+import time
+
+from collections import deque
+from contextvars import ContextVar
+
+from loguru import logger
+
+current_call: ContextVar[str | None] = ContextVar("current_call", default=None)
+
+
+class _CallStats:
+
+    def __init__(self):
+        self.steps = 0
+        self.busy_secs = 0.0
+        self.slow_steps = 0
+
+
+class _MonitoredCoroutine(collections.abc.Coroutine):
+    """Wraps a task's coroutine and times each step the event loop runs."""
+
+    def __init__(self, coro, monitor: "EventLoopMonitor", call_id: str | None):
+        self._coro = coro
+        self._monitor = monitor
+        self.call_id = call_id
+
+        owner = None
+        frame = getattr(coro, "cr_frame", None)
+        if frame is not None:
+            owner = frame.f_locals.get("self")
+        self.owner = str(owner) if owner is not None else None
+        self.coro_name = getattr(coro, "__qualname__", repr(coro))
+
+    def send(self, value):
+        start = time.perf_counter()
+        try:
+            return self._coro.send(value)
+        finally:
+            self._monitor._record_step(self, time.perf_counter() - start)
+
+    def throw(self, *args):
+        start = time.perf_counter()
+        try:
+            return self._coro.throw(*args)
+        finally:
+            self._monitor._record_step(self, time.perf_counter() - start)
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+
+class EventLoopMonitor:
+
+    def __init__(
+            self,
+            *,
+            sample_interval: float = 0.1,
+            trace_tasks: bool = False,
+            slow_step_threshold: float = 0.05,
+            max_slow_steps: int = 100):
+        self._sample_interval = sample_interval
+        self._trace_tasks = trace_tasks
+        self._slow_step_threshold = slow_step_threshold
+
+        self._loop = None
+        self._sample_task = None
+
+        self._lag = 0.0
+        self._max_lag = 0.0
+        self._mean_lag = 0.0
+
+        self._calls: dict[str | None, _CallStats] = {}
+        self._slow_steps = deque(maxlen=max_slow_steps)
+
+    def start(self):
+        """Installs the monitor on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        if self._trace_tasks:
+            self._loop.set_task_factory(self._task_factory)
+        self._sample_task = self._loop.create_task(self._sample_task_handler())
+
+    async def stop(self):
+        if self._loop and self._trace_tasks:
+            self._loop.set_task_factory(None)
+        if self._sample_task:
+            self._sample_task.cancel()
+            try:
+                await self._sample_task
+            except asyncio.CancelledError:
+                pass
+            self._sample_task = None
+
+    def end_call(self, call_id: str):
+        self._calls.pop(call_id, None)
+
+    def snapshot(self) -> dict:
+        tasks = {}
+        for task in asyncio.all_tasks(self._loop):
+            coro = task.get_coro()
+            call_id = coro.call_id if isinstance(coro, _MonitoredCoroutine) else None
+            tasks[call_id] = tasks.get(call_id, 0) + 1
+
+        calls = {}
+        for call_id in set(self._calls) | set(tasks):
+            stats = self._calls.get(call_id, _CallStats())
+            calls[call_id or "-"] = {
+                "tasks": tasks.get(call_id, 0),
+                "steps": stats.steps,
+                "busy_secs": round(stats.busy_secs, 4),
+                "slow_steps": stats.slow_steps,
+            }
+
+        return {
+            "lag": {
+                "current_ms": round(self._lag * 1000, 2),
+                "mean_ms": round(self._mean_lag * 1000, 2),
+                "max_ms": round(self._max_lag * 1000, 2),
+            },
+            "calls": calls,
+            "slow_steps": list(self._slow_steps),
+        }
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if asyncio.iscoroutine(coro) and not isinstance(coro, _MonitoredCoroutine):
+            coro = _MonitoredCoroutine(coro, self, current_call.get())
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    def _record_step(self, coro: _MonitoredCoroutine, duration: float):
+        stats = self._calls.get(coro.call_id)
+        if not stats:
+            stats = self._calls[coro.call_id] = _CallStats()
+        stats.steps += 1
+        stats.busy_secs += duration
+
+        if duration >= self._slow_step_threshold:
+            stats.slow_steps += 1
+            self._slow_steps.append({
+                "time": time.time(),
+                "call": coro.call_id,
+                "owner": coro.owner,
+                "coroutine": coro.coro_name,
+                "duration_ms": round(duration * 1000, 2),
+            })
+            logger.warning(
+                f"Slow task step: {coro.coro_name} ({coro.owner}) blocked the event loop "
+                f"for {duration * 1000:.1f}ms [call: {coro.call_id}]")
+
+    async def _sample_task_handler(self):
+        samples = 0
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self._sample_interval)
+            self._lag = max(time.monotonic() - start - self._sample_interval, 0.0)
+            self._max_lag = max(self._max_lag, self._lag)
+            samples += 1
+            self._mean_lag += (self._lag - self._mean_lag) / samples
@@ -0,0 +1,90 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Preallocated audio ring buffer used by the websocket output transport. Audio
+# is copied in exactly once and handed out as fixed-size memoryviews.
+
+
+class AudioRingBuffer:
+
+    def __init__(self, frame_size: int, capacity: int | None = None):
+        if frame_size <= 0:
+            raise ValueError(f"frame_size must be positive, got {frame_size}")
+
+        self._frame_size = frame_size
+        # Keep the capacity a multiple of the frame size. Reads always advance
+        # by a whole frame, so the read position stays frame aligned and a
+        # frame never straddles the end of the buffer.
+        capacity = max(capacity or frame_size * 16, frame_size)
+        capacity = -(-capacity // frame_size) * frame_size
+
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._read = 0
+        self._size = 0
+        self.bytes_copied = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def frame_size(self) -> int:
+        return self._frame_size
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    def clear(self):
+        self._read = 0
+        self._size = 0
+
+    def write(self, data: bytes):
+        length = len(data)
+        if length == 0:
+            return
+        if self._size + length > len(self._buffer):
+            self._grow(self._size + length)
+
+        capacity = len(self._buffer)
+        start = (self._read + self._size) % capacity
+        first = min(length, capacity - start)
+        self._view[start:start + first] = data[:first]
+        if first < length:
+            self._view[:length - first] = data[first:]
+        self._size += length
+        self.bytes_copied += length
+
+    def read_frame(self) -> memoryview | None:
+        """Returns the next frame as a view into the buffer, or None if there
+        is not a full frame available. The view is only valid until the next
+        call to `write()`.
+
+        """
+        if self._size < self._frame_size:
+            return None
+
+        frame = self._view[self._read:self._read + self._frame_size]
+        self._read = (self._read + self._frame_size) % len(self._buffer)
+        self._size -= self._frame_size
+        return frame
+
+    def _grow(self, needed: int):
+        capacity = len(self._buffer)
+        while capacity < needed:
+            capacity *= 2
+
+        buffer = bytearray(capacity)
+        end = self._read + self._size
+        if end <= len(self._buffer):
+            buffer[:self._size] = self._view[self._read:end]
+        else:
+            head = len(self._buffer) - self._read
+            buffer[:head] = self._view[self._read:]
+            buffer[head:self._size] = self._view[:end - len(self._buffer)]
+        self.bytes_copied += self._size
+
+        self._buffer = buffer
+        self._view = memoryview(self._buffer)
+        self._read = 0
@@ -0,0 +1,92 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Watches the transcripts of the user's turn and, once they have been stable
+# for `stable_ms`, sends the text so far downstream as a
+# SpeculativeTranscriptionFrame. GroqLLMService starts generating from it
+# and keeps the result if the final turn says the same thing.
+#
+# Goes between the STT service and the user response aggregator. Turns are
+# delimited the way LLMUserResponseAggregator does it: a turn is over once
+# the user stopped speaking and there is a final transcript.
+
+import asyncio
+
+from pipecat.frames.frames import (
+    CancelFrame,
+    EndFrame,
+    Frame,
+    InterimTranscriptionFrame,
+    TranscriptionFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+from custom_services.frames import SpeculativeTranscriptionFrame
+
+
+class SpeculativeTurnProcessor(FrameProcessor):
+
+    def __init__(self, *, stable_ms: int = 300, min_words: int = 2, **kwargs):
+        super().__init__(**kwargs)
+        self._stable_secs = stable_ms / 1000
+        self._min_words = min_words
+
+        self._finals = []
+        self._interim = ""
+        self._user_speaking = False
+        self._candidate = ""
+        self._speculated = ""
+        self._timer_task = None
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, (EndFrame, CancelFrame)):
+            self._end_turn()
+        elif isinstance(frame, UserStartedSpeakingFrame):
+            self._user_speaking = True
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            self._user_speaking = False
+            if self._finals:
+                self._end_turn()
+        elif isinstance(frame, TranscriptionFrame):
+            self._finals.append(frame.text)
+            self._interim = ""
+            if not self._user_speaking:
+                self._end_turn()
+            else:
+                self._update()
+        elif isinstance(frame, InterimTranscriptionFrame):
+            self._interim = frame.text
+            self._update()
+
+        await self.push_frame(frame, direction)
+
+    def _end_turn(self):
+        self._finals = []
+        self._interim = ""
+        self._candidate = ""
+        self._speculated = ""
+        self._cancel_timer()
+
+    def _update(self):
+        text = " ".join(self._finals + [self._interim]).strip()
+        if text == self._candidate:
+            return
+        self._candidate = text
+        self._cancel_timer()
+        if len(text.split()) >= self._min_words and text != self._speculated:
+            self._timer_task = self.get_event_loop().create_task(self._timer_task_handler(text))
+
+    def _cancel_timer(self):
+        if self._timer_task:
+            self._timer_task.cancel()
+            self._timer_task = None
+
+    async def _timer_task_handler(self, text: str):
+        await asyncio.sleep(self._stable_secs)
+        self._timer_task = None
+        self._speculated = text
+        await self.push_frame(SpeculativeTranscriptionFrame(text=text))
@@ -0,0 +1,191 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# STT latency metrics, per utterance (from VAD start of speech to the first
+# final transcript after VAD end of speech):
+#
+#   final_latency      VAD end of speech to the final transcript
+#   interim_interval   time between interim results while the user speaks
+#   words_per_second   final transcript words over the speech duration
+#   processing_lag     audio sent minus the end of the audio the result
+#                      covers, as reported by the provider
+#
+# Connection outages are counted too (reconnect recovery time and the audio
+# that was lost, i.e. not replayed into the new connection).
+#
+# Every utterance produces an STTUtteranceMetricsFrame and is added to the
+# process-wide histograms (served on /debug/stt).
+
+import bisect
+import time
+
+from loguru import logger
+
+from custom_services.frames import STTUtteranceMetricsFrame
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0]
+WORDS_PER_SECOND_BUCKETS = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0]
+
+
+class Histogram:
+
+    def __init__(self, buckets: list[float]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{b:g}": c for b, c in zip(self._buckets, self._counts)}
+        buckets["inf"] = self._counts[-1]
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 4) if self.count else None,
+            "buckets": buckets,
+        }
+
+
+class STTHistograms:
+
+    def __init__(self):
+        self.final_latency = Histogram(LATENCY_BUCKETS)
+        self.interim_interval = Histogram(LATENCY_BUCKETS)
+        self.words_per_second = Histogram(WORDS_PER_SECOND_BUCKETS)
+        self.processing_lag = Histogram(LATENCY_BUCKETS)
+        self.reconnect_recovery = Histogram(LATENCY_BUCKETS)
+        self.lost_audio = Histogram(LATENCY_BUCKETS)
+
+    def snapshot(self) -> dict:
+        return {
+            "final_latency_secs": self.final_latency.snapshot(),
+            "interim_interval_secs": self.interim_interval.snapshot(),
+            "words_per_second": self.words_per_second.snapshot(),
+            "processing_lag_secs": self.processing_lag.snapshot(),
+            "reconnect_recovery_secs": self.reconnect_recovery.snapshot(),
+            "lost_audio_secs": self.lost_audio.snapshot(),
+        }
+
+
+class _Utterance:
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.stop_time = None
+        self.last_interim_time = None
+        self.interim_results = 0
+        self.interim_intervals = []
+        self.words = 0
+        self.max_processing_lag = 0.0
+
+
+class STTMetricsTracker:
+
+    def __init__(self, service: str, histograms: "STTHistograms | None" = None):
+        self._service = service
+        self._histograms = histograms or get_default_stt_histograms()
+        self._audio_secs = 0.0
+        self._utterance = None
+
+    def audio_sent(self, secs: float):
+        self._audio_secs += secs
+
+    def reconnected(self, recovery_secs: float, lost_audio_secs: float):
+        self._histograms.reconnect_recovery.add(recovery_secs)
+        self._histograms.lost_audio.add(lost_audio_secs)
+
+    def speech_started(self) -> STTUtteranceMetricsFrame | None:
+        """Starts a new utterance. Returns the metrics of the previous one if
+        it was left open: its transcript was final before the end of speech
+        and no final came after it.
+
+        """
+        frame = None
+        utterance = self._utterance
+        if utterance and utterance.stop_time is not None and utterance.words:
+            frame = self._finish(utterance, 0.0)
+        self._utterance = _Utterance()
+        return frame
+
+    def speech_stopped(self):
+        if self._utterance:
+            self._utterance.stop_time = time.time()
+
+    def result(self, transcript: str, is_final: bool, start: float, duration: float) -> STTUtteranceMetricsFrame | None:
+        """Records a transcript (`start` and `duration` locate the audio it
+        covers in the stream) and returns the utterance metrics once the
+        utterance is done, i.e. on the first final after the end of speech,
+        even an empty one.
+
+        """
+        now = time.time()
+        lag = max(self._audio_secs - (start + duration), 0.0)
+        self._histograms.processing_lag.add(lag)
+
+        utterance = self._utterance
+        if not utterance:
+            return None
+        utterance.max_processing_lag = max(utterance.max_processing_lag, lag)
+
+        if not is_final:
+            if not transcript:
+                return None
+            if utterance.last_interim_time is not None:
+                interval = now - utterance.last_interim_time
+                utterance.interim_intervals.append(interval)
+                self._histograms.interim_interval.add(interval)
+            utterance.last_interim_time = now
+            utterance.interim_results += 1
+            return None
+
+        utterance.words += len(transcript.split())
+        if utterance.stop_time is None:
+            return None
+
+        self._utterance = None
+        if transcript:
+            final_latency = now - utterance.stop_time
+        elif utterance.words:
+            # Deepgram's endpointing finalized the transcript before the VAD
+            # detected the end of speech; this is the (empty) answer to
+            # Finalize.
+            final_latency = 0.0
+        else:
+            # Nothing was said.
+            return None
+        return self._finish(utterance, final_latency)
+
+    def _finish(self, utterance: _Utterance, final_latency: float) -> STTUtteranceMetricsFrame:
+        speech_secs = utterance.stop_time - utterance.start_time
+        words_per_second = utterance.words / speech_secs if speech_secs > 0 else 0.0
+        intervals = utterance.interim_intervals
+        self._histograms.final_latency.add(final_latency)
+        self._histograms.words_per_second.add(words_per_second)
+
+        frame = STTUtteranceMetricsFrame(
+            service=self._service,
+            final_latency_secs=final_latency,
+            interim_results=utterance.interim_results,
+            mean_interim_interval_secs=sum(intervals) / len(intervals) if intervals else None,
+            words_per_second=words_per_second,
+            max_processing_lag_secs=utterance.max_processing_lag)
+        logger.debug(
+            f"{self._service} utterance: final {final_latency:.3f}s after end of speech, "
+            f"{utterance.interim_results} interim results, {words_per_second:.1f} words/s, "
+            f"max processing lag {utterance.max_processing_lag:.3f}s")
+        return frame
+
+
+_default_histograms: STTHistograms | None = None
+
+
+def get_default_stt_histograms() -> STTHistograms:
+    global _default_histograms
+    if not _default_histograms:
+        _default_histograms = STTHistograms()
+    return _default_histograms
@@ -0,0 +1,86 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Splits streamed LLM text into chunks for TTS. Whole sentences sound best,
+# but waiting for the end of a long first sentence delays the first audio of
+# every response. So the first chunk of a response is flushed early, at the
+# first clause boundary (a comma or a conjunction) after a few words. After
+# that we go back to whole sentences; Cartesia keeps the prosody continuous
+# across the chunks of a context.
+
+import re
+
+# End of sentence. Like pipecat's match_endofsentence, not after a single
+# capital ("J. Smith", "U.S."), a title ("Dr. Smith") or a.m./p.m. After a
+# number ("3.5", "at 9.") or a.m./p.m. only if a new sentence clearly starts.
+_SENTENCE_END = re.compile(r"""
+    (?<![A-Z])
+    (?<!\d)
+    (?<!Mr|Ms|Dr)
+    (?<!Mrs)
+    (?<!Prof)
+    (?<![ap]\.m)
+    [.?!]+["')\]]*(?=\s)
+    |
+    (?:(?<=\d)|(?<=[ap]\.m))[.?!]+(?=\s+[A-Z])
+""", re.VERBOSE)
+
+# A clause boundary: punctuation, or the space before a conjunction. We only
+# split once what follows has started arriving, so "1,000" or "and" being
+# the start of "android" never split.
+_CLAUSE_END = re.compile(
+    r"[,;:]+(?=\s)|\s(?:—|-|–)(?=\s)|(?=\s(?:and|but|so|because|or|which|while)\s)",
+    re.IGNORECASE)
+
+_WORD = re.compile(r"\S+")
+
+
+class TextChunker:
+
+    def __init__(self, first_chunk_min_words: int = 4, first_chunk_max_words: int = 20):
+        self._first_chunk_min_words = first_chunk_min_words
+        self._first_chunk_max_words = first_chunk_max_words
+        self._first_chunk = True
+
+    def reset(self):
+        """Call at the start of every response."""
+        self._first_chunk = True
+
+    def split(self, text: str) -> tuple[str, str] | None:
+        """Returns the next chunk of `text` and the rest, or None if `text`
+        doesn't contain a complete chunk yet.
+
+        """
+        end = self._find_end(text)
+        if not end:
+            return None
+        self._first_chunk = False
+        return text[:end], text[end:].lstrip()
+
+    def _find_end(self, text: str) -> int:
+        match = _SENTENCE_END.search(text)
+        sentence_end = match.end() if match else 0
+        if not self._first_chunk:
+            return sentence_end
+
+        min_end = self._word_end(text, self._first_chunk_min_words)
+        if not min_end:
+            return sentence_end
+        for match in _CLAUSE_END.finditer(text, min_end - 1):
+            end = match.end()
+            if sentence_end and sentence_end <= end:
+                break
+            return end
+
+        # No clause boundary, but don't wait forever on a very long clause.
+        max_end = self._word_end(text, self._first_chunk_max_words)
+        if max_end and not sentence_end and text[max_end:max_end + 1].isspace():
+            return max_end
+        return sentence_end
+
+    def _word_end(self, text: str, count: int) -> int:
+        for i, match in enumerate(_WORD.finditer(text), 1):
+            if i == count:
+                return match.end()
+        return 0
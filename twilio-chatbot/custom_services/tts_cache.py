@@ -0,0 +1,229 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Cache of synthesized audio for phrases the bot says over and over (the
+# greeting, "didn't catch that", ...). There are two tiers:
+#
+#   memory  per-process LRU, bounded by audio bytes
+#   disk    one file per phrase in a directory shared by all the worker
+#           processes, so a phrase synthesized by one worker is a hit for
+#           the others
+#
+# Entries are keyed by provider, voice, model, audio format and normalized
+# text. Cartesia entries also keep the word timestamps. Disk reads, writes
+# and pruning run in the default executor, never on the event loop.
+
+import asyncio
+import hashlib
+import os
+import struct
+import tempfile
+import unicodedata
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from custom_services.codec import json_dumps, json_loads
+
+_HEADER = struct.Struct("!I")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def tts_cache_key(provider: str, voice: str, model: str, audio_format: str, text: str) -> str:
+    key = "\0".join((provider, voice, model, audio_format, normalize_text(text)))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CachedAudio:
+    audio: bytes
+    # (word, end time in seconds) pairs, for services that emit word timestamps.
+    words: list[tuple[str, float]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.audio)
+
+
+class TTSCache:
+
+    def __init__(
+            self,
+            *,
+            max_memory_bytes: int = 32 * 1024 * 1024,
+            directory: str | None = None,
+            max_disk_bytes: int = 512 * 1024 * 1024,
+            max_text_length: int = 300,
+            prune_every: int = 50):
+        self._max_memory_bytes = max_memory_bytes
+        self._max_disk_bytes = max_disk_bytes
+        # Long sentences are rarely repeated word for word.
+        self._max_text_length = max_text_length
+
+        self._memory: OrderedDict[str, CachedAudio] = OrderedDict()
+        self._memory_bytes = 0
+
+        self._directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Pruning scans the whole directory, so only do it every
+        # `prune_every` writes.
+        self._prune_every = max(prune_every, 1)
+        self._writes = 0
+        # Disk writes still running, `flush()` waits for them.
+        self._pending_writes: set[asyncio.Future] = set()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def cacheable(self, text: str) -> bool:
+        return 0 < len(text) <= self._max_text_length
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "pending_writes": len(self._pending_writes),
+        }
+
+    async def get(self, key: str) -> CachedAudio | None:
+        entry = self._memory.get(key)
+        if entry:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+        else:
+            entry = await self._read_file(key)
+            if not entry:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, entry)
+
+        self.bytes_saved += len(entry)
+        return entry
+
+    def put(self, key: str, entry: CachedAudio):
+        """Stores `entry`. The disk write happens in the background."""
+        if not entry.audio:
+            return
+        self._remember(key, entry)
+        if self._directory:
+            self._writes += 1
+            prune = self._writes % self._prune_every == 0
+            future = asyncio.get_running_loop().run_in_executor(None, self._write_file, key, entry, prune)
+            self._pending_writes.add(future)
+            future.add_done_callback(self._write_done)
+
+    async def flush(self):
+        """Waits for the disk writes started so far, call it on shutdown so
+        they aren't lost.
+
+        """
+        if self._pending_writes:
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
+
+    def _write_done(self, future: asyncio.Future):
+        self._pending_writes.discard(future)
+        if not future.cancelled() and future.exception():
+            logger.warning(f"TTS cache write failed: {future.exception()}")
+
+    def _remember(self, key: str, entry: CachedAudio):
+        if len(entry) > self._max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = entry
+        self._memory_bytes += len(entry)
+        while self._memory_bytes > self._max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.tts")
+
+    async def _read_file(self, key: str) -> CachedAudio | None:
+        if not self._directory:
+            return None
+        return await asyncio.to_thread(self._read_file_sync, key)
+
+    def _read_file_sync(self, key: str) -> CachedAudio | None:
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            (header_size,) = _HEADER.unpack_from(data)
+            header = json_loads(data[_HEADER.size:_HEADER.size + header_size])
+            audio = data[_HEADER.size + header_size:]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Unable to read TTS cache entry {key}: {e}")
+            return None
+        return CachedAudio(audio=audio, words=[tuple(w) for w in header["words"]])
+
+    def _write_file(self, key: str, entry: CachedAudio, prune: bool):
+        header = json_dumps({"words": entry.words}).encode("utf-8")
+        try:
+            # Write to a temporary file and rename it, so other workers never
+            # see a partial entry.
+            fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(len(header)))
+                f.write(header)
+                f.write(entry.audio)
+            os.replace(tmp_path, self._path(key))
+            if prune:
+                self._prune_directory()
+        except Exception as e:
+            logger.warning(f"Unable to write TTS cache entry {key}: {e}")
+
+    def _prune_directory(self):
+        files = []
+        total = 0
+        with os.scandir(self._directory) as it:
+            for f in it:
+                if f.name.endswith(".tts"):
+                    try:
+                        stat = f.stat()
+                    except FileNotFoundError:
+                        # Pruned by another worker.
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, f.path))
+                    total += stat.st_size
+        if total <= self._max_disk_bytes:
+            return
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self._max_disk_bytes:
+                break
+
+
+def iter_audio_chunks(audio: bytes, chunk_size: int):
+    for i in range(0, len(audio), chunk_size):
+        yield audio[i:i + chunk_size]
+
+
+_default_cache: TTSCache | None = None
+
+
+def get_default_tts_cache() -> TTSCache:
+    global _default_cache
+    if not _default_cache:
+        directory = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "call-agent-tts-cache"))
+        _default_cache = TTSCache(directory=directory)
+    return _default_cache
@@ -0,0 +1,89 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Per-sentence TTS metrics, comparable across providers:
+#
+#   ttfb               request sent to first audio byte received
+#   real_time_factor   time to synthesize the sentence (from the request to
+#                      its last audio byte) divided by its audio duration
+#   playout_lag        audio generated minus audio the caller has heard, when
+#                      the sentence finished; how far ahead of playout the
+#                      service is (close to zero means the caller is about to
+#                      hear a gap)
+#
+# Played audio comes from the AudioPlayoutFrames the output transport sends
+# upstream.
+#
+# Each sentence is reported as a pipecat MetricsFrame with one `processing`
+# entry: the usual "processor" and "value" (the synthesis time) plus "text",
+# "ttfb_secs", "audio_secs", "real_time_factor" and "playout_lag_secs".
+
+import time
+
+from pipecat.frames.frames import MetricsFrame
+
+from loguru import logger
+
+from custom_services.frames import AudioPlayoutFrame
+
+
+class TTSSentence:
+
+    def __init__(self, text: str):
+        self.text = text
+        self.request_time = time.time()
+        self.first_byte_time = None
+        self.audio_secs = 0.0
+
+
+class TTSMetricsTracker:
+
+    def __init__(self, service: str, bytes_per_second: int):
+        self._service = service
+        self._bytes_per_second = bytes_per_second
+        self._generated_secs = 0.0
+        self._played_secs = 0.0
+
+    @property
+    def playout_lag_secs(self) -> float:
+        return self._generated_secs - self._played_secs
+
+    def reset(self):
+        """Call on interruptions, the audio not played yet is dropped."""
+        self._generated_secs = 0.0
+        self._played_secs = 0.0
+
+    def handle_playout(self, frame: AudioPlayoutFrame):
+        # Both counts start over on interruptions.
+        self._played_secs = frame.stream_secs
+
+    def start(self, text: str) -> TTSSentence:
+        return TTSSentence(text)
+
+    def add_audio(self, sentence: TTSSentence | None, num_bytes: int):
+        secs = num_bytes / self._bytes_per_second
+        self._generated_secs += secs
+        if sentence:
+            if sentence.first_byte_time is None:
+                sentence.first_byte_time = time.time()
+            sentence.audio_secs += secs
+
+    def finish(self, sentence: TTSSentence) -> MetricsFrame | None:
+        if sentence.first_byte_time is None or not sentence.audio_secs:
+            return None
+        synthesis_secs = time.time() - sentence.request_time
+        metrics = {
+            "processor": self._service,
+            "value": synthesis_secs,
+            "text": sentence.text,
+            "ttfb_secs": sentence.first_byte_time - sentence.request_time,
+            "audio_secs": sentence.audio_secs,
+            "real_time_factor": synthesis_secs / sentence.audio_secs,
+            "playout_lag_secs": self.playout_lag_secs,
+        }
+        logger.debug(
+            f"{self._service} TTS [{sentence.text}]: ttfb {metrics['ttfb_secs']:.3f}s, "
+            f"audio {metrics['audio_secs']:.2f}s, RTF {metrics['real_time_factor']:.2f}, "
+            f"playout lag {metrics['playout_lag_secs']:.2f}s")
+        return MetricsFrame(processing=[metrics])
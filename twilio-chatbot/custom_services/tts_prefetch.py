@@ -0,0 +1,210 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Pipelined synthesis for the HTTP TTS services. TTSService synthesizes one
+# sentence at a time, so the next sentence is only requested once the
+# previous one has been fully streamed, and every sentence boundary costs a
+# TTFB of silence. With the mixin, up to `prefetch_depth` sentences are
+# synthesized concurrently while a player task pushes their frames strictly
+# in order, with the same TTSStartedFrame/TTSStoppedFrame and metrics around
+# each sentence as TTSService. Other frames the service pushes downstream
+# (the end of the response, EndFrame, ...) are queued behind the audio in
+# flight.
+#
+# TTFB and processing time are measured per sentence: the base metrics keep
+# a single start time, which concurrent sentences would overwrite.
+
+import asyncio
+import contextvars
+import time
+
+from collections import deque
+
+from pipecat.frames.frames import (
+    CancelFrame,
+    EndFrame,
+    ErrorFrame,
+    Frame,
+    MetricsFrame,
+    StartInterruptionFrame,
+    SystemFrame,
+    TextFrame,
+    TTSStartedFrame,
+    TTSStoppedFrame)
+from pipecat.processors.frame_processor import FrameDirection
+
+from loguru import logger
+
+
+class _Sentence:
+
+    def __init__(self, text: str, text_passthrough: bool):
+        self.text = text
+        self.text_passthrough = text_passthrough
+        self.frames = asyncio.Queue()
+        self.task = None
+        self.ttfb_start_time = None
+        self.processing_secs = None
+
+
+# The sentence synthesized by the current task, if any.
+_synthesizing = contextvars.ContextVar("_synthesizing", default=None)
+
+
+class TTSPrefetchMixin:
+    """Mix into a TTSService subclass (before TTSService). `prefetch_depth` is
+    the number of sentences in flight, including the one being played; 1
+    behaves like TTSService.
+
+    """
+
+    def __init__(self, *, prefetch_depth: int = 2, **kwargs):
+        super().__init__(**kwargs)
+        self._prefetch_depth = max(prefetch_depth, 1)
+        # Sentences and frames, in the order they have to be pushed.
+        self._prefetch_queue = deque()
+        self._prefetch_queue_event = asyncio.Event()
+        self._prefetch_sentences = 0
+        self._prefetch_slot_event = asyncio.Event()
+        # Bumped on interruptions, so sentences waiting for a slot know they
+        # belong to an interrupted response.
+        self._prefetch_generation = 0
+        self._prefetch_player_task = None
+        self._prefetch_ttfb_reported = False
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        if isinstance(frame, CancelFrame):
+            await self._cancel_prefetch()
+        await super().process_frame(frame, direction)
+
+    async def push_frame(self, frame: Frame, direction: FrameDirection = FrameDirection.DOWNSTREAM):
+        if (direction == FrameDirection.DOWNSTREAM and
+                not isinstance(frame, SystemFrame) and
+                self._prefetch_queue_busy()):
+            self._enqueue(frame)
+            return
+        await super().push_frame(frame, direction)
+
+    async def _handle_interruption(self, frame: StartInterruptionFrame, direction: FrameDirection):
+        # Drop everything queued before the interruption goes downstream.
+        await self._cancel_prefetch()
+        await super()._handle_interruption(frame, direction)
+
+    async def start_ttfb_metrics(self):
+        sentence = _synthesizing.get()
+        if not sentence:
+            await super().start_ttfb_metrics()
+            return
+        if self.report_only_initial_ttfb and self._prefetch_ttfb_reported:
+            return
+        self._prefetch_ttfb_reported = True
+        sentence.ttfb_start_time = time.time()
+
+    async def stop_ttfb_metrics(self):
+        sentence = _synthesizing.get()
+        if not sentence:
+            await super().stop_ttfb_metrics()
+            return
+        if sentence.ttfb_start_time is None:
+            return
+        value = time.time() - sentence.ttfb_start_time
+        sentence.ttfb_start_time = None
+        if self.can_generate_metrics() and self.metrics_enabled:
+            logger.debug(f"{self.name} TTFB: {value}")
+            # Played in order, before the audio it measures.
+            sentence.frames.put_nowait(MetricsFrame(ttfb=[{"processor": self.name, "value": value}]))
+
+    async def _push_tts_frames(self, text: str, text_passthrough: bool = True):
+        text = text.strip()
+        if not text:
+            return
+
+        generation = self._prefetch_generation
+        while self._prefetch_sentences >= self._prefetch_depth:
+            self._prefetch_slot_event.clear()
+            await self._prefetch_slot_event.wait()
+            if generation != self._prefetch_generation:
+                return
+
+        sentence = _Sentence(text, text_passthrough)
+        sentence.task = self.get_event_loop().create_task(self._synthesize(sentence))
+        self._prefetch_sentences += 1
+        self._enqueue(sentence)
+
+    def _prefetch_queue_busy(self) -> bool:
+        return bool(self._prefetch_queue) or self._prefetch_sentences > 0
+
+    def _enqueue(self, item: _Sentence | Frame):
+        self._prefetch_queue.append(item)
+        self._prefetch_queue_event.set()
+        if not self._prefetch_player_task or self._prefetch_player_task.done():
+            self._prefetch_player_task = self.get_event_loop().create_task(self._prefetch_player_handler())
+
+    async def _synthesize(self, sentence: _Sentence):
+        _synthesizing.set(sentence)
+        start_time = time.time()
+        try:
+            async for frame in self.run_tts(sentence.text):
+                if frame:
+                    sentence.frames.put_nowait(frame)
+        except Exception as e:
+            logger.exception(f"{self} exception: {e}")
+        finally:
+            sentence.processing_secs = time.time() - start_time
+            sentence.frames.put_nowait(None)
+
+    async def _prefetch_player_handler(self):
+        while True:
+            if not self._prefetch_queue:
+                self._prefetch_queue_event.clear()
+                await self._prefetch_queue_event.wait()
+                continue
+
+            item = self._prefetch_queue[0]
+            if isinstance(item, _Sentence):
+                await self._play(item)
+                self._prefetch_queue.popleft()
+                self._prefetch_sentences -= 1
+                self._prefetch_slot_event.set()
+            else:
+                self._prefetch_queue.popleft()
+                await super().push_frame(item)
+                if isinstance(item, EndFrame):
+                    return
+
+    async def _play(self, sentence: _Sentence):
+        await super().push_frame(TTSStartedFrame())
+        while True:
+            frame = await sentence.frames.get()
+            if frame is None:
+                break
+            if isinstance(frame, ErrorFrame):
+                await super().push_frame(frame, FrameDirection.UPSTREAM)
+            else:
+                await super().push_frame(frame)
+        if self.can_generate_metrics() and self.metrics_enabled:
+            value = sentence.processing_secs
+            logger.debug(f"{self.name} processing time: {value}")
+            await super().push_frame(MetricsFrame(processing=[{"processor": self.name, "value": value}]))
+        await super().push_frame(TTSStoppedFrame())
+        if self._push_text_frames and sentence.text_passthrough:
+            # Like TTSService, the text goes after the audio so it isn't added
+            # to the context if we are interrupted.
+            await super().push_frame(TextFrame(sentence.text))
+
+    async def _cancel_prefetch(self):
+        self._prefetch_generation += 1
+        if self._prefetch_player_task:
+            self._prefetch_player_task.cancel()
+            try:
+                await self._prefetch_player_task
+            except asyncio.CancelledError:
+                pass
+            self._prefetch_player_task = None
+        for item in self._prefetch_queue:
+            if isinstance(item, _Sentence):
+                item.task.cancel()
+        self._prefetch_queue.clear()
+        self._prefetch_sentences = 0
+        self._prefetch_slot_event.set()
@@ -0,0 +1,109 @@
+#
+# Copyright (c) 2024, Daily
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+# Edited by Kyle Jeong
+
+from pipecat.frames.frames import AudioRawFrame, Frame, StartInterruptionFrame
+from pipecat.serializers.base_serializer import FrameSerializer
+
+from custom_services.audio_dsp import UlawDecoder, UlawEncoder, ulaw_decode
+from custom_services.codec import b64decode, b64encode, json_dumps, json_loads
+from custom_services.frames import (
+    PlayoutMarkFrame,
+    SequencedAudioRawFrame,
+    TelephonyAudioRawFrame,
+    UlawAudioRawFrame)
+
+
+class TwilioFrameSerializer(FrameSerializer):
+    SERIALIZABLE_TYPES = {
+        AudioRawFrame: "audio",
+        StartInterruptionFrame: "clear",
+        PlayoutMarkFrame: "mark",
+    }
+
+    def __init__(self, stream_sid: str, sample_rate: int = 16000, native_ulaw: bool = False):
+        self._stream_sid = stream_sid
+        self._sample_rate = sample_rate
+        # In telephony-native mode inbound audio stays at 8kHz and keeps the
+        # original μ-law payload, so STT can be fed without transcoding.
+        self._native_ulaw = native_ulaw
+
+        # The resamplers keep state between frames, so we need one for each
+        # direction of the call.
+        self._decoder = UlawDecoder(sample_rate)
+        self._encoder = UlawEncoder(sample_rate)
+        self._encoder_sample_rate = sample_rate
+
+        # Media messages only differ in their payload, so build the rest of
+        # the JSON once. Base64 never needs escaping.
+        self._media_prefix = f'{{"event":"media","streamSid":{json_dumps(stream_sid)},"media":{{"payload":"'
+        self._media_suffix = '"}}'
+
+    def _media_message(self, ulaw: bytes) -> str:
+        return self._media_prefix + b64encode(ulaw) + self._media_suffix
+
+    def serialize(self, frame: Frame) -> str | bytes | None:
+        if isinstance(frame, UlawAudioRawFrame):
+            return self._media_message(frame.audio)
+
+        if isinstance(frame, AudioRawFrame):
+            if frame.sample_rate != self._encoder_sample_rate:
+                self._encoder = UlawEncoder(frame.sample_rate)
+                self._encoder_sample_rate = frame.sample_rate
+
+            serialized_data = self._encoder.encode(frame.audio)
+            return self._media_message(serialized_data)
+
+        if isinstance(frame, StartInterruptionFrame):
+            # Tells Twilio to drop all the audio it has buffered for the call.
+            # The next audio we send starts a new stream, so don't let the
+            # resampler mix in the tail of the interrupted one.
+            self._encoder.reset()
+            answer = {"event": "clear", "streamSid": self._stream_sid}
+            return json_dumps(answer)
+
+        if isinstance(frame, PlayoutMarkFrame):
+            answer = {
+                "event": "mark",
+                "streamSid": self._stream_sid,
+                "mark": {
+                    "name": frame.mark
+                }
+            }
+            return json_dumps(answer)
+
+        return None
+
+    def deserialize(self, data: str | bytes) -> Frame | None:
+        message = json_loads(data)
+
+        if message["event"] == "mark":
+            # Twilio sends the mark back once the audio before it was played.
+            return PlayoutMarkFrame(mark=message["mark"]["name"])
+        elif message["event"] != "media":
+            return None
+        else:
+            payload_base64 = message["media"]["payload"]
+            payload = b64decode(payload_base64)
+            # Media chunks are numbered from 1 and can arrive out of order.
+            sequence_number = int(message["media"]["chunk"])
+
+            if self._native_ulaw:
+                return TelephonyAudioRawFrame(
+                    audio=ulaw_decode(payload).tobytes(),
+                    num_channels=1,
+                    sample_rate=8000,
+                    sequence_number=sequence_number,
+                    ulaw=payload)
+
+            deserialized_data = self._decoder.decode(payload)
+            audio_frame = SequencedAudioRawFrame(
+                audio=deserialized_data,
+                num_channels=1,
+                sample_rate=self._sample_rate,
+                sequence_number=sequence_number)
+            return audio_frame
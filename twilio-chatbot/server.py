@@ -1,15 +1,35 @@
 import json
+import os
+import secrets
+import uuid
 
 import uvicorn
 
-from fastapi import FastAPI, WebSocket
+from fastapi import Depends, FastAPI, Header, HTTPException, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, JSONResponse
 
 from bot import run_bot 
+from custom_services.loop_monitor import EventLoopMonitor, current_call
+from custom_services.stt_metrics import get_default_stt_histograms
+from custom_services.tts_cache import get_default_tts_cache
 
 app = FastAPI()
 
+# All calls share this process' event loop. The monitor tracks loop lag and,
+# with LOOP_MONITOR_TRACE_TASKS=1, which call and which processor is blocking
+# it (see /debug/loop).
+loop_monitor = EventLoopMonitor(trace_tasks=os.getenv("LOOP_MONITOR_TRACE_TASKS") == "1")
+
+# The /debug endpoints are only served when DEBUG_TOKEN is set, to requests
+# with an `X-Debug-Token` header matching it.
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+
+
+def check_debug_token(x_debug_token: str | None = Header(default=None)):
+    if not DEBUG_TOKEN or not x_debug_token or not secrets.compare_digest(x_debug_token, DEBUG_TOKEN):
+        raise HTTPException(status_code=404)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # Allow all origins for testing
@@ -19,21 +39,53 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def startup():
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await loop_monitor.stop()
+    await get_default_tts_cache().flush()
+
+@app.get('/debug/loop', dependencies=[Depends(check_debug_token)])
+async def debug_loop():
+    return JSONResponse(content=loop_monitor.snapshot())
+
+@app.get('/debug/stt', dependencies=[Depends(check_debug_token)])
+async def debug_stt():
+    return JSONResponse(content=get_default_stt_histograms().snapshot())
+
+@app.get('/debug/tts_cache', dependencies=[Depends(check_debug_token)])
+async def debug_tts_cache():
+    return JSONResponse(content=get_default_tts_cache().stats())
+
 @app.post('/start_call')
 async def start_call():
     print("Call Started")
     return HTMLResponse(content=open("templates/streams.xml").read(), media_type="application/xml")
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, mode: str = "twilio"):
+    # Our own clients connect with `/ws?mode=binary` and start streaming
+    # binary messages right away (see custom_services/binary_serializer.py).
+    # Twilio first sends a "connected" and a "start" message.
+    binary = mode == "binary"
     await websocket.accept()
-    start_data = websocket.iter_text()
-    await start_data.__anext__()
-    call_data = json.loads(await start_data.__anext__())
-    print(call_data, flush=True)
-    stream_sid = call_data['start']['streamSid']
+    if binary:
+        stream_sid = str(uuid.uuid4())
+    else:
+        start_data = websocket.iter_text()
+        await start_data.__anext__()
+        call_data = json.loads(await start_data.__anext__())
+        print(call_data, flush=True)
+        stream_sid = call_data['start']['streamSid']
     print("WebSocket connection accepted")
-    await run_bot(websocket, stream_sid)
+    current_call.set(stream_sid)
+    try:
+        await run_bot(websocket, stream_sid, binary=binary)
+    finally:
+        loop_monitor.end_call(stream_sid)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8765)
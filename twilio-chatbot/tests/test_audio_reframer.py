@@ -0,0 +1,89 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+import random
+
+import pytest
+
+from custom_services.audio_reframer import AudioReframer, reframe_audio
+
+SAMPLE_RATE = 16000
+FRAME_SIZE = SAMPLE_RATE * 2 * 100 // 1000
+
+AUDIO = random.Random(0).randbytes(SAMPLE_RATE * 2 * 3 + 3 * 2)
+
+
+def _odd_pieces(data: bytes, seed: int = 1) -> list[bytes]:
+    # Odd sizes, so every other piece splits a 16-bit sample.
+    rng = random.Random(seed)
+    pieces = []
+    i = 0
+    while i < len(data):
+        size = rng.randrange(1, 2048, 2)
+        pieces.append(data[i:i + size])
+        i += size
+    return pieces
+
+
+def _check_frames(frames: list[bytes], frame_size: int, audio: bytes):
+    assert frames
+    for frame in frames[:-1]:
+        assert len(frame) == frame_size
+    assert 0 < len(frames[-1]) <= frame_size
+    assert all(len(frame) % 2 == 0 for frame in frames)
+    assert b"".join(frames) == audio
+
+
+def test_reframer_push_and_flush():
+    reframer = AudioReframer(FRAME_SIZE)
+    frames = []
+    for piece in _odd_pieces(AUDIO):
+        frames.extend(reframer.push(piece))
+    frames.append(reframer.flush())
+
+    _check_frames(frames, FRAME_SIZE, AUDIO)
+
+
+def test_reframer_aligns_frame_size_to_samples():
+    reframer = AudioReframer(FRAME_SIZE + 1)
+    assert reframer.frame_size == FRAME_SIZE
+
+
+def test_reframer_drops_trailing_partial_sample():
+    reframer = AudioReframer(FRAME_SIZE)
+    assert reframer.push(b"\x01\x02\x03") == []
+    assert reframer.flush() == b"\x01\x02"
+
+
+def test_reframe_audio_from_http_stub():
+    aiohttp = pytest.importorskip("aiohttp")
+    from aiohttp import web
+
+    async def stream_audio(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for piece in _odd_pieces(AUDIO):
+            await response.write(piece)
+            # Make sure the client sees the pieces separately.
+            await asyncio.sleep(0)
+        await response.write_eof()
+        return response
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/audio", stream_audio)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/audio") as r:
+                    return [f async for f in reframe_audio(r.content.iter_chunked(4096), FRAME_SIZE)]
+        finally:
+            await runner.cleanup()
+
+    _check_frames(asyncio.run(run()), FRAME_SIZE, AUDIO)
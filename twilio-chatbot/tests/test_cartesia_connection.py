@@ -0,0 +1,55 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+
+import pytest
+
+websockets = pytest.importorskip("websockets")
+
+from custom_services.cartesia_connection import CartesiaConnection
+
+
+def test_recovery_listeners_run_concurrently():
+    async def run():
+        connections = 0
+
+        async def handler(websocket):
+            nonlocal connections
+            connections += 1
+            if connections == 1:
+                # Drop the first connection so it is reopened.
+                await asyncio.sleep(0.05)
+                await websocket.close()
+                return
+            await websocket.wait_closed()
+
+        events = []
+        recovered = asyncio.Event()
+
+        async def slow_listener(recovery_secs):
+            await asyncio.sleep(0.2)
+            events.append("slow")
+            recovered.set()
+
+        async def failing_listener(recovery_secs):
+            raise RuntimeError("replay failed")
+
+        async def fast_listener(recovery_secs):
+            events.append("fast")
+
+        async with websockets.serve(handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            connection = CartesiaConnection(f"ws://127.0.0.1:{port}", min_backoff=0.01)
+            for listener in (slow_listener, failing_listener, fast_listener):
+                connection.add_recovery_listener(listener)
+            await connection.connect()
+            await asyncio.wait_for(recovered.wait(), timeout=2)
+            await connection.close()
+        return connection, events
+
+    connection, events = asyncio.run(run())
+    assert connection.reconnects == 1
+    # Neither the slow nor the failing listener held up the last one.
+    assert events == ["fast", "slow"]
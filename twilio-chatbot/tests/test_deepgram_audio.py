@@ -0,0 +1,63 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pipecat")
+pytest.importorskip("deepgram")
+
+from deepgram import LiveOptions
+from pipecat.processors.frame_processor import FrameDirection
+
+from custom_services.audio_dsp import ulaw_decode, ulaw_encode
+from custom_services.binary_serializer import AUDIO_PCM16, AUDIO_ULAW, BinaryFrameSerializer
+from custom_services.deepgram_service import DeepgramSTTService
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(data)
+
+
+def _message(message_type, sequence_number, payload):
+    return bytes([message_type, 0]) + sequence_number.to_bytes(2, "big") + payload
+
+
+def _send_binary_messages(*messages):
+    async def run():
+        # The options bot.py uses, binary mode shares them with Twilio.
+        stt = DeepgramSTTService(
+            api_key="test",
+            live_options=LiveOptions(encoding="mulaw", sample_rate=8000, channels=1))
+        stt._connection = FakeConnection()
+        serializer = BinaryFrameSerializer(sample_rate=8000)
+        for message in messages:
+            await stt.process_frame(serializer.deserialize(message), FrameDirection.DOWNSTREAM)
+        return stt._connection.sent
+
+    return asyncio.run(run())
+
+
+def test_pcm16_message_reaches_deepgram_as_ulaw():
+    samples = (np.sin(np.arange(160) / 5) * 8000).astype(np.int16)
+
+    sent = _send_binary_messages(_message(AUDIO_PCM16, 0, samples.tobytes()))
+
+    assert sent == [ulaw_encode(samples)]
+    assert np.abs(ulaw_decode(sent[0]).astype(np.int32) - samples).max() < 300
+
+
+def test_ulaw_message_reaches_deepgram_untouched():
+    ulaw = bytes(range(160))
+
+    sent = _send_binary_messages(_message(AUDIO_ULAW, 0, ulaw))
+
+    assert sent == [ulaw]
@@ -0,0 +1,66 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+import base64
+import json
+
+import pytest
+
+pytest.importorskip("pipecat")
+websockets = pytest.importorskip("websockets")
+
+from pipecat.frames.frames import (
+    AudioRawFrame,
+    EndFrame,
+    StartFrame,
+    TextFrame,
+    TTSStartedFrame,
+    TTSStoppedFrame)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+from custom_services.eleven_labs_service import ElevenLabsWebsocketTTSService
+
+
+async def _stub_handler(websocket):
+    # Like ElevenLabs: audio for the buffered text only comes once the stream
+    # is closed with an empty text, a little later.
+    async for message in websocket:
+        msg = json.loads(message)
+        if msg.get("text") == "":
+            await asyncio.sleep(0.1)
+            audio = base64.b64encode(b"\x00\x01" * 160).decode()
+            await websocket.send(json.dumps({"audio": audio}))
+            await websocket.send(json.dumps({"isFinal": True}))
+            await websocket.close()
+            return
+
+
+class Collector(FrameProcessor):
+
+    def __init__(self):
+        super().__init__()
+        self.frames = []
+
+    async def process_frame(self, frame, direction):
+        self.frames.append(frame)
+
+
+def test_end_frame_waits_for_last_audio():
+    async def run():
+        async with websockets.serve(_stub_handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            tts = ElevenLabsWebsocketTTSService(
+                api_key="test", voice_id="voice", url=f"ws://127.0.0.1:{port}")
+            collector = Collector()
+            tts.link(collector)
+            await tts.process_frame(StartFrame(), FrameDirection.DOWNSTREAM)
+            await tts.process_frame(TextFrame("Goodbye for now"), FrameDirection.DOWNSTREAM)
+            await tts.process_frame(EndFrame(), FrameDirection.DOWNSTREAM)
+            return collector.frames
+
+    frames = [f for f in asyncio.run(run()) if not isinstance(f, StartFrame)]
+    assert [type(f) for f in frames] == [
+        TTSStartedFrame, AudioRawFrame, TTSStoppedFrame, TextFrame, EndFrame]
+    assert frames[3].text == "Goodbye for now"
@@ -0,0 +1,50 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pipecat")
+
+from pipecat.frames.frames import AudioRawFrame
+
+from custom_services.audio_dsp import ulaw_decode, ulaw_encode
+from custom_services.frames import TelephonyAudioRawFrame
+from custom_services.jitter_buffer import AudioJitterBuffer
+
+
+def _telephony_packet(sequence_number, value):
+    ulaw = bytes([value]) * 160
+    return TelephonyAudioRawFrame(
+        audio=ulaw_decode(ulaw).tobytes(),
+        sample_rate=8000,
+        num_channels=1,
+        sequence_number=sequence_number,
+        ulaw=ulaw)
+
+
+def test_mixed_block_keeps_ulaw_payload():
+    buffer = AudioJitterBuffer(block_ms=60)
+    pcm = (np.arange(160) * 50).astype(np.int16)
+    buffer.push(_telephony_packet(0, 0x10))
+    buffer.push(AudioRawFrame(audio=pcm.tobytes(), sample_rate=8000, num_channels=1))
+    [block] = buffer.push(_telephony_packet(1, 0x20))
+
+    assert isinstance(block, TelephonyAudioRawFrame)
+    assert block.ulaw == bytes([0x10]) * 160 + ulaw_encode(pcm) + bytes([0x20]) * 160
+    assert len(block.audio) == 2 * len(block.ulaw)
+
+
+def test_concealed_block_keeps_ulaw_payload():
+    buffer = AudioJitterBuffer(block_ms=100, max_delay_ms=20)
+    blocks = []
+    # Packets 1 and 2 never arrive: 1 repeats packet 0, 2 is silence.
+    for sequence_number in (0, 3, 4, 5):
+        blocks += buffer.push(_telephony_packet(sequence_number, 0x30 + sequence_number))
+    blocks += buffer.flush()
+
+    ulaw = b"".join(block.ulaw for block in blocks)
+    assert all(isinstance(block, TelephonyAudioRawFrame) for block in blocks)
+    assert ulaw == b"".join(bytes([v]) * 160 for v in (0x30, 0x30, 0xFF, 0x33, 0x34, 0x35))
+    assert buffer.concealed == 2
@@ -0,0 +1,73 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("pipecat")
+pytest.importorskip("fastapi")
+
+from pipecat.frames.frames import AudioRawFrame, StartFrame, TTSStartedFrame, TTSStoppedFrame
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from starlette.websockets import WebSocketState
+
+from custom_services.binary_serializer import BinaryFrameSerializer
+from custom_services.fastapi_websocket import FastAPIWebsocketOutputTransport, FastAPIWebsocketParams
+from custom_services.frames import PlayoutMarkFrame
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        self.client_state = WebSocketState.CONNECTED
+        self.sent = []
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+class Collector(FrameProcessor):
+
+    def __init__(self):
+        super().__init__()
+        self.tts_stopped = asyncio.Event()
+
+    async def process_frame(self, frame, direction):
+        if isinstance(frame, TTSStoppedFrame):
+            self.tts_stopped.set()
+
+
+def test_reply_end_is_marked():
+    serializer = BinaryFrameSerializer(sample_rate=8000)
+
+    async def run():
+        websocket = FakeWebSocket()
+        params = FastAPIWebsocketParams(
+            audio_out_enabled=True,
+            audio_out_sample_rate=8000,
+            # Don't pace, there is no client playing the audio.
+            audio_send_lead_ms=10000,
+            audio_mark_ms=100,
+            serializer=serializer)
+        transport = FastAPIWebsocketOutputTransport(websocket, params)
+        collector = Collector()
+        transport.link(collector)
+
+        await transport.process_frame(StartFrame(), FrameDirection.DOWNSTREAM)
+        await transport.process_frame(TTSStartedFrame(), FrameDirection.DOWNSTREAM)
+        # 260ms of audio, more than the interval marks cover.
+        await transport.process_frame(
+            AudioRawFrame(b"\x00" * 4160, sample_rate=8000, num_channels=1), FrameDirection.DOWNSTREAM)
+        await transport.process_frame(TTSStoppedFrame(), FrameDirection.DOWNSTREAM)
+        await asyncio.wait_for(collector.tts_stopped.wait(), timeout=2)
+        await transport.cleanup()
+        return websocket.sent
+
+    frames = [serializer.deserialize(data) for data in asyncio.run(run())]
+    marks = [f.mark for f in frames if isinstance(f, PlayoutMarkFrame)]
+    assert len(marks) == 3
+    # The last mark follows the last audio and covers all of it.
+    assert marks[-1] == "1:0.260"
+    assert isinstance(frames[-1], PlayoutMarkFrame)
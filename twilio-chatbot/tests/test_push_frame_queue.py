@@ -0,0 +1,44 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("pipecat")
+pytest.importorskip("fastapi")
+
+from pipecat.frames.frames import AudioRawFrame, UserStartedSpeakingFrame
+from pipecat.processors.frame_processor import FrameDirection
+
+from custom_services.fastapi_websocket import AudioInputQueueStats, PushFrameQueue
+
+
+def _audio(n):
+    return AudioRawFrame(bytes([n]) * 2, sample_rate=8000, num_channels=1)
+
+
+def test_oldest_audio_is_dropped_and_other_frames_kept():
+    async def run():
+        stats = AudioInputQueueStats()
+        queue = PushFrameQueue(2, stats)
+        speaking = UserStartedSpeakingFrame()
+        queue.put_nowait((_audio(1), FrameDirection.DOWNSTREAM))
+        queue.put_nowait((speaking, FrameDirection.DOWNSTREAM))
+        queue.put_nowait((_audio(2), FrameDirection.DOWNSTREAM))
+        queue.put_nowait((_audio(3), FrameDirection.DOWNSTREAM))
+
+        frames = []
+        while not queue.empty():
+            frame, _ = await queue.get()
+            queue.task_done()
+            frames.append(frame)
+        # Every put was accounted for, dropped or consumed.
+        await asyncio.wait_for(queue.join(), timeout=1)
+        return frames, speaking, stats
+
+    frames, speaking, stats = asyncio.run(run())
+    assert frames[0] is speaking
+    assert [f.audio[0] for f in frames[1:]] == [2, 3]
+    assert stats.dropped_push == 1
@@ -0,0 +1,220 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+import types
+
+import pytest
+
+pytest.importorskip("pipecat")
+pytest.importorskip("groq")
+
+from pipecat.frames.frames import (
+    EndFrame,
+    InterimTranscriptionFrame,
+    LLMMessagesFrame,
+    TextFrame,
+    UserStartedSpeakingFrame)
+from pipecat.processors.frame_processor import FrameDirection
+
+from custom_services.frames import SpeculativeTranscriptionFrame
+from custom_services.groq_service import GroqLLMService
+from custom_services.speculative_turn import SpeculativeTurnProcessor
+
+
+def _chunk(text):
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    """Streams `reply` for every request, or raises `error` for the
+    speculative ones (those sent before the user turn is in the messages).
+
+    """
+
+    def __init__(self, reply, error=None):
+        self._reply = reply
+        self._error = error
+        self.requests = []
+
+    async def create(self, *, messages, **kwargs):
+        self.requests.append(messages)
+        if self._error:
+            raise self._error
+
+        async def stream():
+            for text in self._reply:
+                yield _chunk(text)
+        return stream()
+
+
+def _make_llm(reply, error=None):
+    llm = GroqLLMService(api_key="test")
+    completions = FakeCompletions(reply, error)
+    llm._client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    pushed = []
+
+    async def push_frame(frame, direction=FrameDirection.DOWNSTREAM):
+        pushed.append(frame)
+    llm.push_frame = push_frame
+    return llm, completions, pushed
+
+
+def _text(frames):
+    return "".join(f.text for f in frames if isinstance(f, TextFrame))
+
+
+async def _turn(llm, messages, speculative_text, final_text):
+    """Speculates on `speculative_text` and then ends the turn with
+    `final_text`.
+
+    """
+    await llm.process_frame(SpeculativeTranscriptionFrame(text=speculative_text), FrameDirection.DOWNSTREAM)
+    # Let the speculative completion run.
+    await asyncio.sleep(0.01)
+    messages.append({"role": "user", "content": final_text})
+    await llm.process_frame(LLMMessagesFrame(messages), FrameDirection.DOWNSTREAM)
+
+
+async def _start_conversation(llm):
+    messages = [{"role": "system", "content": "Be brief."}]
+    await llm.process_frame(LLMMessagesFrame(messages), FrameDirection.DOWNSTREAM)
+    messages.append({"role": "assistant", "content": "Hi, how can I help?"})
+    return messages
+
+
+def test_matching_final_commits_speculation():
+    async def run():
+        llm, completions, pushed = _make_llm(["It's ", "noon."])
+        messages = await _start_conversation(llm)
+        pushed.clear()
+
+        await _turn(llm, messages, "what time is it", "What time is it?")
+
+        # The speculative completion is used, no new request is made.
+        assert len(completions.requests) == 2
+        assert _text(pushed) == "It's noon."
+        assert llm.speculation_stats.hits == 1
+        assert llm.speculation_stats.misses == 0
+
+    asyncio.run(run())
+
+
+def test_different_final_cancels_speculation():
+    async def run():
+        llm, completions, pushed = _make_llm(["Sure."])
+        messages = await _start_conversation(llm)
+        pushed.clear()
+
+        await _turn(llm, messages, "what time", "What time do you close?")
+
+        # The speculation is dropped and the turn is answered normally.
+        assert len(completions.requests) == 3
+        assert completions.requests[-1][-1]["content"] == "What time do you close?"
+        assert _text(pushed) == "Sure."
+        assert llm.speculation_stats.misses == 1
+
+    asyncio.run(run())
+
+
+def test_conversation_change_cancels_speculation():
+    async def run():
+        llm, completions, pushed = _make_llm(["Sure."])
+        messages = await _start_conversation(llm)
+
+        await llm.process_frame(SpeculativeTranscriptionFrame(text="book a table"), FrameDirection.DOWNSTREAM)
+        await asyncio.sleep(0.01)
+        # The bot said something more before the user's turn ended.
+        messages.append({"role": "assistant", "content": "Anything else?"})
+        messages.append({"role": "user", "content": "Book a table."})
+        await llm.process_frame(LLMMessagesFrame(messages), FrameDirection.DOWNSTREAM)
+
+        assert len(completions.requests) == 3
+        assert llm.speculation_stats.misses == 1
+
+    asyncio.run(run())
+
+
+def test_failed_speculation_falls_back():
+    async def run():
+        llm, completions, pushed = _make_llm(["Sure."])
+        messages = await _start_conversation(llm)
+        completions._error = RuntimeError("rate limited")
+        await llm.process_frame(SpeculativeTranscriptionFrame(text="book a table"), FrameDirection.DOWNSTREAM)
+        await asyncio.sleep(0.01)
+        completions._error = None
+        pushed.clear()
+
+        messages.append({"role": "user", "content": "Book a table."})
+        await llm.process_frame(LLMMessagesFrame(messages), FrameDirection.DOWNSTREAM)
+
+        assert len(completions.requests) == 3
+        assert _text(pushed) == "Sure."
+        assert llm.speculation_stats.hits == 0
+        assert llm.speculation_stats.misses == 1
+
+    asyncio.run(run())
+
+
+def test_hit_rate():
+    async def run():
+        llm, completions, pushed = _make_llm(["Ok."])
+        messages = await _start_conversation(llm)
+
+        await _turn(llm, messages, "hello there", "Hello there.")
+        messages.append({"role": "assistant", "content": "Ok."})
+        await _turn(llm, messages, "one more", "One more thing.")
+        messages.append({"role": "assistant", "content": "Ok."})
+        await _turn(llm, messages, "thank you", "Thank you!")
+
+        stats = llm.speculation_stats
+        assert (stats.hits, stats.misses) == (2, 1)
+        assert stats.hit_rate == pytest.approx(2 / 3)
+        assert stats.saved_secs >= 0
+
+    asyncio.run(run())
+
+
+def _make_processor(**kwargs):
+    processor = SpeculativeTurnProcessor(**kwargs)
+    pushed = []
+
+    async def push_frame(frame, direction=FrameDirection.DOWNSTREAM):
+        pushed.append(frame)
+    processor.push_frame = push_frame
+    return processor, pushed
+
+
+def _speculations(frames):
+    return [f.text for f in frames if isinstance(f, SpeculativeTranscriptionFrame)]
+
+
+def test_processor_speculates_on_stable_transcript():
+    async def run():
+        processor, pushed = _make_processor(stable_ms=20)
+        await processor.process_frame(UserStartedSpeakingFrame(), FrameDirection.DOWNSTREAM)
+        await processor.process_frame(
+            InterimTranscriptionFrame("what time", "", ""), FrameDirection.DOWNSTREAM)
+        await asyncio.sleep(0.01)
+        await processor.process_frame(
+            InterimTranscriptionFrame("what time is it", "", ""), FrameDirection.DOWNSTREAM)
+        await asyncio.sleep(0.05)
+
+        assert _speculations(pushed) == ["what time is it"]
+
+    asyncio.run(run())
+
+
+def test_processor_cancels_timer_on_end():
+    async def run():
+        processor, pushed = _make_processor(stable_ms=20)
+        await processor.process_frame(UserStartedSpeakingFrame(), FrameDirection.DOWNSTREAM)
+        await processor.process_frame(
+            InterimTranscriptionFrame("what time is it", "", ""), FrameDirection.DOWNSTREAM)
+        await processor.process_frame(EndFrame(), FrameDirection.DOWNSTREAM)
+        await asyncio.sleep(0.05)
+
+        assert _speculations(pushed) == []
+
+    asyncio.run(run())
@@ -0,0 +1,52 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import pytest
+
+from custom_services.text_chunker import TextChunker
+
+
+def _sentences(text: str) -> list[str]:
+    # Never in the first chunk of a response, so only sentence ends split.
+    chunker = TextChunker(first_chunk_min_words=1000, first_chunk_max_words=1000)
+    chunks = []
+    while (split := chunker.split(text)):
+        chunk, text = split
+        chunks.append(chunk)
+    return chunks + [text]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Dr. Smith will call you. Bye",
+     ["Dr. Smith will call you.", "Bye"]),
+    ("Mr. and Mrs. Jones are here. Ms. Lee too. Bye",
+     ["Mr. and Mrs. Jones are here.", "Ms. Lee too.", "Bye"]),
+    ("Prof. Brown agrees. Bye",
+     ["Prof. Brown agrees.", "Bye"]),
+    ("We open at 9 a.m. tomorrow and close at 5 p.m. on Fridays. Bye",
+     ["We open at 9 a.m. tomorrow and close at 5 p.m. on Fridays.", "Bye"]),
+    ("See you at 9 a.m. Bring your card. Bye",
+     ["See you at 9 a.m.", "Bring your card.", "Bye"]),
+    ("J. Smith lives in the U.S. now. Bye",
+     ["J. Smith lives in the U.S. now.", "Bye"]),
+    ("It costs 3.5 dollars. Call 555. Today",
+     ["It costs 3.5 dollars.", "Call 555.", "Today"]),
+    ("Really? Yes! Ok",
+     ["Really?", "Yes!", "Ok"]),
+])
+def test_sentence_ends(text, expected):
+    assert _sentences(text) == expected
+
+
+def test_first_chunk_splits_at_clause():
+    chunker = TextChunker(first_chunk_min_words=4)
+    assert chunker.split("Sure, I can book that for you, what time works") == (
+        "Sure, I can book that for you,", "what time works")
+    # Back to whole sentences after the first chunk.
+    assert chunker.split("what time works, morning or afternoon") is None
+
+
+def test_first_chunk_waits_for_min_words():
+    chunker = TextChunker(first_chunk_min_words=4)
+    assert chunker.split("Sure, I can") is None
@@ -0,0 +1,35 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+
+from custom_services.tts_cache import CachedAudio, TTSCache
+
+
+def test_flush_waits_for_disk_writes(tmp_path):
+    async def run():
+        cache = TTSCache(directory=str(tmp_path))
+        cache.put("greeting", CachedAudio(audio=b"\x01\x02", words=[("Hello", 0.5)]))
+        await cache.flush()
+        assert cache.stats()["pending_writes"] == 0
+
+        # Another worker finds it on disk.
+        other = TTSCache(directory=str(tmp_path))
+        return await other.get("greeting")
+
+    entry = asyncio.run(run())
+    assert entry == CachedAudio(audio=b"\x01\x02", words=[("Hello", 0.5)])
+
+
+def test_failed_write_is_not_left_pending(tmp_path):
+    async def run():
+        cache = TTSCache(directory=str(tmp_path))
+        # Words that can't be encoded fail the write before it starts.
+        cache.put("greeting", CachedAudio(audio=b"\x01\x02", words=[(object(), 0.5)]))
+        await cache.flush()
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.stats()["pending_writes"] == 0
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,142 @@
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("pipecat")
+
+from pipecat.frames.frames import (
+    AudioRawFrame,
+    LLMFullResponseEndFrame,
+    MetricsFrame,
+    StartInterruptionFrame,
+    TextFrame,
+    TTSSpeakFrame)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.services.ai_services import TTSService
+
+from custom_services.tts_prefetch import TTSPrefetchMixin
+
+
+class FakeTTSService(TTSPrefetchMixin, TTSService):
+    """Returns one audio frame per sentence after `delays[text]` seconds."""
+
+    def __init__(self, delays, **kwargs):
+        super().__init__(**kwargs)
+        self._delays = delays
+        self._enable_metrics = True
+        self.cancelled = []
+
+    def can_generate_metrics(self) -> bool:
+        return True
+
+    async def set_voice(self, voice: str):
+        pass
+
+    async def run_tts(self, text: str):
+        await self.start_ttfb_metrics()
+        try:
+            await asyncio.sleep(self._delays[text])
+        except asyncio.CancelledError:
+            self.cancelled.append(text)
+            raise
+        await self.stop_ttfb_metrics()
+        yield AudioRawFrame(audio=text.encode(), sample_rate=16000, num_channels=1)
+
+
+class Collector(FrameProcessor):
+
+    def __init__(self):
+        super().__init__()
+        self.frames = []
+        self.response_ended = asyncio.Event()
+
+    async def process_frame(self, frame, direction):
+        self.frames.append(frame)
+        if isinstance(frame, LLMFullResponseEndFrame):
+            self.response_ended.set()
+
+
+async def _make_tts(delays):
+    tts = FakeTTSService(delays, prefetch_depth=2)
+    collector = Collector()
+    tts.link(collector)
+    return tts, collector
+
+
+async def _respond(tts, collector, *texts):
+    collector.response_ended.clear()
+    for text in texts:
+        await tts.process_frame(TextFrame(text), FrameDirection.DOWNSTREAM)
+    await tts.process_frame(LLMFullResponseEndFrame(), FrameDirection.DOWNSTREAM)
+    await asyncio.wait_for(collector.response_ended.wait(), timeout=2)
+
+
+def _describe(frame):
+    if isinstance(frame, MetricsFrame):
+        return "ttfb" if frame.ttfb else "processing"
+    if isinstance(frame, AudioRawFrame):
+        return f"audio {frame.audio.decode()}"
+    if isinstance(frame, TextFrame):
+        return f"text {frame.text}"
+    return type(frame).__name__
+
+
+def _sentence_frames(text, passthrough=True):
+    frames = ["TTSStartedFrame", "ttfb", f"audio {text}", "processing", "TTSStoppedFrame"]
+    return frames + [f"text {text}"] if passthrough else frames
+
+
+def test_sentences_keep_order_and_frame_sequence():
+    async def run():
+        # The second sentence is ready long before the first.
+        tts, collector = await _make_tts({"One two three.": 0.2, "Four five.": 0.01})
+        await _respond(tts, collector, "One two three. ", "Four five.")
+        return collector.frames
+
+    frames = asyncio.run(run())
+    assert [_describe(f) for f in frames] == (
+        _sentence_frames("One two three.") +
+        _sentence_frames("Four five.") +
+        ["LLMFullResponseEndFrame"])
+
+    # Concurrent sentences get their own TTFB.
+    first, second = [f.ttfb[0]["value"] for f in frames if isinstance(f, MetricsFrame) and f.ttfb]
+    assert first >= 0.2
+    assert second < 0.1
+
+
+def test_speak_frame_is_not_passed_through():
+    async def run():
+        tts, collector = await _make_tts({"Hello there.": 0.01})
+        await tts.process_frame(TTSSpeakFrame("Hello there."), FrameDirection.DOWNSTREAM)
+        await _respond(tts, collector)
+        return collector.frames
+
+    frames = asyncio.run(run())
+    assert [_describe(f) for f in frames] == (
+        _sentence_frames("Hello there.", passthrough=False) + ["LLMFullResponseEndFrame"])
+
+
+def test_interruption_drops_sentences_in_flight():
+    async def run():
+        tts, collector = await _make_tts({"One two three.": 0.3, "Four five.": 0.3, "Six.": 0.01})
+        await tts.process_frame(TextFrame("One two three. "), FrameDirection.DOWNSTREAM)
+        await tts.process_frame(TextFrame("Four five. "), FrameDirection.DOWNSTREAM)
+        await asyncio.sleep(0.05)
+        await tts.process_frame(StartInterruptionFrame(), FrameDirection.DOWNSTREAM)
+        await asyncio.sleep(0)
+        interrupted_at = len(collector.frames)
+        await _respond(tts, collector, "Six.")
+        return tts, collector.frames, interrupted_at
+
+    tts, frames, interrupted_at = asyncio.run(run())
+    assert sorted(tts.cancelled) == ["Four five.", "One two three."]
+    # Only the start of the first sentence made it downstream, like with
+    # TTSService interrupted in the middle of `run_tts`.
+    assert [_describe(f) for f in frames[:interrupted_at]] == ["TTSStartedFrame", "StartInterruptionFrame"]
+    assert [_describe(f) for f in frames[interrupted_at:]] == (
+        _sentence_frames("Six.") + ["LLMFullResponseEndFrame"])